@@ -3,13 +3,20 @@ import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import io
 import time
-import re
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
+from kho_core import (SheetCache, apply_schema, concat_frames, no_accent_vietnamese, to_strings, voucher_rows,
+                      voucher_shortages)
+from kho_gsheet import (SHARD_COLUMNS, SHARD_DIRECTORY, SHARD_SCHEMA, SHARD_TOTALS, TOTALS_COLUMNS, TOTALS_SCHEMA,
+                        active_shard, append_records, append_with_rollover, is_shard, shards_in_range, totals_as_journal,
+                        worksheet_or_create)
+from kho_fakesheets import fake_client_from_env
+from kho_quota import rate_limited
+from kho_report import build_xnt_report
 
 # --- 1. CẤU HÌNH GOOGLE SHEETS ---
 SCOPE = ["https://www.googleapis.com/auth/spreadsheets"]
@@ -19,77 +26,145 @@ ADMIN_PASSWORD = "2605"
 
 @st.cache_resource
 def get_gsheet_client():
-    creds = Credentials.from_service_account_file("credentials.json", scopes=SCOPE)
-    return gspread.authorize(creds)
+    # KHO_FAKE_SHEETS: Google Sheets giả trong bộ nhớ (load test, benchmark, CI), không cần credentials
+    client = fake_client_from_env()
+    if client is None:
+        client = gspread.authorize(Credentials.from_service_account_file("credentials.json", scopes=SCOPE))
+    # Giới hạn hạn mức dùng chung: chờ slot, backoff khi 429, gộp các lệnh đọc trùng nhau từ nhiều phiên
+    return rate_limited(client)
 
 
-@st.cache_data(ttl=15)
-def load_data_from_gsheet(sheet_name):
+COLS_MAP = {
+    "danhmuc_qua": ["MaQua", "TenQua"],
+    "nhatky_xuatnhap": ["Loai", "Ngay", "MaQua", "TenQua", "SoLuong", "SoChungTu", "NguoiThucHien", "GhiChu"],
+    SHARD_DIRECTORY: SHARD_COLUMNS,
+    SHARD_TOTALS: TOTALS_COLUMNS
+}
+
+
+def fetch_sheet(sheet_name):
+    client = get_gsheet_client()
+    sh = client.open_by_key(SHEET_ID)
+    target_cols = COLS_MAP["nhatky_xuatnhap" if is_shard("nhatky_xuatnhap", sheet_name) else sheet_name]
     try:
-        client = get_gsheet_client()
-        sh = client.open_by_key(SHEET_ID)
         worksheet = sh.worksheet(sheet_name)
-        data = worksheet.get_all_values()
+    except gspread.WorksheetNotFound:
+        # Danh mục / tổng shard chỉ có sau lần chia shard đầu tiên
+        return pd.DataFrame(columns=target_cols)
+    return frame_for(sheet_name, worksheet.get_all_values())
+
+
+def frame_for(sheet_name, data):
+    # Dựng DF đã làm sạch + ép kiểu từ giá trị thô của sheet (dùng cả khi tải lẫn khi đặt dữ liệu vừa ghi vào bộ đệm)
+    is_journal = is_shard("nhatky_xuatnhap", sheet_name)
+    target_cols = COLS_MAP["nhatky_xuatnhap" if is_journal else sheet_name]
+    if not data or len(data) < 1:
+        return pd.DataFrame(columns=target_cols)
 
-        cols_map = {
-            "danhmuc_qua": ["MaQua", "TenQua"],
-            "nhatky_xuatnhap": ["Loai", "Ngay", "MaQua", "TenQua", "SoLuong", "SoChungTu", "NguoiThucHien", "GhiChu"]
-        }
-        target_cols = cols_map[sheet_name]
+    # Tạo DF và làm sạch tiêu đề/index ngay từ đầu
+    df = pd.DataFrame(data[1:], columns=[str(c).strip() for c in data[0]])
+    df = df.loc[:, ~df.columns.duplicated()].copy()
 
-        if not data or len(data) < 1:
-            return pd.DataFrame(columns=target_cols)
+    if "MaQua" in df.columns:
+        df = df[df["MaQua"].str.strip() != ""]
 
-        # Tạo DF và làm sạch tiêu đề/index ngay từ đầu
-        df = pd.DataFrame(data[1:], columns=[str(c).strip() for c in data[0]])
-        df = df.loc[:, ~df.columns.duplicated()].copy()
+    available_cols = [c for c in target_cols if c in df.columns]
+    df = df[available_cols].reset_index(drop=True)
+    # Nhật ký được ép kiểu một lần ở đây (SoLuong int32, Ngay datetime, các cột lặp lại dạng category)
+    if is_journal: return apply_schema(df)
+    schema = {SHARD_DIRECTORY: SHARD_SCHEMA, SHARD_TOTALS: TOTALS_SCHEMA}.get(sheet_name)
+    return apply_schema(df, schema) if schema else df
 
-        if "MaQua" in df.columns:
-            df = df[df["MaQua"].str.strip() != ""]
 
-        available_cols = [c for c in target_cols if c in df.columns]
-        return df[available_cols].reset_index(drop=True)
+@st.cache_resource
+def get_sheet_cache():
+    # Bộ đệm dùng chung cho mọi phiên, phiên bản riêng theo từng sheet: ghi vào sheet nào chỉ làm mới sheet đó
+    return SheetCache(ttl=15)
+
+
+def load_data_from_gsheet(sheet_name):
+    try:
+        return get_sheet_cache().get(sheet_name, lambda name, prev: (fetch_sheet(name), None))
     except Exception as e:
-        st.error(f"Lỗi tải dữ liệu: {e}")
-        return pd.DataFrame()
+        # Hết hạn mức (429) / lỗi mạng: dùng bản cũ thay vì bảng rỗng (tồn về 0, danh mục trống)
+        df = get_sheet_cache().stale(sheet_name)
+        if df is None:
+            st.error(f"Lỗi tải dữ liệu: {e}")
+            return pd.DataFrame()
+        st.warning("⚠️ Google Sheets đang giới hạn truy cập, tạm hiển thị dữ liệu cũ")
+        return df
 
 
 def save_data_to_gsheet(df, sheet_name):
     client = get_gsheet_client()
     sh = client.open_by_key(SHEET_ID)
-    worksheet = sh.worksheet(sheet_name)
-    df_save = df.reset_index(drop=True).astype(str)
+    worksheet = worksheet_or_create(sh, sheet_name, len(df.columns))
+    df_save = to_strings(df)
+    values = [df_save.columns.values.tolist()] + df_save.values.tolist()
     worksheet.clear()
-    worksheet.update([df_save.columns.values.tolist()] + df_save.values.tolist())
-    st.cache_data.clear()
+    worksheet.update(values)
+    # Đặt lại đúng dữ liệu vừa ghi vào bộ đệm, không xóa bộ đệm của các sheet khác
+    get_sheet_cache().put(sheet_name, frame_for(sheet_name, values))
 
 
-# --- 2. HÀM TIỆN ÍCH (ĐỊNH NGHĨA TRƯỚC KHI DÙNG) ---
-def no_accent_vietnamese(s):
-    s = str(s)
-    patterns = {'[àáạảãâầấậẩẫăằắặẳẵ]': 'a', '[èéẹẻẽêềếệểễ]': 'e', '[òóọỏõôồốộổỗơờớợởỡ]': 'o', '[ìíịỉĩ]': 'i',
-                '[ùúụủũưừứựửữ]': 'u', '[ỳýỵỷỹ]': 'y', '[đ]': 'd'}
-    for p, r in patterns.items():
-        s = re.sub(p, r, s);
-        s = re.sub(p.upper(), r.upper(), s)
-    return s
+def append_gifts(gifts):
+    # Quà mới chỉ nối thêm dòng vào danh mục bằng một lệnh append; ghi lại cả sheet chỉ dành cho Restore/Reset
+    worksheet = worksheet_or_create(get_gsheet_client().open_by_key(SHEET_ID), "danhmuc_qua", 2)
+    header, new_values, _ = append_records(worksheet, gifts)
+    get_sheet_cache().append("danhmuc_qua", frame_for("danhmuc_qua", [header] + new_values))
 
 
+# --- 2. HÀM TIỆN ÍCH (ĐỊNH NGHĨA TRƯỚC KHI DÙNG) ---
 def generate_new_gift_code():
     df_g = load_data_from_gsheet("danhmuc_qua")
-    if df_g.empty: return "QT0001"
-    # Lấy các mã có định dạng QTxxxx
-    codes = [c for c in df_g['MaQua'].astype(str) if c.startswith("QT") and c[2:].isdigit()]
+    # Lấy các mã có định dạng QTxxxx, kể cả quà mới đang chờ trong phiếu nhập
+    codes = df_g['MaQua'].astype(str).tolist() if not df_g.empty else []
+    codes += [l["MaQua"] for l in st.session_state.get("cart_NHẬP", [])]
+    codes = [c for c in codes if c.startswith("QT") and c[2:].isdigit()]
     if not codes: return "QT0001"
     nums = [int(c[2:]) for c in codes]
     return f"QT{(max(nums) + 1):04d}"
 
 
+def load_journal(d1=None, d2=None, totals=True):
+    # Chỉ đọc các shard nhật ký giao với [d1, d2]. Shard đã đóng hẳn trước d1 được thay bằng tổng theo MaQua
+    # (totals=True, đủ cho tồn kho và Tồn đầu) hoặc bỏ qua (totals=False).
+    df_dir = load_data_from_gsheet(SHARD_DIRECTORY)
+    names, closed = shards_in_range(df_dir, "nhatky_xuatnhap", d1, d2)
+    parts = [load_data_from_gsheet(name) for name in names]
+    if totals and closed:
+        parts.insert(0, totals_as_journal(load_data_from_gsheet(SHARD_TOTALS), df_dir, "nhatky_xuatnhap", closed))
+    return concat_frames(parts)
+
+
+def append_journal_rows(new_t):
+    # Ghi các dòng mới vào shard đang ghi bằng một lệnh append (một lần ghi cho cả phiếu); shard đầy thì
+    # kho_gsheet.append_with_rollover đóng lại (ghi tổng theo MaQua + khoảng ngày vào danh mục shard) và mở shard mới
+    df_dir = load_data_from_gsheet(SHARD_DIRECTORY)
+    active = active_shard(df_dir, "nhatky_xuatnhap")
+    df_dir, written, header, new_values, _ = append_with_rollover(
+        get_gsheet_client().open_by_key(SHEET_ID), "nhatky_xuatnhap", to_strings(new_t).to_dict("records"),
+        df_dir, len(load_data_from_gsheet(active)))
+    # Chỉ nối các dòng vừa ghi vào bộ đệm của shard được ghi; vừa mở shard mới thì làm mới danh mục và tổng shard
+    if written != active:
+        get_sheet_cache().put(SHARD_DIRECTORY, df_dir)
+        get_sheet_cache().invalidate(SHARD_TOTALS)
+    get_sheet_cache().append(written, frame_for(written, [header] + new_values))
+
+
 def get_current_stock(ma_qua):
-    df_t = load_data_from_gsheet("nhatky_xuatnhap")
+    # Tồn kho chỉ cần shard đang ghi + tổng của các shard đã đóng
+    df_t = load_journal(date.today() + timedelta(days=1))
     if df_t.empty: return 0
-    df_t['SoLuong'] = pd.to_numeric(df_t['SoLuong'], errors='coerce').fillna(0)
-    return df_t[df_t["MaQua"].astype(str) == str(ma_qua)]["SoLuong"].sum()
+    return int(df_t.loc[df_t["MaQua"] == str(ma_qua), "SoLuong"].sum())
+
+
+def get_stock_snapshot(ma_list):
+    # Tồn của nhiều mã từ cùng một lần tải nhật ký
+    df_t = load_journal(date.today() + timedelta(days=1))
+    if df_t.empty: return {str(m): 0 for m in ma_list}
+    ton = df_t['SoLuong'].astype("int64").groupby(df_t['MaQua'].astype(str)).sum()
+    return {str(m): int(ton.get(str(m), 0)) for m in ma_list}
 
 
 def export_pdf_reportlab(df, date_range):
@@ -144,7 +219,7 @@ with st.sidebar:
         pwd = st.text_input("Mật khẩu", type="password")
         if pwd == ADMIN_PASSWORD:
             if st.button("📤 Tải Backup Excel", use_container_width=True):
-                dg, dt = load_data_from_gsheet("danhmuc_qua"), load_data_from_gsheet("nhatky_xuatnhap")
+                dg, dt = load_data_from_gsheet("danhmuc_qua"), load_journal()
                 buf = io.BytesIO()
                 with pd.ExcelWriter(buf) as wr:
                     dg.to_excel(wr, sheet_name='DM', index=False);
@@ -160,6 +235,8 @@ def render_form(type_f="XUẤT"):
     if f"ma_{type_f}" not in st.session_state: st.session_state[f"ma_{type_f}"] = ""
     if f"ten_{type_f}" not in st.session_state: st.session_state[f"ten_{type_f}"] = ""
     if f"show_list_{type_f}" not in st.session_state: st.session_state[f"show_list_{type_f}"] = False
+    if f"cart_{type_f}" not in st.session_state: st.session_state[f"cart_{type_f}"] = []
+    voucher = st.toggle("🧾 Phiếu nhiều dòng", key=f"voucher_{type_f}")
 
     st.markdown(f"🔍 **Tìm quà ({type_f}):**")
     c1, c2 = st.columns([3, 1])
@@ -215,30 +292,65 @@ def render_form(type_f="XUẤT"):
             st.info(f"🎁 {curr_ten} - 📊 Tồn: {ton}")
 
         with st.form(f"form_{type_f}"):
-            so_ct = st.text_input("Số chứng từ *")
+            so_ct = "" if voucher else st.text_input("Số chứng từ *")
             sl = st.number_input("Số lượng *", min_value=1, step=1)
             note = st.text_input("Ghi chú")
-            if st.form_submit_button(f"XÁC NHẬN {type_f}", use_container_width=True):
+            if voucher:
+                # Chỉ thêm dòng vào phiếu, chưa ghi gì lên Google
+                if st.form_submit_button("➕ Thêm vào phiếu", use_container_width=True):
+                    st.session_state[f"cart_{type_f}"].append({"MaQua": curr_ma, "TenQua": curr_ten,
+                                                               "SoLuong": int(sl), "GhiChu": note})
+                    st.session_state[f"ma_{type_f}"] = "";
+                    st.rerun()
+            elif st.form_submit_button(f"XÁC NHẬN {type_f}", use_container_width=True):
                 if so_ct:
                     # Lưu nhật ký
-                    df_t = load_data_from_gsheet("nhatky_xuatnhap")
                     new_t = pd.DataFrame([{"Loai": type_f, "Ngay": date.today().strftime("%Y-%m-%d"), "MaQua": curr_ma,
                                            "TenQua": curr_ten, "SoLuong": sl if type_f == "NHẬP" else -sl,
                                            "SoChungTu": so_ct, "NguoiThucHien": st.session_state['user_info']['name'],
                                            "GhiChu": note}])
-                    save_data_to_gsheet(pd.concat([df_t.reset_index(drop=True), new_t], ignore_index=True),
-                                        "nhatky_xuatnhap")
+                    append_journal_rows(new_t)
                     # Lưu danh mục nếu mới
-                    if is_new:
-                        df_g_now = load_data_from_gsheet("danhmuc_qua")
-                        save_data_to_gsheet(pd.concat(
-                            [df_g_now.reset_index(drop=True), pd.DataFrame([{"MaQua": curr_ma, "TenQua": curr_ten}])],
-                            ignore_index=True), "danhmuc_qua")
+                    if is_new: append_gifts([{"MaQua": curr_ma, "TenQua": curr_ten}])
                     st.success("✅ Thành công!");
                     time.sleep(1)
                     st.session_state[f"ma_{type_f}"] = "";
                     st.rerun()
 
+    if voucher and st.session_state[f"cart_{type_f}"]: render_voucher(type_f, df_g)
+
+
+def render_voucher(type_f, df_g):
+    # Phiếu nhiều dòng cùng một Số chứng từ: cả phiếu chỉ tốn một lần ghi nhật ký (và một lần ghi danh mục nếu có quà mới)
+    cart = st.session_state[f"cart_{type_f}"]
+    st.markdown(f"🧾 **Phiếu {type_f}: {len(cart)} dòng**")
+    st.dataframe(pd.DataFrame(cart), use_container_width=True, hide_index=True)
+    so_ct = st.text_input("Số chứng từ *", key=f"so_ct_{type_f}")
+    c1, c2 = st.columns([3, 1])
+    if c2.button("🗑️ Hủy phiếu", key=f"clear_{type_f}", use_container_width=True):
+        cart.clear();
+        st.rerun()
+    if c1.button(f"XÁC NHẬN PHIẾU {type_f}", key=f"post_{type_f}", type="primary", use_container_width=True):
+        if not so_ct:
+            st.error("❌ Chưa nhập Số chứng từ!")
+            return
+        if type_f == "XUẤT":
+            # Kiểm tra tồn của mọi dòng trên cùng một lần tải nhật ký
+            short = voucher_shortages(cart, get_stock_snapshot([l["MaQua"] for l in cart]))
+            if short:
+                st.error("❌ Không đủ tồn: " + "; ".join(f"{ma} cần {n}, tồn {ton}" for ma, n, ton in short))
+                return
+        append_journal_rows(pd.DataFrame(voucher_rows(cart, type_f, so_ct, date.today().strftime("%Y-%m-%d"),
+                                                      st.session_state['user_info']['name'])))
+        known = set(df_g['MaQua'].astype(str)) if not df_g.empty else set()
+        new_gifts = list({l["MaQua"]: {"MaQua": l["MaQua"], "TenQua": l["TenQua"]} for l in cart
+                          if l["MaQua"] not in known}.values())
+        if new_gifts: append_gifts(new_gifts)
+        cart.clear();
+        st.success("✅ Thành công!");
+        time.sleep(1)
+        st.rerun()
+
 
 with tabs[0]: render_form("XUẤT")
 with tabs[1]: render_form("NHẬP")
@@ -249,24 +361,10 @@ with tabs[2]:
     d1 = c1.date_input("Từ ngày", date(date.today().year, date.today().month, 1), key="d1")
     d2 = c2.date_input("Đến ngày", date.today(), key="d2")
     if st.button("Chạy báo cáo", type="primary"):
-        df_t = load_data_from_gsheet("nhatky_xuatnhap")
+        df_t = load_journal(d1, d2)
         df_g = load_data_from_gsheet("danhmuc_qua")
         if not df_t.empty:
-            df_t['Ngay'] = pd.to_datetime(df_t['Ngay']).dt.date
-            df_t['SoLuong'] = pd.to_numeric(df_t['SoLuong'])
-            res = []
-            for _, item in df_g.iterrows():
-                m, t = item['MaQua'], item['TenQua']
-                t_dau = df_t[(df_t['MaQua'] == m) & (df_t['Ngay'] < d1)]['SoLuong'].sum()
-                nhap = \
-                df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "NHẬP") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                    'SoLuong'].sum()
-                xuat = abs(
-                    df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "XUẤT") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                        'SoLuong'].sum())
-                res.append(
-                    {"Mã": m, "Tên": t, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat, "Tồn cuối": t_dau + nhap - xuat})
-            st.session_state['report_df'] = pd.DataFrame(res)
+            st.session_state['report_df'] = build_xnt_report(df_g, df_t, d1, d2)
 
     if 'report_df' in st.session_state:
         st.dataframe(st.session_state['report_df'], use_container_width=True, hide_index=True)
@@ -278,4 +376,11 @@ with tabs[2]:
                            use_container_width=True)
 
 with tabs[3]:
-    st.dataframe(load_data_from_gsheet("nhatky_xuatnhap").iloc[::-1], use_container_width=True)
\ No newline at end of file
+    c1, c2 = st.columns(2)
+    n1 = c1.date_input("Từ ngày", (date.today().replace(day=1) - timedelta(days=1)).replace(day=1), key="nk_d1")
+    n2 = c2.date_input("Đến ngày", date.today(), key="nk_d2")
+    df_nk = load_journal(n1, n2, totals=False)
+    if not df_nk.empty:
+        ngay = df_nk['Ngay'].dt.normalize()
+        df_nk = df_nk[(ngay >= pd.Timestamp(n1)) & (ngay <= pd.Timestamp(n2))]
+    st.dataframe(df_nk.iloc[::-1], use_container_width=True)
\ No newline at end of file
@@ -4,21 +4,57 @@ import gspread
 from google.oauth2.service_account import Credentials
 import extra_streamlit_components as stx
 from datetime import datetime, date, timedelta
-import io
+import os
+import threading
 import time
-import re
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+from kho_core import (BALANCE_COLUMNS, BALANCE_SCHEMA, JOURNAL_COLUMNS, JOURNAL_SCHEMA, BalanceIndex,
+                      GiftSearchIndex, ReportCache, SheetCache, StockBalance, apply_schema, concat_frames, to_strings,
+                      voucher_rows, voucher_shortages)
+from kho_export import export_backup, export_excel_report, export_pdf_report
+from kho_gsheet import (SHARD_COLUMNS, SHARD_DIRECTORY, SHARD_MAX_ROWS, SHARD_SCHEMA, SHARD_TOTALS, TOTALS_COLUMNS,
+                        TOTALS_SCHEMA, active_shard, advance_watermark, append_records, append_with_rollover,
+                        fetch_incremental, fetch_many, frame_from_values, is_shard, shard_directory, shards_in_range,
+                        split_shards, totals_as_journal, values_from_frame)
+from kho_import import IMPORT_CHUNK_ROWS, REJECT_COLUMN, chunks, read_import_file, validate_import
+from kho_fakesheets import FAKE_ENV, fake_client_from_env
+from kho_perf import PerfLog, count_api_calls, timed, timed_fn
+from kho_quota import limiter_of, rate_limited
+from kho_writeback import SYNC_ID, WriteBehind, unsynced_rows
+import kho_sqlite
+from kho_report import (balance_as_journal, build_xnt_report, close_period, closing_dates, unarchived_rows,
+                        xnt_report_from_index)
 
 # --- 1. CẤU HÌNH HỆ THỐNG ---
 SHEET_ID = "1Q1JmyrwjySDpoaUcjc1Wr5S40Oju9lHGK_Q9rv58KAg"
 ADMIN_PASSWORD = "2605"
 SCOPE = ["https://www.googleapis.com/auth/spreadsheets"]
+# Số dư chốt sổ và các sheet lưu trữ nhật ký đã chốt theo năm (nhatky_2024, nhatky_2025, ...)
+SODU_SHEET = "sodu_chotso"
+ARCHIVE_PREFIX = "nhatky_"
+# Nhật ký được ép kiểu ngay khi tải (SoLuong int32, Ngay datetime, Loai/MaQua/NguoiThucHien category)
+SHEET_SCHEMAS = {SODU_SHEET: BALANCE_SCHEMA, SHARD_DIRECTORY: SHARD_SCHEMA, SHARD_TOTALS: TOTALS_SCHEMA}
+# Bảng hiệu năng (admin): số lượt chạy gần nhất hiển thị, và file JSON-lines khi bật ghi log
+PERF_PANEL_RUNS = 20
+PERF_LOG_FILE = "perf_log.jsonl"
+# Hàng đợi ghi nhật ký: mọi giao dịch ghi vào JOURNAL_WAL_FILE trên đĩa trước, rồi được gom từ mọi phiên và ghi
+# lên Google bằng một lệnh append sau WRITE_BEHIND_SECONDS giây hoặc khi đủ WRITE_BEHIND_MAX_ROWS dòng; mất kết nối
+# thì nằm lại trong WAL và tự đồng bộ khi có mạng trở lại
+WRITE_BEHIND_SECONDS = 1.0
+WRITE_BEHIND_MAX_ROWS = 500
+JOURNAL_WAL_FILE = "nhatky_wal.jsonl"
+# Bản sao cục bộ (SQLite) các sheet đã tải, dùng khi khởi động lúc không kết nối được Google; cập nhật tối đa
+# mỗi REPLICA_SECONDS giây một lần cho mỗi sheet
+REPLICA_DB = "kho_ban_sao.db"
+REPLICA_SECONDS = 10
+# Các sheet đang hiển thị bằng bản cũ trong lượt chạy này (Google từ chối vì hết hạn mức)
+STALE_SHEETS = set()
 
 st.set_page_config(page_title="Kho Quà Vườn Xuân TNF", layout="wide")
 
 # --- 2. XỬ LÝ CREDENTIALS ---
-if "gcp_service_account" in st.secrets:
+if os.environ.get(FAKE_ENV):
+    CREDS_DATA = {}  # Google Sheets giả trong bộ nhớ (kho_fakesheets), không cần credentials
+elif "gcp_service_account" in st.secrets:
     CREDS_DATA = dict(st.secrets["gcp_service_account"])
 else:
     import json
@@ -34,34 +70,385 @@ else:
 # --- 3. QUẢN LÝ KẾT NỐI ---
 @st.cache_resource
 def get_gsheet_client(creds_info):
-    creds = Credentials.from_service_account_info(creds_info, scopes=SCOPE)
-    return gspread.authorize(creds)
+    # KHO_FAKE_SHEETS: Google Sheets giả trong bộ nhớ (load test, benchmark, CI)
+    client = fake_client_from_env()
+    if client is None: client = gspread.authorize(Credentials.from_service_account_info(creds_info, scopes=SCOPE))
+    # Mọi request tới Google Sheets được đếm vào lượt chạy hiện tại (bảng hiệu năng), rồi đi qua bộ giới hạn
+    # hạn mức dùng chung (chờ slot, backoff khi 429, gộp các lệnh đọc trùng nhau từ nhiều phiên)
+    return rate_limited(count_api_calls(client))
+
+
+@st.cache_resource
+def get_spreadsheet(creds_info):
+    return get_gsheet_client(creds_info).open_by_key(SHEET_ID)
+
+
+@st.cache_resource
+def get_worksheet(sheet_name, creds_info):
+    # Giữ sẵn handle của Spreadsheet/Worksheet: bỏ 2 lượt gọi metadata (open_by_key, worksheet) mỗi lần đọc/ghi
+    return get_spreadsheet(creds_info).worksheet(sheet_name)
+
+
+@st.cache_resource
+def get_sheet_cache():
+    # Bộ đệm dùng chung theo từng worksheet (TTL 15 giây, có phiên bản riêng cho mỗi sheet)
+    return SheetCache(ttl=15)
+
+
+@st.cache_resource
+def get_perf_log():
+    # Thời gian từng lượt chạy lại + số lệnh gọi API, dùng chung cho cả tiến trình
+    return PerfLog()
+
+
+def archive_sheet(year):
+    return f"{ARCHIVE_PREFIX}{year}"
+
+
+def is_archive_sheet(sheet_name):
+    return sheet_name.startswith(ARCHIVE_PREFIX) and sheet_name[len(ARCHIVE_PREFIX):].isdigit()
+
+
+def is_journal_sheet(sheet_name):
+    return is_shard("nhatky_xuatnhap", sheet_name)
+
+
+def sheet_schema(sheet_name):
+    if is_journal_sheet(sheet_name) or is_archive_sheet(sheet_name): return JOURNAL_SCHEMA
+    return SHEET_SCHEMAS.get(sheet_name)
+
+
+def ensure_worksheet(sheet_name, creds_info, cols):
+    # Sheet số dư / lưu trữ chỉ được tạo ở lần chốt sổ đầu tiên
+    try:
+        return get_worksheet(sheet_name, creds_info)
+    except gspread.WorksheetNotFound:
+        get_spreadsheet(creds_info).add_worksheet(title=sheet_name, rows=1000, cols=cols)
+        return get_worksheet(sheet_name, creds_info)
+
+
+def fetch_sheet(sheet_name, creds_info, prev=None):
+    try:
+        worksheet = get_worksheet(sheet_name, creds_info)
+    except gspread.WorksheetNotFound:
+        # Chưa chốt sổ / chưa chia shard lần nào: coi như bảng rỗng (giữ trong bộ đệm để không hỏi lại Google mỗi lượt)
+        empty = {SODU_SHEET: BALANCE_COLUMNS, SHARD_DIRECTORY: SHARD_COLUMNS, SHARD_TOTALS: TOTALS_COLUMNS}
+        if sheet_name in empty: return pd.DataFrame(columns=empty[sheet_name]), None
+        raise
+    if is_journal_sheet(sheet_name):
+        # Shard đã đóng không đổi nữa: giữ bản trong bộ đệm, không tải lại
+        if prev is not None and sheet_name != active_shard(load_data_from_gsheet(SHARD_DIRECTORY, creds_info),
+                                                           "nhatky_xuatnhap"):
+            return prev
+        # Nhật ký chủ yếu chỉ ghi thêm: tải nối tiếp các dòng mới thay vì get_all_values toàn bộ
+        return fetch_incremental(worksheet, prev, sheet_schema(sheet_name))
+    return frame_from_values(worksheet.get_all_values(), sheet_schema(sheet_name)), None
+
+
+def read_sheet(sheet_name, creds_info):
+    # Như load_data_from_gsheet nhưng lỗi thì báo lỗi (không dùng bản cũ): dùng cho các lần ghi
+    with timed(f"tải {sheet_name}"):
+        return get_sheet_cache().get(sheet_name, lambda name, prev: fetch_sheet(name, creds_info, prev))
 
 
-@st.cache_data(ttl=15)
 def load_data_from_gsheet(sheet_name, creds_info):
     try:
-        client = get_gsheet_client(creds_info)
-        sh = client.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet(sheet_name)
-        data = worksheet.get_all_values()
-        if not data or len(data) < 1: return pd.DataFrame()
-        df = pd.DataFrame(data[1:], columns=[str(c).strip() for c in data[0]])
-        df = df.loc[:, ~df.columns.duplicated()].copy()
-        if "MaQua" in df.columns: df = df[df["MaQua"].str.strip() != ""]
-        return df.reset_index(drop=True)
+        df = read_sheet(sheet_name, creds_info)
+    except Exception:
+        # Hết hạn mức (429) / mất kết nối: dùng bản cũ trong bộ đệm, rồi tới bản sao cục bộ, thay vì bảng rỗng
+        # (tồn về 0, danh mục trống)
+        df = get_sheet_cache().stale(sheet_name)
+        if df is None: df = read_replica(sheet_name)
+        if df is None: return pd.DataFrame()
+        if not STALE_SHEETS: st.toast("⚠️ Không tải được từ Google Sheets, tạm dùng dữ liệu cũ")
+        STALE_SHEETS.add(sheet_name)
+        return df.copy()
+    update_replica(sheet_name, df)
+    return df
+
+
+@st.cache_resource
+def get_replica_state():
+    # saved: {tên sheet: (phiên bản trong bộ đệm, thời điểm)} của lần ghi bản sao cục bộ gần nhất (giữ bằng lock, dùng
+    # chung mọi phiên); write: mỗi lần chỉ một luồng nền ghi file SQLite
+    return {"lock": threading.Lock(), "write": threading.Lock(), "saved": {}}
+
+
+def _save_replica(sheet_name, df):
+    state = get_replica_state()
+    with state["write"]:
+        kho_sqlite.save_replica(REPLICA_DB, sheet_name, to_strings(df))
+
+
+def update_replica(sheet_name, df):
+    # Ghi bản sao ở luồng nền (cả bước chuyển sang chuỗi), chỉ khi sheet đã đổi và lần ghi trước đã quá
+    # REPLICA_SECONDS giây
+    state, version = get_replica_state(), get_sheet_cache().version(sheet_name)
+    with state["lock"]:
+        saved = state["saved"].get(sheet_name)
+        if saved and (saved[0] == version or time.monotonic() - saved[1] < REPLICA_SECONDS): return
+        state["saved"][sheet_name] = (version, time.monotonic())
+    threading.Thread(target=_save_replica, args=(sheet_name, df.copy()), daemon=True).start()
+
+
+def read_replica(sheet_name):
+    # Bản sao cục bộ mới nhất trên đĩa; chỉ đọc lại file khi nó đã được ghi lại (khóa theo mtime)
+    try:
+        mtime = os.path.getmtime(REPLICA_DB)
+    except OSError:
+        return None
+    return _read_replica(sheet_name, mtime)
+
+
+@st.cache_resource(max_entries=32)
+def _read_replica(sheet_name, mtime):
+    df = kho_sqlite.load_replica(REPLICA_DB, sheet_name)
+    if df is None or sheet_schema(sheet_name) is None: return df
+    return apply_schema(df, sheet_schema(sheet_name))
+
+
+def prefetch_sheets(sheet_names, creds_info):
+    # Khi bộ đệm còn trống, tải tất cả các sheet cần thiết trong một lệnh batch duy nhất
+    try:
+        get_sheet_cache().prefetch(sheet_names, lambda names: fetch_many(get_spreadsheet(creds_info), names,
+                                                                         incremental=list(filter(is_journal_sheet,
+                                                                                                 names)),
+                                                                         schemas={n: sheet_schema(n) for n in names}))
     except:
-        return pd.DataFrame()
+        pass
+
 
+def load_sheets(sheet_names, creds_info):
+    prefetch_sheets(sheet_names, creds_info)
+    return [load_data_from_gsheet(name, creds_info) for name in sheet_names]
 
+
+@timed_fn("ghi toàn bộ sheet")
 def save_data_to_gsheet(df, sheet_name, creds_info):
-    client = get_gsheet_client(creds_info)
-    sh = client.open_by_key(SHEET_ID)
-    worksheet = sh.worksheet(sheet_name)
-    df_save = df.reset_index(drop=True).astype(str)
+    worksheet = get_worksheet(sheet_name, creds_info)
+    values = values_from_frame(df)
     worksheet.clear()
-    worksheet.update([df_save.columns.values.tolist()] + df_save.values.tolist())
-    st.cache_data.clear()
+    worksheet.update(values)
+    get_sheet_cache().put(sheet_name, frame_from_values(values, sheet_schema(sheet_name)))
+    if is_journal_sheet(sheet_name) or sheet_name == SODU_SHEET:
+        get_stock_balance().invalidate()
+        get_balance_index().invalidate()
+        get_report_cache().clear()
+
+
+@timed_fn("ghi thêm dòng")
+def append_rows_to_gsheet(rows, sheet_name, creds_info):
+    # Chỉ gửi các dòng mới bằng một lệnh append: Google tự chèn vào cuối bảng nên nhiều phiên ghi cùng lúc không đè nhau.
+    # save_data_to_gsheet (xóa & ghi lại toàn bộ) chỉ dùng cho Restore/Reset.
+    cache_appended(sheet_name, rows, *append_records(get_worksheet(sheet_name, creds_info), rows))
+
+
+def cache_appended(sheet_name, rows, header, new_values, resp):
+    # Cộng các dòng vừa append vào bộ đệm (dời mốc tải nối tiếp), tồn kho và chỉ mục lũy kế
+    get_sheet_cache().append(sheet_name, frame_from_values([header] + new_values, sheet_schema(sheet_name)),
+                             None if resp is None else lambda meta: advance_watermark(meta, resp, new_values))
+    if is_journal_sheet(sheet_name):
+        get_stock_balance().apply(rows)
+        get_balance_index().apply(rows)
+        get_report_cache().clear()
+
+
+def load_shards(creds_info, d1=None, d2=None, totals=True):
+    # Các dòng nhật ký còn mở, chỉ đọc các shard giao với [d1, d2]. Shard đã đóng hẳn trước d1 được thay bằng
+    # tổng theo MaQua (totals=True, đủ cho tồn kho và Tồn đầu) hoặc bỏ qua (totals=False, vd. tab Nhật ký).
+    df_dir = load_data_from_gsheet(SHARD_DIRECTORY, creds_info)
+    names, closed = shards_in_range(df_dir, "nhatky_xuatnhap", d1, d2)
+    prefetch_sheets(names, creds_info)
+    parts = [load_data_from_gsheet(name, creds_info) for name in names]
+    if totals and closed:
+        parts.insert(0, totals_as_journal(load_data_from_gsheet(SHARD_TOTALS, creds_info), df_dir, "nhatky_xuatnhap",
+                                          closed))
+    return concat_frames(parts)
+
+
+def append_journal_rows(rows, creds_info):
+    # Ghi nhật ký vào shard đang ghi (kho_gsheet.append_with_rollover), danh mục và số dòng shard đang ghi lấy từ bộ
+    # đệm; vừa mở shard mới thì làm mới danh mục và tổng shard.
+    df_dir = load_data_from_gsheet(SHARD_DIRECTORY, creds_info)
+    active = active_shard(df_dir, "nhatky_xuatnhap")
+    df_dir, written, *appended = append_with_rollover(
+        None, "nhatky_xuatnhap", rows, df_dir, len(load_data_from_gsheet(active, creds_info)),
+        open_ws=lambda name, cols: ensure_worksheet(name, creds_info, cols))
+    if written != active:
+        get_sheet_cache().put(SHARD_DIRECTORY, df_dir)
+        get_sheet_cache().invalidate(SHARD_TOTALS)
+    cache_appended(written, rows, *appended)
+
+
+def sync_journal_rows(rows, creds_info):
+    # Ghi một lô từ hàng đợi lên Google: quà mới (chưa có trong danh mục) trước, rồi các dòng nhật ký. Danh mục đọc
+    # thật từ Google (không dùng bản cũ) để không ghi trùng quà.
+    df_g = read_sheet("danhmuc_qua", creds_info)
+    known = set(df_g['MaQua'].astype(str)) if not df_g.empty else set()
+    new_gifts = list({str(r["MaQua"]): {"MaQua": r["MaQua"], "TenQua": r["TenQua"]} for r in rows
+                      if str(r["MaQua"]) not in known}.values())
+    if new_gifts: append_rows_to_gsheet(new_gifts, "danhmuc_qua", creds_info)
+    append_journal_rows(rows, creds_info)
+
+
+def read_fresh(sheet_names, creds_info):
+    # Đọc thẳng từ Google, bỏ qua bộ đệm (lỗi thì báo lỗi, không dùng bản cũ). Chỉ khi mọi sheet đọc được mới thay
+    # bộ đệm; đọc lỗi giữa chừng thì giữ nguyên mọi thứ.
+    fresh = {name: fetch_sheet(name, creds_info) for name in sheet_names}
+    for name, (df, meta) in fresh.items(): get_sheet_cache().put(name, df, meta)
+    return [df.copy() for df, _ in fresh.values()]
+
+
+def unsynced_journal_rows(rows, creds_info):
+    # Khi có mạng trở lại: đối chiếu các dòng trong WAL với nhật ký đọc mới từ Google, bỏ các dòng đã lên sheet
+    # (lần ghi trước đã tới Google nhưng chưa kịp xác nhận). Đọc lỗi thì báo lỗi để lần sau thử lại.
+    d1 = min(str(r["Ngay"])[:10] for r in rows)
+    names, _ = shards_in_range(read_sheet(SHARD_DIRECTORY, creds_info), "nhatky_xuatnhap", d1)
+    df_t = concat_frames(read_fresh(names, creds_info))
+    # Đọc được nhật ký thật rồi mới dựng lại tồn/chỉ mục (có thể đang dựng từ bản cũ hoặc bản sao cục bộ)
+    get_stock_balance().invalidate()
+    get_balance_index().invalidate()
+    return unsynced_rows(rows, df_t)
+
+
+def flush_pending_journal():
+    # Ghi nốt các giao dịch đang chờ trong hàng đợi trước khi đọc/ghi lại toàn bộ nhật ký
+    if not get_write_queue().drain():
+        raise RuntimeError("Chưa ghi được các giao dịch đang chờ lên Google Sheets, vui lòng thử lại sau!")
+
+
+def save_journal(df, creds_info):
+    # Ghi lại toàn bộ nhật ký (Restore/Reset/Chốt sổ), chia lại thành các shard <= SHARD_MAX_ROWS dòng
+    flush_pending_journal()
+    old = shard_directory(load_data_from_gsheet(SHARD_DIRECTORY, creds_info), "nhatky_xuatnhap")['Shard'].tolist()
+    shards, df_dir, totals = split_shards(df, "nhatky_xuatnhap", SHARD_MAX_ROWS)
+    for name, chunk in shards:
+        ensure_worksheet(name, creds_info, len(JOURNAL_COLUMNS))
+        save_data_to_gsheet(chunk, name, creds_info)
+    if len(old) > len(shards):
+        for name in old[len(shards):]:
+            get_spreadsheet(creds_info).del_worksheet(get_worksheet(name, creds_info))
+            get_sheet_cache().invalidate(name)
+        get_worksheet.clear()
+    if len(shards) > 1 or len(old) > 1:
+        for name, df_x, cols in ((SHARD_DIRECTORY, df_dir, SHARD_COLUMNS), (SHARD_TOTALS, totals, TOTALS_COLUMNS)):
+            ensure_worksheet(name, creds_info, len(cols))
+            save_data_to_gsheet(df_x, name, creds_info)
+
+
+def load_journal(creds_info, d1=None, d2=None):
+    # Nhật ký dùng cho tồn kho/báo cáo: số dư lần chốt gần nhất + các dòng còn mở (chỉ các shard cần cho [d1, d2]).
+    # Báo cáo bắt đầu từ trước ngày chốt thì ghép số dư của lần chốt trước d1 + các dòng lưu trữ sau lần chốt đó.
+    df_t, df_sd = load_shards(creds_info, d1, d2), load_data_from_gsheet(SODU_SHEET, creds_info)
+    dates = closing_dates(df_sd)
+    if not dates or d1 is None or pd.Timestamp(d1) > dates[-1]:
+        return concat_frames([balance_as_journal(df_sd), df_t])
+    base = max((d for d in dates if d < pd.Timestamp(d1)), default=None)
+    years = [int(ws.title[len(ARCHIVE_PREFIX):]) for ws in get_spreadsheet(creds_info).worksheets()
+             if is_archive_sheet(ws.title)]
+    archived = [load_data_from_gsheet(archive_sheet(y), creds_info) for y in sorted(years)
+                if base is None or y >= base.year]
+    archived = [a[a['Ngay'] > base] if base is not None else a for a in archived if not a.empty]
+    opening = balance_as_journal(df_sd, base) if base is not None else balance_as_journal(df_sd.iloc[:0])
+    return concat_frames([opening] + archived + [df_t])
+
+
+def read_live_journal(creds_info):
+    # Mọi shard của nhật ký, đọc thẳng từ Google
+    df_dir, = read_fresh([SHARD_DIRECTORY], creds_info)
+    return concat_frames(read_fresh(shard_directory(df_dir, "nhatky_xuatnhap")['Shard'].tolist(), creds_info))
+
+
+def close_books(ngay_chot, creds_info):
+    # Chốt sổ đến hết ngày ngay_chot: chuyển các dòng đã chốt sang sheet lưu trữ theo năm, nhật ký chỉ còn các dòng
+    # sau ngày chốt, sau cùng ghi số dư theo MaQua vào SODU_SHEET (có số dư của ngày chốt = đã chốt xong).
+    # Đọc thẳng từ Google (bỏ qua bộ đệm). Lỗi giữa chừng thì chốt lại được: dòng đã có trong lưu trữ không ghi lại,
+    # số dư tính từ lưu trữ (đúng cả khi lần trước đã kịp ghi lại nhật ký).
+    flush_pending_journal()
+    chot = pd.Timestamp(ngay_chot)
+    df_sd, = read_fresh([SODU_SHEET], creds_info)
+    dates = closing_dates(df_sd)
+    if chot in dates: return 0
+    if dates and chot < dates[-1]: raise RuntimeError("Ngày chốt phải sau lần chốt gần nhất!")
+    prev = dates[-1] if dates else None
+    df_t = read_live_journal(creds_info)
+    closed, live, _ = close_period(df_t, df_sd, chot)
+    years = {int(ws.title[len(ARCHIVE_PREFIX):]) for ws in get_spreadsheet(creds_info).worksheets()
+             if is_archive_sheet(ws.title)} | set(closed['Ngay'].dt.year.astype(int))
+    archived = []
+    for year in sorted(y for y in years if (prev is None or y >= prev.year) and y <= chot.year):
+        ensure_worksheet(archive_sheet(year), creds_info, len(JOURNAL_COLUMNS))
+        df_a, = read_fresh([archive_sheet(year)], creds_info)
+        if not df_a.empty:
+            ngay = df_a['Ngay'].dt.normalize()
+            df_a = df_a[(ngay <= chot) & (ngay > prev if prev is not None else True)]
+        missing = unarchived_rows(closed[closed['Ngay'].dt.year == year], df_a)
+        if not missing.empty: append_rows_to_gsheet(to_strings(missing).to_dict("records"), archive_sheet(year), creds_info)
+        archived += [df_a, missing]
+    if not closed.empty:
+        # Giao dịch mới từ phiên khác giữa lúc đọc và lúc ghi lại nhật ký sẽ bị mất: đọc lại, có thay đổi thì dừng
+        flush_pending_journal()
+        if len(read_live_journal(creds_info)) != len(df_t):
+            raise RuntimeError("Nhật ký vừa có giao dịch mới trong lúc chốt sổ, vui lòng bấm chốt sổ lại!")
+        save_journal(live, creds_info)
+    archived = concat_frames([a for a in archived if not a.empty] or [closed])
+    _, _, bal = close_period(archived, df_sd, chot)
+    if archived.empty or bal.empty: return 0
+    ensure_worksheet(SODU_SHEET, creds_info, len(BALANCE_COLUMNS))
+    append_rows_to_gsheet(to_strings(bal).to_dict("records"), SODU_SHEET, creds_info)
+    return len(closed)
+
+
+def import_journal(data, file_name, nguoi, creds_info):
+    # Nhập hàng loạt từ CSV/XLSX: kiểm tra cả file một lượt với nhật ký hiện có (số dư + mọi shard), rồi ghi các dòng
+    # hợp lệ theo ngày tăng dần, mỗi khối IMPORT_CHUNK_ROWS dòng một lệnh append. Trả về (số dòng đã ghi, dòng bị loại).
+    flush_pending_journal()
+    ok, rejected = validate_import(read_import_file(data, file_name), load_data_from_gsheet("danhmuc_qua", creds_info),
+                                   load_journal(creds_info), nguoi)
+    rows = to_strings(ok.sort_values('Ngay', kind="stable")).to_dict("records")
+    for chunk in chunks(rows, min(IMPORT_CHUNK_ROWS, SHARD_MAX_ROWS)): append_journal_rows(chunk, creds_info)
+    return len(rows), rejected
+
+
+@st.cache_resource
+def get_stock_balance():
+    # Bảng tồn kho dùng chung cho mọi phiên trong tiến trình
+    return StockBalance()
+
+
+@st.cache_resource
+def get_write_queue():
+    # Luồng nền ghi nhật ký dùng chung cho mọi phiên; lần khởi động nạp lại các dòng còn trong WAL
+    return WriteBehind(lambda rows: sync_journal_rows(rows, CREDS_DATA), JOURNAL_WAL_FILE, WRITE_BEHIND_SECONDS,
+                       WRITE_BEHIND_MAX_ROWS, reconcile_fn=lambda rows: unsynced_journal_rows(rows, CREDS_DATA))
+
+
+def load_catalog():
+    # Danh mục + quà mới còn trong hàng đợi ghi (chưa lên Google)
+    df_g = load_data_from_gsheet("danhmuc_qua", CREDS_DATA)
+    known = set(df_g['MaQua'].astype(str)) if not df_g.empty else set()
+    new = {str(r["MaQua"]): r["TenQua"] for r in get_write_queue().pending_rows() if str(r["MaQua"]) not in known}
+    if not new: return df_g
+    return concat_frames([df_g, pd.DataFrame({"MaQua": list(new), "TenQua": list(new.values())})]).reset_index(
+        drop=True)
+
+
+@st.cache_resource
+def get_balance_index():
+    # Số dư lũy kế theo ngày dùng cho báo cáo XNT, cộng dồn khi ghi thêm nhật ký
+    return BalanceIndex()
+
+
+@st.cache_resource
+def get_report_cache():
+    # Kết quả báo cáo XNT dùng chung giữa các phiên: cùng kỳ, nhật ký chưa đổi thì trả ngay
+    return ReportCache()
+
+
+@st.cache_resource(max_entries=2)
+def get_search_index(catalog_version, n_rows, _df_g):
+    # Chỉ dựng lại chỉ mục tìm kiếm khi danh mục đổi phiên bản
+    return GiftSearchIndex(_df_g)
 
 
 # --- 4. QUẢN LÝ ĐĂNG NHẬP ---
@@ -82,57 +469,34 @@ def check_login():
 
 
 # --- 5. HÀM TIỆN ÍCH ---
-def no_accent_vietnamese(s):
-    s = str(s)
-    patterns = {'[àáạảãâầấậẩẫăằắặẳẵ]': 'a', '[èéẹẻẽêềếệểễ]': 'e', '[òóọỏõôồốộổỗơờớợởỡ]': 'o', '[ìíịỉĩ]': 'i',
-                '[ùúụủũưừứựửữ]': 'u', '[ỳýỵỷỹ]': 'y', '[đ]': 'd'}
-    for p, r in patterns.items():
-        s = re.sub(p, r, s);
-        s = re.sub(p.upper(), r.upper(), s)
-    return s
-
-
 def generate_new_gift_code():
-    df_g = load_data_from_gsheet("danhmuc_qua", CREDS_DATA)
-    if df_g.empty: return "QT0001"
-    codes = [c for c in df_g['MaQua'].astype(str) if c.startswith("QT") and c[2:].isdigit()]
-    nums = [int(c[2:]) for c in codes] if codes else [0]
+    df_g = load_catalog()
+    codes = df_g['MaQua'].astype(str).tolist() if not df_g.empty else []
+    codes += [l["MaQua"] for l in st.session_state.get("cart_NHẬP", [])]  # quà mới đang chờ trong phiếu nhập
+    nums = [int(c[2:]) for c in codes if c.startswith("QT") and c[2:].isdigit()] or [0]
     return f"QT{(max(nums) + 1):04d}"
 
 
+@timed_fn("tồn kho")
 def get_current_stock(ma_qua):
-    df_t = load_data_from_gsheet("nhatky_xuatnhap", CREDS_DATA)
-    if df_t.empty: return 0
-    df_t['SoLuong'] = pd.to_numeric(df_t['SoLuong'], errors='coerce').fillna(0)
-    return df_t[df_t["MaQua"].astype(str) == str(ma_qua)]["SoLuong"].sum()
-
-
-def export_pdf_report(df, d1, d2):
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    w, h = A4
-    c.setFont("Helvetica-Bold", 16);
-    c.drawCentredString(w / 2, h - 50, "BAO CAO XUAT NHAP TON")
-    c.setFont("Helvetica", 10);
-    c.drawCentredString(w / 2, h - 70, f"Tu {d1} den {d2}")
-    y = h - 110;
-    headers = ["Ma", "Ten Qua", "Ton Dau", "Nhap", "Xuat", "Ton Cuoi"]
-    x_pos = [40, 100, 300, 360, 420, 480]
-    for i, txt in enumerate(headers): c.drawString(x_pos[i], y, txt)
-    y -= 20;
-    c.setFont("Helvetica", 9)
-    for _, r in df.iterrows():
-        if y < 50: c.showPage(); y = h - 50
-        c.drawString(x_pos[0], y, str(r['Mã']))
-        c.drawString(x_pos[1], y, no_accent_vietnamese(r['Tên'])[:35])
-        c.drawString(x_pos[2], y, str(r['Tồn đầu']))
-        c.drawString(x_pos[3], y, str(r['Nhập']))
-        c.drawString(x_pos[4], y, str(r['Xuất']))
-        c.drawString(x_pos[5], y, str(r['Tồn cuối']))
-        y -= 18
-    c.save();
-    return buf.getvalue()
+    bal = get_stock_balance()
+    # Tồn kho chỉ cần shard đang ghi + tổng của các shard đã đóng
+    if bal.needs_check(): bal.sync(load_journal(CREDS_DATA, date.today() + timedelta(days=1)))
+    # Cộng các giao dịch còn trong hàng đợi ghi
+    return bal.get(ma_qua) + get_write_queue().pending_qty([ma_qua]).get(str(ma_qua), 0)
+
+
+def get_stock_snapshot(ma_list):
+    bal = get_stock_balance()
+    if bal.needs_check(): bal.sync(load_journal(CREDS_DATA, date.today() + timedelta(days=1)))
+    pending = get_write_queue().pending_qty(ma_list)
+    return {ma: ton + pending.get(ma, 0) for ma, ton in bal.snapshot(ma_list).items()}
+
 
+# Mỗi lượt chạy lại của script là một lượt đo; lượt trước của phiên chưa kết thúc (st.rerun/st.stop) được đóng lại
+perf_run = get_perf_log().start(st.session_state.get('user_info', {}).get('id', "(chưa đăng nhập)"),
+                                st.session_state.get('_perf_run'))
+st.session_state['_perf_run'] = perf_run
 
 # --- 6. GIAO DIỆN ĐĂNG NHẬP ---
 if not check_login():
@@ -149,9 +513,16 @@ if not check_login():
     st.stop()
 
 # --- 7. GIAO DIỆN CHÍNH ---
+prefetch_sheets(["danhmuc_qua", "nhatky_xuatnhap"], CREDS_DATA)  # lần hiển thị đầu: nạp cả 2 sheet trong một lệnh
 with st.sidebar:
     st.subheader("🌸 Vườn Xuân TNF")
     st.info(f"👤 **{st.session_state['user_info']['name']}**\n\n🆔 Mã NV: **{st.session_state['user_info']['id']}**")
+    n_pending = len(get_write_queue().pending_rows())
+    if n_pending: st.caption(f"⏳ {n_pending} dòng đang chờ ghi lên Google Sheets")
+    limiter = limiter_of(get_gsheet_client(CREDS_DATA))
+    if get_write_queue().failures or (limiter and limiter.offline()):
+        st.warning("📴 Không kết nối được Google Sheets: vẫn nhập liệu bình thường, giao dịch được lưu trên máy chủ "
+                   "và tự đồng bộ khi có mạng.")
     if st.button("Đăng xuất", use_container_width=True):
         cookie_manager.delete("saved_user_tnf");
         st.session_state.clear();
@@ -161,16 +532,13 @@ with st.sidebar:
     with st.expander("🛠️ QUẢN TRỊ"):
         pwd = st.text_input("Mật khẩu Admin", type="password")
         if pwd == ADMIN_PASSWORD:
-            dg = load_data_from_gsheet("danhmuc_qua", CREDS_DATA)
-            dt = load_data_from_gsheet("nhatky_xuatnhap", CREDS_DATA)
+            dg, dsd = load_sheets(["danhmuc_qua", SODU_SHEET], CREDS_DATA)
+            dt = load_shards(CREDS_DATA)
 
             # --- BACKUP ---
             st.write("📂 **Sao lưu dữ liệu**")
-            buf = io.BytesIO()
-            with pd.ExcelWriter(buf) as wr:
-                dg.to_excel(wr, sheet_name='DM', index=False);
-                dt.to_excel(wr, sheet_name='NK', index=False)
-            st.download_button("📤 Tải Backup Excel", buf.getvalue(), "backup_vuonxuan.xlsx", use_container_width=True)
+            st.download_button("📤 Tải Backup Excel", export_backup(dg, dt, dsd), "backup_vuonxuan.xlsx",
+                               use_container_width=True)
 
             st.divider()
 
@@ -186,7 +554,10 @@ with st.sidebar:
                             df_nk_new = pd.read_excel(uploaded_file, sheet_name='NK')
 
                             save_data_to_gsheet(df_dm_new, "danhmuc_qua", CREDS_DATA)
-                            save_data_to_gsheet(df_nk_new, "nhatky_xuatnhap", CREDS_DATA)
+                            save_journal(df_nk_new, CREDS_DATA)
+                            if 'SD' in ex.sheet_names:
+                                ensure_worksheet(SODU_SHEET, CREDS_DATA, len(BALANCE_COLUMNS))
+                                save_data_to_gsheet(pd.read_excel(uploaded_file, sheet_name='SD'), SODU_SHEET, CREDS_DATA)
 
                             st.success("✅ Khôi phục thành công!")
                             time.sleep(1);
@@ -198,15 +569,79 @@ with st.sidebar:
 
             st.divider()
 
+            # --- NHẬP HÀNG LOẠT ---
+            st.write("📦 **Nhập hàng loạt**")
+            import_file = st.file_uploader("File dòng nhật ký (.csv/.xlsx)", type=["csv", "xlsx"], key="import_file")
+            if import_file and st.button("📦 KIỂM TRA & NHẬP", use_container_width=True):
+                nguoi = f"{st.session_state['user_info']['name']} ({st.session_state['user_info']['id']})"
+                try:
+                    n, st.session_state['import_rejected'] = import_journal(import_file.getvalue(), import_file.name,
+                                                                            nguoi, CREDS_DATA)
+                    st.success(f"✅ Đã nhập {n} dòng!")
+                except Exception as e:
+                    st.error(f"❌ Lỗi: {str(e)}")
+            if 'import_rejected' in st.session_state and not st.session_state['import_rejected'].empty:
+                rej = st.session_state['import_rejected']
+                st.warning(f"⚠️ {len(rej)} dòng bị loại")
+                st.dataframe(rej[['Dong', REJECT_COLUMN]].head(200), use_container_width=True, hide_index=True)
+                st.download_button("📄 Tải danh sách dòng bị loại", rej.to_csv(index=False).encode("utf-8-sig"),
+                                   "dong_bi_loai.csv", use_container_width=True)
+
+            st.divider()
+
+            # --- CHỐT SỔ ---
+            st.write("📕 **Chốt sổ**")
+            dates = closing_dates(dsd)
+            if dates: st.caption(f"Lần chốt gần nhất: {dates[-1]:%d/%m/%Y}")
+            ngay_chot = st.date_input("Chốt đến hết ngày", date.today().replace(day=1) - timedelta(days=1),
+                                      max_value=date.today() - timedelta(days=1), key="ngay_chot")
+            st.caption("Nên chốt khi không có ai đang nhập liệu.")
+            if st.button("📕 CHỐT SỔ", use_container_width=True):
+                if dates and pd.Timestamp(ngay_chot) <= dates[-1]:
+                    st.error("❌ Ngày chốt phải sau lần chốt gần nhất!")
+                else:
+                    try:
+                        n = close_books(ngay_chot, CREDS_DATA)
+                        st.success(f"✅ Đã chốt sổ, chuyển {n} dòng vào lưu trữ!");
+                        time.sleep(1);
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ Lỗi: {str(e)}")
+
+            st.divider()
+
+            # --- HIỆU NĂNG ---
+            st.write("⏱️ **Hiệu năng**")
+            perf = get_perf_log()
+            log_on = st.toggle("Ghi log JSON-lines", value=perf.path is not None, key="perf_log_on")
+            perf.path = PERF_LOG_FILE if log_on else None
+            if log_on: st.caption(f"Ghi vào {PERF_LOG_FILE}")
+            limiter = limiter_of(get_gsheet_client(CREDS_DATA))
+            if limiter:
+                s = limiter.stats
+                st.caption(f"Hạn mức còn lại/phút: đọc {limiter.budget('read')}, ghi {limiter.budget('write')} · "
+                           f"gộp {s['coalesced']} · thử lại {s['retries']} · bị chặn {s['throttled']}")
+            runs = perf.recent(PERF_PANEL_RUNS)[::-1]
+            if runs:
+                st.dataframe(pd.DataFrame(runs).drop(columns="timings"), use_container_width=True, hide_index=True)
+                i = st.selectbox("Chi tiết lượt", range(len(runs)), key="perf_run_sel",
+                                 format_func=lambda i: f"{runs[i]['time']} · {runs[i]['label']} · {runs[i]['total_s']}s")
+                st.dataframe(pd.DataFrame([{"Bước": k, "Giây": v["s"], "Số lần": v["n"]}
+                                           for k, v in runs[i]["timings"].items()]),
+                             use_container_width=True, hide_index=True)
+
+            st.divider()
+
             # --- RESET ---
             st.warning("⚠️ **Vùng nguy hiểm**")
             confirm_reset = st.checkbox("Xác nhận xóa TOÀN BỘ dữ liệu")
             if confirm_reset:
                 if st.button("🔥 RESET DATABASE", type="primary", use_container_width=True):
                     save_data_to_gsheet(pd.DataFrame(columns=["MaQua", "TenQua"]), "danhmuc_qua", CREDS_DATA)
-                    save_data_to_gsheet(pd.DataFrame(
+                    save_journal(pd.DataFrame(
                         columns=["Loai", "Ngay", "MaQua", "TenQua", "SoLuong", "SoChungTu", "NguoiThucHien", "GhiChu"]),
-                                        "nhatky_xuatnhap", CREDS_DATA)
+                                 CREDS_DATA)
+                    if not dsd.empty: save_data_to_gsheet(pd.DataFrame(columns=BALANCE_COLUMNS), SODU_SHEET, CREDS_DATA)
                     st.success("✅ Đã làm sạch dữ liệu!");
                     time.sleep(1);
                     st.rerun()
@@ -215,11 +650,15 @@ tabs = st.tabs(["📤 Xuất kho", "📥 Nhập kho", "📊 Báo cáo XNT", "
 
 
 def render_form(type_f="XUẤT"):
-    df_g = load_data_from_gsheet("danhmuc_qua", CREDS_DATA)
+    df_g = load_catalog()
+    if f"flash_{type_f}" in st.session_state: st.success(st.session_state.pop(f"flash_{type_f}"))
     if f"ma_{type_f}" not in st.session_state: st.session_state[f"ma_{type_f}"] = ""
     if f"ten_{type_f}" not in st.session_state: st.session_state[f"ten_{type_f}"] = ""
     if f"show_list_{type_f}" not in st.session_state: st.session_state[f"show_list_{type_f}"] = False
 
+    if f"cart_{type_f}" not in st.session_state: st.session_state[f"cart_{type_f}"] = []
+    voucher = st.toggle("🧾 Phiếu nhiều dòng", key=f"voucher_{type_f}")
+
     st.markdown(f"🔍 **Tìm quà ({type_f}):**")
     c1, c2 = st.columns([3, 1])
     with c1:
@@ -242,48 +681,86 @@ def render_form(type_f="XUẤT"):
                         st.rerun()
 
     if search_term and not st.session_state[f"show_list_{type_f}"]:
-        f = df_g[
-            df_g['MaQua'].str.contains(search_term, case=False) | df_g['TenQua'].str.contains(search_term, case=False)]
+        idx = get_search_index(get_sheet_cache().version("danhmuc_qua"), len(df_g), df_g)
+        with timed("tìm quà"):
+            f = df_g.iloc[idx.search(search_term, limit=3)]
         if not f.empty:
-            for i, r in f.head(3).iterrows():
+            for i, r in f.iterrows():
                 if st.button(f"📍 {r['MaQua']} - {r['TenQua']}", key=f"res_{type_f}_{i}", use_container_width=True):
                     st.session_state[f"ma_{type_f}"], st.session_state[f"ten_{type_f}"] = r['MaQua'], r['TenQua'];
                     st.rerun()
-        elif type_f == "NHẬP":
-            if st.button(f"➕ Tạo quà mới: '{search_term}'", type="primary", use_container_width=True):
-                st.session_state[f"ma_{type_f}"], st.session_state[
-                    f"ten_{type_f}"] = generate_new_gift_code(), search_term;
-                st.rerun()
         else:
-            st.error("❌ Không tìm thấy!")
+            # Không có kết quả khớp: chỉ gợi ý các món gần đúng, vẫn coi là chưa tìm thấy
+            fz = df_g.iloc[idx.fuzzy(search_term, limit=3)]
+            if not fz.empty: st.caption("🤔 Có phải bạn muốn tìm:")
+            for i, r in fz.iterrows():
+                if st.button(f"📍 {r['MaQua']} - {r['TenQua']}", key=f"fz_{type_f}_{i}", use_container_width=True):
+                    st.session_state[f"ma_{type_f}"], st.session_state[f"ten_{type_f}"] = r['MaQua'], r['TenQua'];
+                    st.rerun()
+            if type_f == "NHẬP":
+                if st.button(f"➕ Tạo quà mới: '{search_term}'", type="primary", use_container_width=True):
+                    st.session_state[f"ma_{type_f}"], st.session_state[
+                        f"ten_{type_f}"] = generate_new_gift_code(), search_term;
+                    st.rerun()
+            else:
+                st.error("❌ Không tìm thấy!")
 
     m, t = st.session_state[f"ma_{type_f}"], st.session_state[f"ten_{type_f}"]
     if m:
         ton = get_current_stock(m) if not df_g.empty and m in df_g['MaQua'].values else 0
         st.success(f"Đang chọn: **{t}** | Tồn: **{ton}**")
         with st.form(f"f_{type_f}", clear_on_submit=True):
-            so_ct = st.text_input("Số chứng từ *")
+            so_ct = "" if voucher else st.text_input("Số chứng từ *")
             sl = st.number_input("Số lượng *", min_value=1, step=1)
             note = st.text_input("Ghi chú")
-            if st.form_submit_button(f"XÁC NHẬN {type_f}", use_container_width=True):
+            if voucher:
+                if st.form_submit_button("➕ Thêm vào phiếu", use_container_width=True):
+                    st.session_state[f"cart_{type_f}"].append({"MaQua": m, "TenQua": t, "SoLuong": int(sl),
+                                                               "GhiChu": note})
+                    st.session_state[f"ma_{type_f}"] = "";
+                    st.rerun()
+            elif st.form_submit_button(f"XÁC NHẬN {type_f}", use_container_width=True):
                 if so_ct:
                     user_info = f"{st.session_state['user_info']['name']} ({st.session_state['user_info']['id']})"
-                    df_t = load_data_from_gsheet("nhatky_xuatnhap", CREDS_DATA)
                     new_r = {"Loai": type_f, "Ngay": date.today().strftime("%Y-%m-%d"), "MaQua": m, "TenQua": t,
                              "SoLuong": sl if type_f == "NHẬP" else -sl, "SoChungTu": so_ct, "NguoiThucHien": user_info,
                              "GhiChu": note}
-                    save_data_to_gsheet(pd.concat([df_t, pd.DataFrame([new_r])], ignore_index=True), "nhatky_xuatnhap",
-                                        CREDS_DATA)
-                    if df_g.empty or m not in df_g['MaQua'].values:
-                        dg_now = load_data_from_gsheet("danhmuc_qua", CREDS_DATA)
-                        save_data_to_gsheet(
-                            pd.concat([dg_now, pd.DataFrame([{"MaQua": m, "TenQua": t}])], ignore_index=True),
-                            "danhmuc_qua", CREDS_DATA)
-                    st.success("✅ Thành công!");
-                    time.sleep(1);
+                    # Quà mới được thêm vào danh mục cùng lần ghi nhật ký (sync_journal_rows)
+                    get_write_queue().enqueue([new_r])
+                    st.session_state[f"flash_{type_f}"] = "✅ Thành công!"
                     st.session_state[f"ma_{type_f}"] = "";
                     st.rerun()
 
+    if voucher and st.session_state[f"cart_{type_f}"]: render_voucher(type_f)
+
+
+def render_voucher(type_f):
+    # Phiếu nhiều dòng: mọi dòng cùng một Số chứng từ, ghi lên Google bằng một lệnh append duy nhất
+    cart = st.session_state[f"cart_{type_f}"]
+    st.markdown(f"🧾 **Phiếu {type_f}: {len(cart)} dòng**")
+    st.dataframe(pd.DataFrame(cart), use_container_width=True, hide_index=True)
+    so_ct = st.text_input("Số chứng từ *", key=f"so_ct_{type_f}")
+    c1, c2 = st.columns([3, 1])
+    if c2.button("🗑️ Hủy phiếu", key=f"clear_{type_f}", use_container_width=True):
+        cart.clear();
+        st.rerun()
+    if c1.button(f"XÁC NHẬN PHIẾU {type_f}", key=f"post_{type_f}", type="primary", use_container_width=True):
+        if not so_ct:
+            st.error("❌ Chưa nhập Số chứng từ!")
+            return
+        if type_f == "XUẤT":
+            # Kiểm tra tồn của mọi dòng trên cùng một lần chụp tồn kho
+            short = voucher_shortages(cart, get_stock_snapshot([l["MaQua"] for l in cart]))
+            if short:
+                st.error("❌ Không đủ tồn: " + "; ".join(f"{ma} cần {n}, tồn {ton}" for ma, n, ton in short))
+                return
+        user_info = f"{st.session_state['user_info']['name']} ({st.session_state['user_info']['id']})"
+        # Cả phiếu là một lần enqueue nên luôn được ghi chung một lệnh append
+        get_write_queue().enqueue(voucher_rows(cart, type_f, so_ct, date.today().strftime("%Y-%m-%d"), user_info))
+        cart.clear();
+        st.session_state[f"flash_{type_f}"] = "✅ Thành công!"
+        st.rerun()
+
 
 with tabs[0]: render_form("XUẤT")
 with tabs[1]: render_form("NHẬP")
@@ -293,35 +770,47 @@ with tabs[2]:
     d1, d2 = c1.date_input("Từ ngày", date(date.today().year, date.today().month, 1), key="d1"), c2.date_input(
         "Đến ngày", date.today(), key="d2")
     if st.button("Chạy báo cáo", type="primary", use_container_width=True):
-        df_t, df_g = load_data_from_gsheet("nhatky_xuatnhap", CREDS_DATA), load_data_from_gsheet("danhmuc_qua",
-                                                                                                 CREDS_DATA)
-        if not df_t.empty and not df_g.empty:
-            df_t['Ngay'] = pd.to_datetime(df_t['Ngay']).dt.date
-            df_t['SoLuong'] = pd.to_numeric(df_t['SoLuong'], errors='coerce').fillna(0)
-            res = []
-            for _, r in df_g.iterrows():
-                m, q = r['MaQua'], r['TenQua']
-                t_dau = df_t[(df_t['MaQua'] == m) & (df_t['Ngay'] < d1)]['SoLuong'].sum()
-                nhap = \
-                df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "NHẬP") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                    'SoLuong'].sum()
-                xuat = abs(
-                    df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "XUẤT") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                        'SoLuong'].sum())
-                res.append(
-                    {"Mã": m, "Tên": q, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat, "Tồn cuối": t_dau + nhap - xuat})
-            st.session_state['rep_df'] = pd.DataFrame(res)
+        prefetch_sheets(["nhatky_xuatnhap", SODU_SHEET, "danhmuc_qua"], CREDS_DATA)
+        df_g, dates = load_data_from_gsheet("danhmuc_qua", CREDS_DATA), closing_dates(
+            load_data_from_gsheet(SODU_SHEET, CREDS_DATA))
+        # Chỉ mục lũy kế được dựng một lần trên toàn bộ nhật ký rồi cộng dồn; shard đã đóng không tải lại.
+        # Phiên bản của nó (đổi khi có giao dịch mới/chốt sổ/restore) cùng phiên bản danh mục làm khóa bộ đệm báo cáo.
+        idx = get_balance_index()
+        if idx.needs_check(): idx.sync(load_journal(CREDS_DATA))
+        key = (d1, d2, get_sheet_cache().version("danhmuc_qua"), idx.version)
+        df_rep = get_report_cache().get(key)
+        if df_rep is None and not df_g.empty:
+            with timed("tính báo cáo"):
+                if dates and pd.Timestamp(d1) <= dates[-1]:
+                    # Kỳ báo cáo chạm vào phần đã chốt sổ: tính trực tiếp trên số dư + dữ liệu lưu trữ + các shard cần
+                    df_t = load_journal(CREDS_DATA, d1, d2)
+                    if not df_t.empty: df_rep = build_xnt_report(df_g, df_t, d1, d2)
+                else:
+                    df_rep = xnt_report_from_index(df_g, idx, d1, d2)
+            if df_rep is not None: get_report_cache().put(key, df_rep)
+        if df_rep is not None: st.session_state['rep_df'] = df_rep
 
     if 'rep_df' in st.session_state:
         df_rep = st.session_state['rep_df']
         st.dataframe(df_rep, use_container_width=True, hide_index=True)
         cx, cp = st.columns(2)
-        buf_ex = io.BytesIO()
-        with pd.ExcelWriter(buf_ex) as wr: df_rep.to_excel(wr, index=False)
-        cx.download_button("📥 Xuất Excel", buf_ex.getvalue(), "bao_cao_XNT.xlsx", use_container_width=True)
-        cp.download_button("📥 Xuất PDF", export_pdf_report(df_rep, d1, d2), "bao_cao_XNT.pdf", use_container_width=True)
+        with timed("xuất Excel"):
+            cx.download_button("📥 Xuất Excel", export_excel_report(df_rep), "bao_cao_XNT.xlsx", use_container_width=True)
+        with timed("xuất PDF"):
+            cp.download_button("📥 Xuất PDF", export_pdf_report(df_rep, d1, d2), "bao_cao_XNT.pdf",
+                               use_container_width=True)
 
 with tabs[3]:
     st.subheader("📜 Nhật ký giao dịch")
-    df_nk = load_data_from_gsheet("nhatky_xuatnhap", CREDS_DATA)
-    if not df_nk.empty: st.dataframe(df_nk.iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
+    c1, c2 = st.columns(2)
+    n1 = c1.date_input("Từ ngày", (date.today().replace(day=1) - timedelta(days=1)).replace(day=1), key="nk_d1")
+    n2 = c2.date_input("Đến ngày", date.today(), key="nk_d2")
+    df_nk = load_shards(CREDS_DATA, n1, n2, totals=False)
+    if not df_nk.empty:
+        ngay = df_nk['Ngay'].dt.normalize()
+        df_nk = df_nk[(ngay >= pd.Timestamp(n1)) & (ngay <= pd.Timestamp(n2))]
+    if not df_nk.empty: st.dataframe(df_nk.iloc[::-1], use_container_width=True, hide_index=True,
+                                     column_config={"Ngay": st.column_config.DateColumn("Ngay", format="YYYY-MM-DD"),
+                                                    SYNC_ID: None})
+
+get_perf_log().finish(perf_run)
@@ -4,8 +4,9 @@ import pandas as pd
 from datetime import datetime, date
 import io
 import time
-import re
 from fpdf import FPDF
+from kho_core import no_accent_vietnamese
+from kho_report import build_xnt_report
 
 # --- 1. CẤU HÌNH KẾT NỐI ---
 # Thay link Sheets của bạn vào đây
@@ -29,25 +30,6 @@ def save_data(df, worksheet_name):
     st.cache_data.clear()
 
 
-def no_accent_vietnamese(s):
-    s = str(s)
-    s = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', s);
-    s = re.sub(r'[ÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴ]', 'A', s)
-    s = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', s);
-    s = re.sub(r'[ÈÉẸẺẼÊỀẾỆỂỄ]', 'E', s)
-    s = re.sub(r'[òóọỏõôồốộổỗơờớợởỡ]', 'o', s);
-    s = re.sub(r'[ÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠ]', 'O', s)
-    s = re.sub(r'[ìíịỉĩ]', 'i', s);
-    s = re.sub(r'[ÌÍỊỈĨ]', 'I', s)
-    s = re.sub(r'[ùúụủũưừứựửữ]', 'u', s);
-    s = re.sub(r'[ÙÚỤỦŨƯỪỨỰỬỮ]', 'U', s)
-    s = re.sub(r'[ỳýỵỷỹ]', 'y', s);
-    s = re.sub(r'[ỲÝỴỶỸ]', 'Y', s)
-    s = re.sub(r'[đ]', 'd', s);
-    s = re.sub(r'[Đ]', 'D', s)
-    return s
-
-
 def get_current_stock(ma_qua, df_trans):
     if df_trans.empty: return 0
     return df_trans[df_trans["MaQua"].astype(str) == str(ma_qua)]["SoLuong"].sum()
@@ -198,21 +180,7 @@ with tabs[2]:
 
     if st.button("📊 Xem báo cáo", use_container_width=True):
         if not df_trans.empty:
-            df_t = df_trans.copy()
-            df_t['Ngay'] = pd.to_datetime(df_t['Ngay']).dt.date
-            rpt = []
-            for _, item in df_gifts.iterrows():
-                m, t = item['MaQua'], item['TenQua']
-                t_dau = df_t[(df_t['MaQua'] == m) & (df_t['Ngay'] < d1)]['SoLuong'].sum()
-                nhap = \
-                df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "NHẬP") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                    'SoLuong'].sum()
-                xuat = abs(
-                    df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "XUẤT") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                        'SoLuong'].sum())
-                rpt.append(
-                    {"Mã": m, "Tên": t, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat, "Tồn cuối": t_dau + nhap - xuat})
-            st.session_state['res'] = pd.DataFrame(rpt)
+            st.session_state['res'] = build_xnt_report(df_gifts, df_trans, d1, d2)
             st.dataframe(st.session_state['res'], use_container_width=True, hide_index=True)
 
     if 'res' in st.session_state:
@@ -4,28 +4,22 @@ import os
 from datetime import datetime, date
 import io
 import time
-import re
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
+from kho_core import no_accent_vietnamese
+import kho_sqlite
 
 # --- 1. CẤU HÌNH HỆ THỐNG & FILE ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FILE_PATH = {
     "gifts": os.path.join(BASE_DIR, "danhmuc_qua.csv"),
     "trans": os.path.join(BASE_DIR, "nhatky_xuatnhap.csv"),
+    "db": os.path.join(BASE_DIR, "kho_qua.db"),
     "session": os.path.join(BASE_DIR, "user_session.txt")
 }
 
 
-def init_csv():
-    if not os.path.exists(FILE_PATH["gifts"]):
-        pd.DataFrame(columns=["MaQua", "TenQua"]).to_csv(FILE_PATH["gifts"], index=False, encoding='utf-8-sig')
-    if not os.path.exists(FILE_PATH["trans"]):
-        pd.DataFrame(columns=["Loai", "Ngay", "Gio", "SoChungTu", "MaQua", "TenQua", "SoLuong", "NguoiThucHien",
-                              "GhiChu"]).to_csv(FILE_PATH["trans"], index=False, encoding='utf-8-sig')
-
-
 # --- 2. QUẢN LÝ PHIÊN ĐĂNG NHẬP ---
 def save_session(u_id, u_name):
     with open(FILE_PATH["session"], "w", encoding="utf-8") as f:
@@ -46,27 +40,8 @@ def clear_session():
 
 
 # --- 3. TIỆN ÍCH PDF & MÃ QUÀ ---
-def no_accent_vietnamese(s):
-    s = str(s)
-    s = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', s);
-    s = re.sub(r'[ÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴ]', 'A', s)
-    s = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', s);
-    s = re.sub(r'[ÈÉẸẺẼÊỀẾỆỂỄ]', 'E', s)
-    s = re.sub(r'[òóọỏõôồốộổỗơờớợởỡ]', 'o', s);
-    s = re.sub(r'[ÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠ]', 'O', s)
-    s = re.sub(r'[ìíịỉĩ]', 'i', s);
-    s = re.sub(r'[ÌÍỊỈĨ]', 'I', s)
-    s = re.sub(r'[ùúụủũưừứựửữ]', 'u', s);
-    s = re.sub(r'[ÙÚỤỦŨƯỪỨỰỬỮ]', 'U', s)
-    s = re.sub(r'[ỳýỵỷỹ]', 'y', s);
-    s = re.sub(r'[ỲÝỴỶỸ]', 'Y', s)
-    s = re.sub(r'[đ]', 'd', s);
-    s = re.sub(r'[Đ]', 'D', s)
-    return s
-
-
 def generate_new_gift_code():
-    df_g = pd.read_csv(FILE_PATH["gifts"])
+    df_g = kho_sqlite.read_gifts(FILE_PATH["db"])
     if df_g.empty: return "QT0001"
     codes = [c for c in df_g['MaQua'].astype(str).tolist() if c.startswith("QT") and len(c) == 6]
     if not codes: return "QT0001"
@@ -75,9 +50,7 @@ def generate_new_gift_code():
 
 
 def get_current_stock(ma_qua):
-    df_t = pd.read_csv(FILE_PATH["trans"])
-    if df_t.empty: return 0
-    return df_t[df_t["MaQua"].astype(str) == str(ma_qua)]["SoLuong"].sum()
+    return kho_sqlite.get_stock(FILE_PATH["db"], ma_qua)
 
 
 def export_pdf_reportlab(df, date_range):
@@ -117,7 +90,7 @@ def export_pdf_reportlab(df, date_range):
 
 # --- 4. GIAO DIỆN CHÍNH ---
 st.set_page_config(page_title="Hệ Thống Kho Quà TNF", layout="wide")
-init_csv()
+kho_sqlite.init_db(FILE_PATH["db"], FILE_PATH["gifts"], FILE_PATH["trans"])
 
 if 'user_info' not in st.session_state:
     saved_user = load_session()
@@ -146,7 +119,7 @@ tabs = st.tabs(["📤 Xuất kho", "📥 Nhập kho", "📊 Báo cáo XNT", "
 
 
 def render_form(type_f="XUẤT"):
-    df_g = pd.read_csv(FILE_PATH["gifts"])
+    df_g = kho_sqlite.read_gifts(FILE_PATH["db"])
 
     # 1. Chuẩn bị danh sách Dropbox
     gift_list = df_g.apply(lambda x: f"{x['MaQua']} - {x['TenQua']}", axis=1).tolist()
@@ -210,8 +183,7 @@ def render_form(type_f="XUẤT"):
             f_ten = st.session_state[f"disp_ten_{type_f}"]
 
             if so_ct and f_ma and f_ten:
-                # Ghi vào nhật ký
-                df_t = pd.read_csv(FILE_PATH["trans"])
+                # Ghi nhật ký (kèm quà mới nếu có) trong một giao dịch SQLite
                 new_t = {
                     "Loai": type_f, "Ngay": date.today().strftime("%Y-%m-%d"),
                     "Gio": datetime.now().strftime("%H:%M:%S"),
@@ -219,14 +191,7 @@ def render_form(type_f="XUẤT"):
                     "NguoiThucHien": f"{st.session_state['user_info']['id']} - {st.session_state['user_info']['name']}",
                     "GhiChu": note
                 }
-                pd.concat([df_t, pd.DataFrame([new_t])], ignore_index=True).to_csv(FILE_PATH["trans"], index=False,
-                                                                                   encoding='utf-8-sig')
-
-                # Lưu vào danh mục nếu là quà mới
-                if is_new:
-                    df_g_now = pd.read_csv(FILE_PATH["gifts"])
-                    pd.concat([df_g_now, pd.DataFrame([{"MaQua": f_ma, "TenQua": f_ten}])], ignore_index=True).to_csv(
-                        FILE_PATH["gifts"], index=False, encoding='utf-8-sig')
+                kho_sqlite.add_transaction(FILE_PATH["db"], new_t, {"MaQua": f_ma, "TenQua": f_ten} if is_new else None)
 
                 st.success("✅ Đã lưu thành công!");
                 time.sleep(0.5)
@@ -249,22 +214,7 @@ with tabs[2]:
     d2 = c2.date_input("Đến ngày", date.today(), key="rep_d2")
 
     if st.button("📊 Chạy báo cáo", use_container_width=True):
-        df_t = pd.read_csv(FILE_PATH["trans"])
-        if not df_t.empty:
-            df_t['Ngay'] = pd.to_datetime(df_t['Ngay']).dt.date
-            df_g, r_list = pd.read_csv(FILE_PATH["gifts"]), []
-            for _, item in df_g.iterrows():
-                m, t = item['MaQua'], item['TenQua']
-                t_dau = df_t[(df_t['MaQua'] == m) & (df_t['Ngay'] < d1)]['SoLuong'].sum()
-                nhap = \
-                df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "NHẬP") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                    'SoLuong'].sum()
-                xuat = abs(
-                    df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "XUẤT") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                        'SoLuong'].sum())
-                r_list.append(
-                    {"Mã": m, "Tên": t, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat, "Tồn cuối": t_dau + nhap - xuat})
-            st.session_state['report_final'] = pd.DataFrame(r_list)
+        st.session_state['report_final'] = kho_sqlite.xnt_report(FILE_PATH["db"], d1, d2)
 
     if 'report_final' in st.session_state:
         st.dataframe(st.session_state['report_final'], use_container_width=True, hide_index=True)
@@ -278,4 +228,4 @@ with tabs[2]:
 
 with tabs[3]:
     st.subheader("Lịch sử giao dịch")
-    st.dataframe(pd.read_csv(FILE_PATH["trans"]).iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
+    st.dataframe(kho_sqlite.read_trans(FILE_PATH["db"]).iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
@@ -4,29 +4,23 @@ import os
 from datetime import datetime, date
 import io
 import time
-import re
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
+from kho_core import no_accent_vietnamese
+import kho_sqlite
 
 # --- 1. CẤU HÌNH HỆ THỐNG & FILE ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FILE_PATH = {
     "gifts": os.path.join(BASE_DIR, "danhmuc_qua.csv"),
     "trans": os.path.join(BASE_DIR, "nhatky_xuatnhap.csv"),
+    "db": os.path.join(BASE_DIR, "kho_qua.db"),
     "session": os.path.join(BASE_DIR, "user_session.txt")
 }
 ADMIN_PASSWORD = "2605"  # Thay đổi mật khẩu của bạn tại đây
 
 
-def init_csv():
-    if not os.path.exists(FILE_PATH["gifts"]):
-        pd.DataFrame(columns=["MaQua", "TenQua"]).to_csv(FILE_PATH["gifts"], index=False, encoding='utf-8-sig')
-    if not os.path.exists(FILE_PATH["trans"]):
-        pd.DataFrame(columns=["Loai", "Ngay", "Gio", "SoChungTu", "MaQua", "TenQua", "SoLuong", "NguoiThucHien",
-                              "GhiChu"]).to_csv(FILE_PATH["trans"], index=False, encoding='utf-8-sig')
-
-
 # --- 2. QUẢN LÝ PHIÊN & BẢO MẬT ---
 def save_session(u_id, u_name):
     with open(FILE_PATH["session"], "w", encoding="utf-8") as f:
@@ -47,27 +41,8 @@ def clear_session():
 
 
 # --- 3. TIỆN ÍCH PDF & LOGIC ---
-def no_accent_vietnamese(s):
-    s = str(s)
-    s = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', s);
-    s = re.sub(r'[ÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴ]', 'A', s)
-    s = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', s);
-    s = re.sub(r'[ÈÉẸẺẼÊỀẾỆỂỄ]', 'E', s)
-    s = re.sub(r'[òóọỏõôồốộổỗơờớợởỡ]', 'o', s);
-    s = re.sub(r'[ÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠ]', 'O', s)
-    s = re.sub(r'[ìíịỉĩ]', 'i', s);
-    s = re.sub(r'[ÌÍỊỈĨ]', 'I', s)
-    s = re.sub(r'[ùúụủũưừứựửữ]', 'u', s);
-    s = re.sub(r'[ÙÚỤỦŨƯỪỨỰỬỮ]', 'U', s)
-    s = re.sub(r'[ỳýỵỷỹ]', 'y', s);
-    s = re.sub(r'[ỲÝỴỶỸ]', 'Y', s)
-    s = re.sub(r'[đ]', 'd', s);
-    s = re.sub(r'[Đ]', 'D', s)
-    return s
-
-
 def generate_new_gift_code():
-    df_g = pd.read_csv(FILE_PATH["gifts"])
+    df_g = kho_sqlite.read_gifts(FILE_PATH["db"])
     if df_g.empty: return "QT0001"
     codes = [c for c in df_g['MaQua'].astype(str).tolist() if c.startswith("QT") and len(c) == 6]
     nums = [int(c[2:]) for c in codes if c[2:].isdigit()]
@@ -75,9 +50,7 @@ def generate_new_gift_code():
 
 
 def get_current_stock(ma_qua):
-    df_t = pd.read_csv(FILE_PATH["trans"])
-    if df_t.empty: return 0
-    return df_t[df_t["MaQua"].astype(str) == str(ma_qua)]["SoLuong"].sum()
+    return kho_sqlite.get_stock(FILE_PATH["db"], ma_qua)
 
 
 def export_pdf_reportlab(df, date_range):
@@ -117,7 +90,7 @@ def export_pdf_reportlab(df, date_range):
 
 # --- 4. GIAO DIỆN CHÍNH ---
 st.set_page_config(page_title="Hệ Thống Kho Quà TNF", layout="wide")
-init_csv()
+kho_sqlite.init_db(FILE_PATH["db"], FILE_PATH["gifts"], FILE_PATH["trans"])
 
 if 'user_info' not in st.session_state:
     saved_user = load_session()
@@ -149,20 +122,23 @@ with st.sidebar:
         if pwd == ADMIN_PASSWORD:
             st.success("Xác thực thành công!")
             st.write("📤 **Sao lưu (Backup)**")
-            for key, path in FILE_PATH.items():
-                if key != "session" and os.path.exists(path):
-                    with open(path, "rb") as f:
-                        st.download_button(label=f"Tải {key.upper()}", data=f, file_name=f"{key}_backup.csv",
-                                           mime="text/csv", use_container_width=True, key=f"bk_{key}")
+            for key, df_bk in [("gifts", kho_sqlite.read_gifts(FILE_PATH["db"])),
+                               ("trans", kho_sqlite.read_trans(FILE_PATH["db"]))]:
+                st.download_button(label=f"Tải {key.upper()}", data=df_bk.to_csv(index=False).encode('utf-8-sig'),
+                                   file_name=f"{key}_backup.csv", mime="text/csv", use_container_width=True,
+                                   key=f"bk_{key}")
 
             st.write("📥 **Phục hồi (Restore)**")
+            if "restore_msg" in st.session_state: st.warning(st.session_state.pop("restore_msg"))
             target = st.selectbox("Loại file", ["Danh mục quà", "Nhật ký"])
             up_file = st.file_uploader("Chọn file CSV", type="csv")
             if up_file and st.button("XÁC NHẬN GHI ĐÈ", type="primary", use_container_width=True):
                 try:
-                    df_up = pd.read_csv(up_file)
-                    dest = FILE_PATH["gifts"] if target == "Danh mục quà" else FILE_PATH["trans"]
-                    df_up.to_csv(dest, index=False, encoding='utf-8-sig')
+                    # Đọc mã quà / số chứng từ dạng chuỗi như kho_sqlite._import_csv ("0012" không thành 12)
+                    df_up = pd.read_csv(up_file, dtype={"MaQua": str, "SoChungTu": str})
+                    dest = "danhmuc_qua" if target == "Danh mục quà" else "nhatky_xuatnhap"
+                    n_bo = kho_sqlite.replace_table(FILE_PATH["db"], dest, df_up)
+                    if n_bo: st.session_state["restore_msg"] = f"⚠️ Bỏ qua {n_bo} dòng trùng mã hoặc thiếu mã quà"
                     st.success("Đã phục hồi!");
                     time.sleep(1);
                     st.rerun()
@@ -176,7 +152,7 @@ tabs = st.tabs(["📤 Xuất kho", "📥 Nhập kho", "📊 Báo cáo XNT", "
 
 
 def render_form(type_f="XUẤT"):
-    df_g = pd.read_csv(FILE_PATH["gifts"])
+    df_g = kho_sqlite.read_gifts(FILE_PATH["db"])
     if f"ma_{type_f}" not in st.session_state: st.session_state[f"ma_{type_f}"] = ""
     if f"ten_{type_f}" not in st.session_state: st.session_state[f"ten_{type_f}"] = ""
     if f"show_list_{type_f}" not in st.session_state: st.session_state[f"show_list_{type_f}"] = False
@@ -236,19 +212,14 @@ def render_form(type_f="XUẤT"):
 
             if st.button(f"💾 LƯU PHIẾU {type_f}", type="primary", use_container_width=True):
                 if so_ct and curr_ma and curr_ten:
-                    df_t = pd.read_csv(FILE_PATH["trans"])
                     new_t = {"Loai": type_f, "Ngay": date.today().strftime("%Y-%m-%d"),
                              "Gio": datetime.now().strftime("%H:%M:%S"),
                              "SoChungTu": so_ct, "MaQua": curr_ma, "TenQua": curr_ten,
                              "SoLuong": sl if type_f == "NHẬP" else -sl,
                              "NguoiThucHien": f"{st.session_state['user_info']['id']} - {st.session_state['user_info']['name']}",
                              "GhiChu": note}
-                    pd.concat([df_t, pd.DataFrame([new_t])], ignore_index=True).to_csv(FILE_PATH["trans"], index=False,
-                                                                                       encoding='utf-8-sig')
-                    if is_new:
-                        df_g_now = pd.read_csv(FILE_PATH["gifts"])
-                        pd.concat([df_g_now, pd.DataFrame([{"MaQua": curr_ma, "TenQua": curr_ten}])],
-                                  ignore_index=True).to_csv(FILE_PATH["gifts"], index=False, encoding='utf-8-sig')
+                    kho_sqlite.add_transaction(FILE_PATH["db"], new_t,
+                                               {"MaQua": curr_ma, "TenQua": curr_ten} if is_new else None)
                     st.success("✅ Đã lưu!");
                     time.sleep(0.5)
                     for k in [f"src_{type_f}", f"ct_{type_f}", f"sl_{type_f}", f"note_{type_f}", f"ma_{type_f}",
@@ -268,22 +239,7 @@ with tabs[2]:
     d1, d2 = c1.date_input("Từ ngày", date(date.today().year, date.today().month, 1)), c2.date_input("Đến ngày",
                                                                                                      date.today())
     if st.button("📊 Chạy báo cáo", use_container_width=True):
-        df_t = pd.read_csv(FILE_PATH["trans"])
-        if not df_t.empty:
-            df_t['Ngay'] = pd.to_datetime(df_t['Ngay']).dt.date
-            df_g, r_list = pd.read_csv(FILE_PATH["gifts"]), []
-            for _, item in df_g.iterrows():
-                m, t = item['MaQua'], item['TenQua']
-                t_dau = df_t[(df_t['MaQua'] == m) & (df_t['Ngay'] < d1)]['SoLuong'].sum()
-                nhap = \
-                df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "NHẬP") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                    'SoLuong'].sum()
-                xuat = abs(
-                    df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "XUẤT") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                        'SoLuong'].sum())
-                r_list.append(
-                    {"Mã": m, "Tên": t, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat, "Tồn cuối": t_dau + nhap - xuat})
-            st.session_state['rep'] = pd.DataFrame(r_list)
+        st.session_state['rep'] = kho_sqlite.xnt_report(FILE_PATH["db"], d1, d2)
     if 'rep' in st.session_state:
         st.dataframe(st.session_state['rep'], use_container_width=True, hide_index=True)
         ce, cp = st.columns(2)
@@ -295,4 +251,4 @@ with tabs[2]:
 
 with tabs[3]:
     st.subheader("Lịch sử")
-    st.dataframe(pd.read_csv(FILE_PATH["trans"]).iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
+    st.dataframe(kho_sqlite.read_trans(FILE_PATH["db"]).iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
@@ -4,48 +4,23 @@ import os
 from datetime import datetime, date
 import io
 import time
-import re
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
+from kho_core import no_accent_vietnamese
+import kho_sqlite
 
 # --- 1. CẤU HÌNH FILE ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FILE_PATH = {
     "gifts": os.path.join(BASE_DIR, "danhmuc_qua.csv"),
-    "trans": os.path.join(BASE_DIR, "nhatky_xuatnhap.csv")
+    "trans": os.path.join(BASE_DIR, "nhatky_xuatnhap.csv"),
+    "db": os.path.join(BASE_DIR, "kho_qua.db")
 }
 
 
-def init_csv():
-    if not os.path.exists(FILE_PATH["gifts"]):
-        pd.DataFrame(columns=["MaQua", "TenQua"]).to_csv(FILE_PATH["gifts"], index=False, encoding='utf-8-sig')
-    if not os.path.exists(FILE_PATH["trans"]):
-        pd.DataFrame(columns=["Loai", "Ngay", "Gio", "SoChungTu", "MaQua", "TenQua", "SoLuong", "NguoiThucHien",
-                              "GhiChu"]).to_csv(FILE_PATH["trans"], index=False, encoding='utf-8-sig')
-
-
-def no_accent_vietnamese(s):
-    s = str(s)
-    s = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', s);
-    s = re.sub(r'[ÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴ]', 'A', s)
-    s = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', s);
-    s = re.sub(r'[ÈÉẸẺẼÊỀẾỆỂỄ]', 'E', s)
-    s = re.sub(r'[òóọỏõôồốộổỗơờớợởỡ]', 'o', s);
-    s = re.sub(r'[ÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠ]', 'O', s)
-    s = re.sub(r'[ìíịỉĩ]', 'i', s);
-    s = re.sub(r'[ÌÍỊỈĨ]', 'I', s)
-    s = re.sub(r'[ùúụủũưừứựửữ]', 'u', s);
-    s = re.sub(r'[ÙÚỤỦŨƯỪỨỰỬỮ]', 'U', s)
-    s = re.sub(r'[ỳýỵỷỹ]', 'y', s);
-    s = re.sub(r'[ỲÝỴỶỸ]', 'Y', s)
-    s = re.sub(r'[đ]', 'd', s);
-    s = re.sub(r'[Đ]', 'D', s)
-    return s
-
-
 def generate_new_gift_code():
-    df_g = pd.read_csv(FILE_PATH["gifts"])
+    df_g = kho_sqlite.read_gifts(FILE_PATH["db"])
     if df_g.empty: return "QT0001"
     codes = [c for c in df_g['MaQua'].astype(str).tolist() if c.startswith("QT") and len(c) == 6]
     if not codes: return "QT0001"
@@ -54,9 +29,7 @@ def generate_new_gift_code():
 
 
 def get_current_stock(ma_qua):
-    df_t = pd.read_csv(FILE_PATH["trans"])
-    if df_t.empty: return 0
-    return df_t[df_t["MaQua"].astype(str) == str(ma_qua)]["SoLuong"].sum()
+    return kho_sqlite.get_stock(FILE_PATH["db"], ma_qua)
 
 
 # --- HÀM XUẤT PDF MỚI (REPORTLAB) ---
@@ -113,7 +86,7 @@ def export_pdf_reportlab(df, date_range):
 
 # --- 2. GIAO DIỆN ---
 st.set_page_config(page_title="Quà Tặng Vườn Xuân TNF", layout="wide")
-init_csv()
+kho_sqlite.init_db(FILE_PATH["db"], FILE_PATH["gifts"], FILE_PATH["trans"])
 
 if 'user_info' not in st.session_state:
     with st.container(border=True):
@@ -130,7 +103,7 @@ tabs = st.tabs(["📤 Xuất kho", "📥 Nhập kho", "📊 Báo cáo XNT", "
 
 
 def render_form(type_f="XUẤT"):
-    df_g = pd.read_csv(FILE_PATH["gifts"])
+    df_g = kho_sqlite.read_gifts(FILE_PATH["db"])
 
     # Khởi tạo state
     for key in [f"ma_{type_f}", f"ten_{type_f}", f"new_{type_f}"]:
@@ -193,18 +166,13 @@ def render_form(type_f="XUẤT"):
         if st.button(f"LƯU PHIẾU {type_f}", type="primary", use_container_width=True, disabled=disable_f):
             ma, ten = st.session_state[f"ma_{type_f}"], st.session_state[f"ten_{type_f}"]
             if ma and ten and so_ct:
-                df_t = pd.read_csv(FILE_PATH["trans"])
                 new_row = {"Loai": type_f, "Ngay": date.today().strftime("%Y-%m-%d"),
                            "Gio": datetime.now().strftime("%H:%M:%S"),
                            "SoChungTu": so_ct, "MaQua": ma, "TenQua": ten, "SoLuong": sl if type_f == "NHẬP" else -sl,
                            "NguoiThucHien": f"{st.session_state['user_info']['id']} - {st.session_state['user_info']['name']}",
                            "GhiChu": note}
-                pd.concat([df_t, pd.DataFrame([new_row])], ignore_index=True).to_csv(FILE_PATH["trans"], index=False,
-                                                                                     encoding='utf-8-sig')
-                if type_f == "NHẬP" and st.session_state[f"new_{type_f}"]:
-                    df_g_now = pd.read_csv(FILE_PATH["gifts"])
-                    pd.concat([df_g_now, pd.DataFrame([{"MaQua": ma, "TenQua": ten}])], ignore_index=True).to_csv(
-                        FILE_PATH["gifts"], index=False, encoding='utf-8-sig')
+                is_new = type_f == "NHẬP" and st.session_state[f"new_{type_f}"]
+                kho_sqlite.add_transaction(FILE_PATH["db"], new_row, {"MaQua": ma, "TenQua": ten} if is_new else None)
                 st.success("Đã lưu!");
                 time.sleep(0.5)
                 for k in [f"src_{type_f}", f"ct_{type_f}", f"ma_{type_f}", f"ten_{type_f}", f"sl_{type_f}",
@@ -223,22 +191,7 @@ with tabs[2]:
     d2 = c2.date_input("Đến ngày", date.today())
 
     if st.button("📊 Truy xuất dữ liệu", use_container_width=True):
-        df_t = pd.read_csv(FILE_PATH["trans"])
-        if not df_t.empty:
-            df_t['Ngay'] = pd.to_datetime(df_t['Ngay']).dt.date
-            df_g, r_list = pd.read_csv(FILE_PATH["gifts"]), []
-            for _, item in df_g.iterrows():
-                m, t = item['MaQua'], item['TenQua']
-                t_dau = df_t[(df_t['MaQua'] == m) & (df_t['Ngay'] < d1)]['SoLuong'].sum()
-                nhap = \
-                df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "NHẬP") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                    'SoLuong'].sum()
-                xuat = abs(
-                    df_t[(df_t['MaQua'] == m) & (df_t['Loai'] == "XUẤT") & (df_t['Ngay'] >= d1) & (df_t['Ngay'] <= d2)][
-                        'SoLuong'].sum())
-                r_list.append(
-                    {"Mã": m, "Tên": t, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat, "Tồn cuối": t_dau + nhap - xuat})
-            st.session_state['report_df'] = pd.DataFrame(r_list)
+        st.session_state['report_df'] = kho_sqlite.xnt_report(FILE_PATH["db"], d1, d2)
 
     if 'report_df' in st.session_state:
         st.dataframe(st.session_state['report_df'], use_container_width=True, hide_index=True)
@@ -253,4 +206,4 @@ with tabs[2]:
 
 with tabs[3]:
     st.subheader("Nhật ký")
-    st.dataframe(pd.read_csv(FILE_PATH["trans"]).iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
+    st.dataframe(kho_sqlite.read_trans(FILE_PATH["db"]).iloc[::-1], use_container_width=True, hide_index=True)
\ No newline at end of file
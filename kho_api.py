@@ -0,0 +1,261 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import kho_sqlite
+from kho_cli import JOURNAL_SHEET, load_all, open_spreadsheet
+from kho_core import BalanceIndex, GiftSearchIndex, StockBalance, voucher_rows, voucher_shortages
+from kho_gsheet import active_shard, append_with_rollover
+from kho_report import closing_dates, xnt_report_from_index
+
+# Dịch vụ HTTP cục bộ cho máy quét / lễ tân, không qua Streamlit:
+#   POST /giaodich  {"Loai": "XUẤT", "SoChungTu": "PX01", "NguoiThucHien": "...", "Ngay": "YYYY-MM-DD" (tùy chọn),
+#                    "lines": [{"MaQua": "QT0001", "SoLuong": 2, "GhiChu": ""}, ...]}
+#   GET  /ton?ma=QT0001[&ma=QT0002]   GET /timqua?q=hoa&limit=3   GET /baocao?tu=YYYY-MM-DD&den=YYYY-MM-DD
+# Chạy: python kho_api.py --db kho_qua.db   hoặc   python kho_api.py --gsheet --credentials credentials.json
+# Các phiếu gửi đồng thời được gom lại: kiểm tra tồn trên một lần chụp và ghi bằng một lệnh duy nhất.
+
+
+class Store:
+    # Lớp lưu trữ phía sau API. Lớp con cài đặt gifts(), stock(ma_list), append(rows), report(d1, d2).
+    def __init__(self):
+        self._search = (None, None)
+
+    def search(self, q, limit=3):
+        df_g = self.gifts()
+        if self._search[0] is not df_g: self._search = (df_g, GiftSearchIndex(df_g))
+        return df_g.iloc[self._search[1].search(q, limit)]
+
+
+class SqliteStore(Store):
+    # Cùng file SQLite với các ứng dụng CSV (kho_sqlite); dùng file tạm làm bản thay thế khi kiểm thử
+    def __init__(self, db_path):
+        super().__init__()
+        self.db_path = db_path
+        kho_sqlite.init_db(db_path)
+        self._df_g = None
+
+    def gifts(self):
+        # Đọc lại danh mục mỗi lần nhưng giữ nguyên đối tượng khi không đổi để chỉ mục tìm kiếm không phải dựng lại
+        df_g = kho_sqlite.read_gifts(self.db_path)
+        if self._df_g is None or not df_g.equals(self._df_g): self._df_g = df_g
+        return self._df_g
+
+    def stock(self, ma_list):
+        return kho_sqlite.get_stocks(self.db_path, ma_list)
+
+    def append(self, rows):
+        kho_sqlite.add_transactions(self.db_path, rows)
+
+    def report(self, d1, d2):
+        return kho_sqlite.xnt_report(self.db_path, d1, d2)
+
+
+class SheetStore(Store):
+    # Cùng Google Sheet với QTVXTNF_GS3: tải toàn bộ một lần (số dư chốt sổ + các shard), dựng tồn/chỉ mục lũy kế,
+    # tải lại sau mỗi `reload_seconds`; dòng do chính API ghi được cộng thẳng vào chỉ mục.
+    def __init__(self, spreadsheet, reload_seconds=60):
+        super().__init__()
+        self.spreadsheet, self.reload_seconds = spreadsheet, reload_seconds
+        self._lock = threading.RLock()
+        self._loaded = None
+        self._balance, self._index = StockBalance(), BalanceIndex()
+
+    def _refresh(self):
+        with self._lock:
+            if self._loaded is not None and time.monotonic() - self._loaded < self.reload_seconds: return
+            self._df_g, live, df_sd, history, self._dir = load_all(self.spreadsheet)
+            self._closed = (closing_dates(df_sd) or [None])[-1]
+            self._n_active = len(live) - int(self._dir['SoDong'].iloc[:-1].sum())
+            self._balance.rebuild(history)
+            self._index.rebuild(history)
+            self._loaded = time.monotonic()
+
+    def gifts(self):
+        self._refresh()
+        return self._df_g
+
+    def stock(self, ma_list):
+        self._refresh()
+        return self._balance.snapshot(ma_list)
+
+    def append(self, rows):
+        # Ghi vào shard đang ghi; shard đầy thì kho_gsheet.append_with_rollover đóng lại như các ứng dụng
+        with self._lock:
+            self._refresh()
+            active = active_shard(self._dir, JOURNAL_SHEET)
+            self._dir, written = append_with_rollover(self.spreadsheet, JOURNAL_SHEET, rows, self._dir,
+                                                      self._n_active)[:2]
+            if written != active: self._n_active = 0
+            self._n_active += len(rows)
+            self._balance.apply(rows)
+            self._index.apply(rows)
+
+    def report(self, d1, d2):
+        # Chỉ mục dựng trên số dư lần chốt gần nhất + nhật ký còn mở; kỳ chạm vào phần đã chốt thì dựng riêng từ số
+        # dư của lần chốt trước d1 + lưu trữ
+        self._refresh()
+        if self._closed is None or pd.Timestamp(d1) > self._closed:
+            return xnt_report_from_index(self._df_g, self._index, d1, d2)
+        df_g, _, _, history, _ = load_all(self.spreadsheet, d1)
+        idx = BalanceIndex()
+        idx.rebuild(history)
+        return xnt_report_from_index(df_g, idx, d1, d2)
+
+
+def parse_voucher(body, known):
+    # Kiểm tra một phiếu gửi lên; trả về (phiếu đã chuẩn hóa, None) hoặc (None, lỗi)
+    loai = str(body.get("Loai", "")).strip().upper()
+    if loai not in ("NHẬP", "XUẤT"): return None, "Loai phải là NHẬP hoặc XUẤT"
+    so_ct = str(body.get("SoChungTu", "")).strip()
+    if not so_ct: return None, "Thiếu SoChungTu"
+    try:
+        ngay = date.fromisoformat(str(body.get("Ngay") or date.today()))
+    except ValueError:
+        return None, "Ngay không hợp lệ (YYYY-MM-DD)"
+    lines = []
+    for l in body.get("lines") or []:
+        ma = str(l.get("MaQua", "")).strip()
+        if ma not in known: return None, f"MaQua không có trong danh mục: {ma}"
+        try:
+            sl = int(l.get("SoLuong"))
+        except (TypeError, ValueError):
+            sl = 0
+        if sl <= 0: return None, f"SoLuong phải là số nguyên dương: {ma}"
+        lines.append({"MaQua": ma, "TenQua": known[ma], "SoLuong": sl, "GhiChu": str(l.get("GhiChu", ""))})
+    if not lines: return None, "Phiếu không có dòng nào"
+    return {"Loai": loai, "SoChungTu": so_ct, "Ngay": ngay.isoformat(), "lines": lines,
+            "NguoiThucHien": str(body.get("NguoiThucHien", ""))}, None
+
+
+class BatchWriter:
+    # Gom các phiếu gửi đồng thời: luồng ghi lấy mọi phiếu đang chờ (đợi thêm tối đa `wait` giây, tối đa max_batch
+    # phiếu), chụp tồn một lần cho cả lô, duyệt từng phiếu theo thứ tự đến (phiếu XUẤT thiếu hàng bị từ chối,
+    # phiếu được nhận trừ ngay vào tồn chụp) rồi ghi mọi dòng được nhận bằng một lệnh store.append.
+    def __init__(self, store, wait=0.02, max_batch=500):
+        self.store, self.wait, self.max_batch = store, wait, max_batch
+        self._q = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, voucher, timeout=60):
+        item = {"voucher": voucher, "done": threading.Event(), "result": None}
+        self._q.put(item)
+        if not item["done"].wait(timeout): return {"ok": False, "loi": "Hết thời gian chờ ghi"}
+        return item["result"]
+
+    def _run(self):
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            ton = self.store.stock({l["MaQua"] for it in batch for l in it["voucher"]["lines"]})
+            rows = []
+            for it in batch:
+                v = it["voucher"]
+                if v["Loai"] == "XUẤT":
+                    short = voucher_shortages(v["lines"], ton)
+                    if short:
+                        it["result"] = {"ok": False, "loi": "Không đủ tồn",
+                                        "thieu": [{"MaQua": ma, "can": n, "ton": t} for ma, n, t in short]}
+                        continue
+                sign = 1 if v["Loai"] == "NHẬP" else -1
+                for l in v["lines"]: ton[l["MaQua"]] = ton.get(l["MaQua"], 0) + sign * l["SoLuong"]
+                new = voucher_rows(v["lines"], v["Loai"], v["SoChungTu"], v["Ngay"], v["NguoiThucHien"])
+                rows += new
+                it["result"] = {"ok": True, "so_dong": len(new)}
+            if rows: self.store.append(rows)
+        except Exception as e:
+            for it in batch:
+                if it["result"] is None or it["result"]["ok"]: it["result"] = {"ok": False, "loi": str(e)}
+        finally:
+            for it in batch: it["done"].set()
+
+
+def make_handler(store, writer):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            qs = parse_qs(url.query)
+            try:
+                if url.path == "/ton":
+                    return self._send(200, store.stock(qs.get("ma", [])))
+                if url.path == "/timqua":
+                    found = store.search(qs.get("q", [""])[0], int(qs.get("limit", ["3"])[0]))
+                    return self._send(200, found[["MaQua", "TenQua"]].to_dict("records"))
+                if url.path == "/baocao":
+                    d1, d2 = date.fromisoformat(qs["tu"][0]), date.fromisoformat(qs["den"][0])
+                    return self._send(200, store.report(d1, d2).to_dict("records"))
+            except (KeyError, ValueError) as e:
+                return self._send(400, {"ok": False, "loi": str(e)})
+            self._send(404, {"ok": False, "loi": "Không có đường dẫn này"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/giaodich": return self._send(404, {"ok": False, "loi": "Không có đường dẫn này"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError:
+                return self._send(400, {"ok": False, "loi": "JSON không hợp lệ"})
+            df_g = store.gifts()
+            voucher, err = parse_voucher(body, dict(zip(df_g['MaQua'].astype(str), df_g['TenQua'].astype(str))))
+            if err: return self._send(400, {"ok": False, "loi": err})
+            result = writer.submit(voucher)
+            self._send(200 if result["ok"] else 409, result)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    # Hàng đợi kết nối mặc định (5) quá nhỏ khi nhiều máy quét gửi cùng lúc
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_server(store, host="127.0.0.1", port=8765, wait=0.02):
+    return Server((host, port), make_handler(store, BatchWriter(store, wait)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="API cục bộ Kho Quà Vườn Xuân TNF")
+    p.add_argument("--db", default="kho_qua.db", help="File SQLite (mặc định)")
+    p.add_argument("--gsheet", action="store_true", help="Dùng Google Sheet thay cho SQLite")
+    p.add_argument("--credentials", default="credentials.json")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    args = p.parse_args(argv)
+    if args.gsheet:
+        store = SheetStore(open_spreadsheet(args.credentials))
+    else:
+        store = SqliteStore(args.db)
+    server = make_server(store, args.host, args.port)
+    print(f"http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
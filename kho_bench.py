@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from kho_core import JOURNAL_COLUMNS, JOURNAL_SCHEMA, BalanceIndex, GiftSearchIndex, StockBalance, no_accent_vietnamese
+from kho_export import export_backup, export_excel_report, export_pdf_report
+from kho_gsheet import frame_from_values
+from kho_report import build_xnt_report, xnt_report_from_index
+
+# Đo thời gian các đường nóng của kho trên dữ liệu tổng hợp, ghi kết quả JSON để so sánh giữa các lần chạy:
+#   python kho_bench.py --sizes 1000x10000,10000x1000000 --out bench.json [--compare bench_cu.json]
+# Kích thước dạng <số quà>x<số dòng nhật ký>.
+DEFAULT_SIZES = "1000x10000,10000x100000,10000x1000000"
+# Sao lưu Excel (openpyxl) rất chậm trên nhật ký lớn: bỏ qua khi vượt số dòng này
+BACKUP_MAX_ROWS = 200000
+
+_LOAI_QUA = ["Hộp quà", "Giỏ quà", "Bánh", "Trà", "Mứt", "Lịch", "Nến thơm", "Rượu vang", "Hạt điều", "Kẹo",
+             "Cà phê", "Sổ tay", "Bình giữ nhiệt", "Túi vải", "Áo thun"]
+_MO_TA = ["Tết", "Xuân", "cao cấp", "Đà Lạt", "Bảo Lộc", "truyền thống", "Phú Quốc", "đặc biệt", "Vườn Xuân",
+          "Hoa Đào", "Hoa Mai", "Buôn Ma Thuột", "Sen Tây Hồ", "thủ công", "mini"]
+_NGUOI = ["Nguyễn Văn An", "Trần Thị Bích", "Lê Hoàng Cường", "Phạm Thu Dung", "Võ Minh Đức", "Đặng Thị Hạnh"]
+
+
+def make_gifts(n, rng):
+    # Tên quà tiếng Việt ghép từ loại + mô tả + quy cách, mã QT0001.. như generate_new_gift_code
+    loai = rng.choice(_LOAI_QUA, n)
+    mo_ta = rng.choice(_MO_TA, n)
+    quy_cach = rng.integers(1, 50, n) * 50
+    return pd.DataFrame({"MaQua": [f"QT{i:04d}" for i in range(1, n + 1)],
+                         "TenQua": [f"{a} {b} {c}g" for a, b, c in zip(loai, mo_ta, quy_cach)]})
+
+
+def make_journal(df_g, n, rng, years=3):
+    # Độ phổ biến lệch (Zipf: vài món chiếm phần lớn giao dịch), ngày trải nhiều năm và dồn vào mùa Tết,
+    # XUẤT nhiều dòng lẻ, NHẬP ít dòng nhưng số lượng lớn. Trả về dạng chuỗi như get_all_values.
+    weights = 1.0 / np.arange(1, len(df_g) + 1) ** 1.1
+    gift = rng.permutation(len(df_g))[rng.choice(len(df_g), n, p=weights / weights.sum())]
+    start = np.datetime64(date(date.today().year - years, 1, 1))
+    day = rng.integers(0, 365 * years, n)
+    tet = rng.random(n) < 0.3  # 30% giao dịch rơi vào tháng 12 - tháng 2 (-30..59 ngày quanh đầu năm)
+    day[tet] = (day[tet] // 365) * 365 + rng.integers(-30, 60, tet.sum()) % 365
+    ngay = (start + np.sort(day).astype("timedelta64[D]")).astype(str)
+    nhap = rng.random(n) < 0.3
+    so_luong = np.where(nhap, rng.integers(20, 500, n), -rng.integers(1, 20, n))
+    ma = df_g['MaQua'].to_numpy()[gift]
+    return pd.DataFrame({"Loai": np.where(nhap, "NHẬP", "XUẤT"), "Ngay": ngay, "MaQua": ma,
+                         "TenQua": df_g['TenQua'].to_numpy()[gift], "SoLuong": so_luong.astype(str),
+                         "SoChungTu": [f"{'PN' if x else 'PX'}{i:07d}" for i, x in enumerate(nhap)],
+                         "NguoiThucHien": rng.choice(_NGUOI, n), "GhiChu": ""}, columns=JOURNAL_COLUMNS)
+
+
+def _built(index_cls, df_t):
+    idx = index_cls()
+    idx.rebuild(df_t)
+    return idx
+
+
+def timeit(fn, repeat):
+    runs, out = [], None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        runs.append(time.perf_counter() - t)
+    return runs, out
+
+
+def bench_size(n_gifts, n_rows, repeat, seed=0):
+    rng = np.random.default_rng(seed)
+    df_g = make_gifts(n_gifts, rng)
+    raw = make_journal(df_g, n_rows, rng)
+    values = [raw.columns.tolist()] + raw.values.tolist()  # giống kết quả worksheet.get_all_values()
+    del raw
+    today = date.today()
+    d1, d2 = today.replace(day=1), today
+    queries = [no_accent_vietnamese(t).lower().split()[0] for t in df_g['TenQua'].sample(50, random_state=seed)] + \
+              list(df_g['MaQua'].sample(50, random_state=seed))
+    codes = df_g['MaQua'].sample(1000, replace=True, random_state=seed).tolist()
+    results = {}
+
+    def case(name, fn, n=repeat):
+        runs, out = timeit(fn, n)
+        results[name] = {"median_s": statistics.median(runs), "min_s": min(runs), "runs_s": runs}
+        print(f"  {name:<28} {statistics.median(runs):9.4f}s", flush=True)
+        return out
+
+    df_t = case("load_journal", lambda: frame_from_values(values, JOURNAL_SCHEMA))
+    del values
+    bal = case("stock_build", lambda: _built(StockBalance, df_t))
+    case("stock_get_x1000", lambda: [bal.get(m) for m in codes])
+    case("stock_scan_x10", lambda: [int(df_t.loc[df_t['MaQua'] == m, 'SoLuong'].sum()) for m in codes[:10]])
+    idx = case("search_build", lambda: GiftSearchIndex(df_g))
+    case("search_x100", lambda: [idx.search(q) for q in queries])
+    rep = case("report_groupby", lambda: build_xnt_report(df_g, df_t, d1, d2))
+    bidx = case("report_index_build", lambda: _built(BalanceIndex, df_t))
+    case("report_index_query", lambda: xnt_report_from_index(df_g, bidx, d1, d2))
+    case("export_pdf", lambda: export_pdf_report(rep, d1, d2))
+    case("export_excel_report", lambda: export_excel_report(rep))
+    if n_rows <= BACKUP_MAX_ROWS: case("export_backup", lambda: export_backup(df_g, df_t), 1)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(new, old):
+    # In tỉ lệ thời gian (mới / cũ) cho các case có ở cả hai lần chạy; > 1 là chậm đi
+    old_runs = {r["size"]: r["cases"] for r in old["results"]}
+    for r in new["results"]:
+        for name, c in r["cases"].items():
+            prev = old_runs.get(r["size"], {}).get(name)
+            if prev: print(f"{r['size']:>16} {name:<28} {c['median_s'] / max(prev['median_s'], 1e-9):6.2f}x")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark các đường nóng của Kho Quà Vườn Xuân TNF")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help="Danh sách <số quà>x<số dòng>, cách nhau bởi dấu phẩy")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default="bench.json")
+    p.add_argument("--compare", help="File JSON của một lần chạy trước để so sánh")
+    args = p.parse_args(argv)
+
+    report = {"meta": {"time": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                       "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                       "machine": platform.platform(), "repeat": args.repeat, "seed": args.seed},
+              "results": []}
+    for size in args.sizes.split(","):
+        n_gifts, n_rows = (int(x) for x in size.lower().split("x"))
+        print(f"{n_gifts} quà x {n_rows} dòng", flush=True)
+        report["results"].append({"size": size, "gifts": n_gifts, "rows": n_rows,
+                                  "cases": bench_size(n_gifts, n_rows, args.repeat, args.seed)})
+    with open(args.out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    print(args.out)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f: compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
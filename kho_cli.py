@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import gspread
+import pandas as pd
+from google.oauth2.service_account import Credentials
+
+from kho_core import BALANCE_SCHEMA, JOURNAL_SCHEMA, BalanceIndex, concat_frames
+from kho_export import export_backup, export_excel_report, export_pdf_report
+from kho_fakesheets import fake_client_from_env
+from kho_gsheet import SHARD_DIRECTORY, SHARD_SCHEMA, fetch_many, is_shard, shard_directory
+from kho_quota import rate_limited
+from kho_report import balance_as_journal, closing_dates, xnt_report_from_index
+
+# Chạy báo cáo XNT / sao lưu không cần Streamlit (vd. cron hằng đêm):
+#   python kho_cli.py --tu 2026-01-01 --den 2026-09-30 --thang --out bao_cao --backup
+# Toàn bộ dữ liệu được tải một lần (một lệnh batch), mọi kỳ báo cáo dùng chung một chỉ mục lũy kế.
+SHEET_ID = "1Q1JmyrwjySDpoaUcjc1Wr5S40Oju9lHGK_Q9rv58KAg"
+SCOPE = ["https://www.googleapis.com/auth/spreadsheets"]
+GIFT_SHEET = "danhmuc_qua"
+JOURNAL_SHEET = "nhatky_xuatnhap"
+SODU_SHEET = "sodu_chotso"
+ARCHIVE_PREFIX = "nhatky_"
+
+
+def open_spreadsheet(credentials_file, sheet_id=SHEET_ID):
+    # KHO_FAKE_SHEETS: Google Sheets giả trong bộ nhớ thay cho Google (không đọc credentials_file)
+    client = fake_client_from_env()
+    if client is None:
+        with open(credentials_file) as f:
+            client = gspread.authorize(Credentials.from_service_account_info(json.load(f), scopes=SCOPE))
+    return rate_limited(client).open_by_key(sheet_id)
+
+
+def is_archive_sheet(sheet_name):
+    return sheet_name.startswith(ARCHIVE_PREFIX) and sheet_name[len(ARCHIVE_PREFIX):].isdigit()
+
+
+def load_all(spreadsheet, d1=None):
+    # Trả về (danh mục, nhật ký còn mở, số dư chốt sổ, lịch sử, danh mục shard đã tải cùng lệnh batch). Lịch sử như load_journal của QTVXTNF_GS3: số dư lần
+    # chốt gần nhất + nhật ký còn mở; kỳ bắt đầu từ d1 chạm vào phần đã chốt thì dùng số dư của lần chốt trước d1 + các
+    # dòng lưu trữ sau lần chốt đó (chưa có lần chốt nào trước d1: toàn bộ lưu trữ).
+    titles = [ws.title for ws in spreadsheet.worksheets()]
+    archives = sorted(t for t in titles if is_archive_sheet(t))
+    shards = [t for t in titles if is_shard(JOURNAL_SHEET, t)]
+    names = [GIFT_SHEET] + [t for t in (SODU_SHEET, SHARD_DIRECTORY) if t in titles] + archives + shards
+    schemas = {SODU_SHEET: BALANCE_SCHEMA, SHARD_DIRECTORY: SHARD_SCHEMA,
+               **{t: JOURNAL_SCHEMA for t in archives + shards}}
+    data = {name: df for name, (df, _) in fetch_many(spreadsheet, names, schemas=schemas).items()}
+    df_dir = shard_directory(data.get(SHARD_DIRECTORY, pd.DataFrame()), JOURNAL_SHEET)
+    live = concat_frames([data[t] for t in df_dir['Shard'] if t in data] or [pd.DataFrame()])
+    df_sd = data.get(SODU_SHEET, pd.DataFrame())
+    dates = closing_dates(df_sd)
+    if not dates or d1 is None or pd.Timestamp(d1) > dates[-1]:
+        return data[GIFT_SHEET], live, df_sd, concat_frames([balance_as_journal(df_sd), live]), df_dir
+    base = max((d for d in dates if d < pd.Timestamp(d1)), default=None)
+    archived = [data[t] for t in archives if base is None or int(t[len(ARCHIVE_PREFIX):]) >= base.year]
+    archived = [a[a['Ngay'] > base] if base is not None else a for a in archived if not a.empty]
+    opening = balance_as_journal(df_sd, base) if base is not None else balance_as_journal(df_sd.iloc[:0])
+    return data[GIFT_SHEET], live, df_sd, concat_frames([opening] + archived + [live]), df_dir
+
+
+def month_periods(d1, d2):
+    # Tách [d1, d2] theo tháng dương lịch
+    periods, start = [], d1
+    while start <= d2:
+        nxt = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        periods.append((start, min(d2, nxt - timedelta(days=1))))
+        start = nxt
+    return periods
+
+
+def write_file(path, data):
+    with open(path, "wb") as f: f.write(data)
+    print(path)
+
+
+def main(argv=None):
+    last_month_end = date.today().replace(day=1) - timedelta(days=1)
+    p = argparse.ArgumentParser(description="Báo cáo Xuất - Nhập - Tồn và sao lưu Kho Quà Vườn Xuân TNF")
+    p.add_argument("--tu", type=date.fromisoformat, default=last_month_end.replace(day=1), help="Từ ngày (YYYY-MM-DD)")
+    p.add_argument("--den", type=date.fromisoformat, default=last_month_end, help="Đến ngày (YYYY-MM-DD)")
+    p.add_argument("--thang", action="store_true", help="Mỗi tháng trong kỳ một báo cáo riêng")
+    p.add_argument("--out", default=".", help="Thư mục ghi file")
+    p.add_argument("--backup", action="store_true", help="Ghi thêm file sao lưu Excel (DM/NK/SD)")
+    p.add_argument("--credentials", default="credentials.json")
+    p.add_argument("--sheet-id", default=SHEET_ID)
+    args = p.parse_args(argv)
+    if args.den < args.tu: p.error("--den phải sau --tu")
+
+    df_g, live, df_sd, history, _ = load_all(open_spreadsheet(args.credentials, args.sheet_id), args.tu)
+    os.makedirs(args.out, exist_ok=True)
+    idx = BalanceIndex()
+    idx.rebuild(history)
+    for d1, d2 in month_periods(args.tu, args.den) if args.thang else [(args.tu, args.den)]:
+        df_rep = xnt_report_from_index(df_g, idx, d1, d2)
+        write_file(os.path.join(args.out, f"bao_cao_XNT_{d1}_{d2}.xlsx"), export_excel_report(df_rep))
+        write_file(os.path.join(args.out, f"bao_cao_XNT_{d1}_{d2}.pdf"), export_pdf_report(df_rep, d1, d2))
+    if args.backup:
+        write_file(os.path.join(args.out, f"backup_vuonxuan_{date.today()}.xlsx"), export_backup(df_g, live, df_sd))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,469 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Các cột dùng để nhận diện "đuôi" nhật ký khi so khớp phiên bản
+JOURNAL_KEY_COLUMNS = ("Ngay", "MaQua", "SoLuong", "SoChungTu")
+
+# Kiểu dữ liệu của nhật ký sau khi tải: ép kiểu một lần ở đây thay cho to_numeric/to_datetime ở mỗi nơi dùng.
+# Các cột lặp nhiều giá trị để dạng category; cột không có trong bảng này vẫn là chuỗi.
+JOURNAL_SCHEMA = {"Loai": "category", "Ngay": "datetime", "MaQua": "category", "SoLuong": "int32",
+                  "NguoiThucHien": "category"}
+JOURNAL_COLUMNS = ["Loai", "Ngay", "MaQua", "TenQua", "SoLuong", "SoChungTu", "NguoiThucHien", "GhiChu"]
+# Bảng số dư chốt sổ: mỗi lần chốt ghi thêm một khối dòng (NgayChot, MaQua, TenQua, SoLuong)
+BALANCE_SCHEMA = {"NgayChot": "datetime", "MaQua": "category", "SoLuong": "int32"}
+BALANCE_COLUMNS = ["NgayChot", "MaQua", "TenQua", "SoLuong"]
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def _parse_dates(s):
+    # Dạng chuẩn YYYY-MM-DD[ HH:MM:SS] đi nhanh; các dạng khác (vd. 15/01/2024 gõ tay trên sheet) mới đoán từng giá trị
+    ngay = pd.to_datetime(s, errors="coerce", format="ISO8601")
+    bad = ngay.isna() & (s.fillna("").astype(str).str.strip() != "")
+    if bad.any(): ngay[bad] = pd.to_datetime(s[bad], errors="coerce", format="mixed", dayfirst=True)
+    return ngay
+
+
+def _cast(s, kind):
+    if kind == "datetime":
+        return s if pd.api.types.is_datetime64_any_dtype(s) else _parse_dates(s)
+    if kind == "category":
+        return s if isinstance(s.dtype, pd.CategoricalDtype) else s.fillna("").astype(str).astype("category")
+    if s.dtype == kind: return s
+    try:
+        return s.astype(kind)  # đường nhanh khi mọi ô đều là số nguyên hợp lệ
+    except (TypeError, ValueError):
+        return pd.to_numeric(s, errors="coerce").fillna(0).astype(kind)
+
+
+def apply_schema(df, schema=JOURNAL_SCHEMA):
+    # Trả về khung đã đúng kiểu; cột đã đúng kiểu thì giữ nguyên (gọi lại nhiều lần gần như không tốn gì)
+    cast = {c: _cast(df[c], kind) for c, kind in schema.items() if c in df.columns}
+    cast = {c: s for c, s in cast.items() if s is not df[c]}
+    return df.assign(**cast) if cast else df
+
+
+def concat_frames(frames):
+    # pd.concat biến cột category về object khi hai khung có tập giá trị khác nhau: hợp nhất category để giữ kiểu gọn
+    frames = [f for f in frames if len(f)] or frames[:1]
+    out = pd.concat(frames, ignore_index=True)
+    for c in out.columns:
+        cols = [f[c] for f in frames if c in f.columns]
+        if len(cols) == len(frames) and not isinstance(out[c].dtype, pd.CategoricalDtype) \
+                and all(isinstance(s.dtype, pd.CategoricalDtype) for s in cols):
+            out[c] = union_categoricals([s.array for s in cols], ignore_order=True)
+    return out
+
+
+def to_strings(df):
+    # Chiều ngược của apply_schema khi ghi lên sheet: ngày về YYYY-MM-DD (giữ giờ nếu có), còn lại là chuỗi như cũ
+    out = df.reset_index(drop=True)
+    for c in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[c]):
+            ngay = out[c]
+            fmt = DATE_FORMAT if (ngay.dropna() == ngay.dropna().dt.normalize()).all() else DATE_FORMAT + " %H:%M:%S"
+            out[c] = ngay.dt.strftime(fmt).fillna("")
+    return out.astype(str)
+
+
+# Bảng dịch ký tự có dấu -> không dấu (một lượt str.translate thay cho 14 lượt re.sub)
+_ACCENTS = {'àáạảãâầấậẩẫăằắặẳẵ': 'a', 'èéẹẻẽêềếệểễ': 'e', 'òóọỏõôồốộổỗơờớợởỡ': 'o', 'ìíịỉĩ': 'i',
+            'ùúụủũưừứựửữ': 'u', 'ỳýỵỷỹ': 'y', 'đ': 'd'}
+_NO_ACCENT_TABLE = str.maketrans({**{c: r for chars, r in _ACCENTS.items() for c in chars},
+                                  **{c.upper(): r.upper() for chars, r in _ACCENTS.items() for c in chars}})
+# Cùng bảng đó dưới dạng mảng tra cứu theo mã Unicode (mọi chữ có dấu tiếng Việt đều < U+1F00)
+_NO_ACCENT_LUT = np.arange(0x1F00, dtype=np.uint32)
+_NO_ACCENT_LUT[list(_NO_ACCENT_TABLE)] = [ord(v) for v in _NO_ACCENT_TABLE.values()]
+
+
+def no_accent_vietnamese(s):
+    return str(s).translate(_NO_ACCENT_TABLE)
+
+
+def no_accent_series(series):
+    # Bản vector hóa cho cả cột: nối mọi giá trị thành một chuỗi UTF-32, tra bảng bằng numpy rồi tách lại
+    values = [str(v) for v in series.tolist()]
+    codes = np.frombuffer("\x00".join(values).encode("utf-32-le"), dtype=np.uint32).copy()
+    small = codes < len(_NO_ACCENT_LUT)
+    codes[small] = _NO_ACCENT_LUT[codes[small]]
+    out = codes.tobytes().decode("utf-32-le").split("\x00") if values else []
+    if len(out) != len(values):  # giá trị có sẵn ký tự \x00: làm từng giá trị
+        out = [v.translate(_NO_ACCENT_TABLE) for v in values]
+    return pd.Series(out, index=series.index, name=series.name, dtype=object)
+
+
+def _to_number(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return 0
+
+
+def _key_value(v):
+    # Cùng một giá trị cho ra cùng chuỗi dù khung đã ép kiểu (Timestamp, int32) hay còn là chuỗi thô
+    return v.strftime(DATE_FORMAT) if isinstance(v, pd.Timestamp) else str(v)
+
+
+def journal_fingerprint(df_t):
+    # Dấu vân tay rẻ của nhật ký: số dòng + giá trị dòng cuối
+    if df_t.empty: return 0, None
+    last = df_t.iloc[-1]
+    return len(df_t), tuple(_key_value(last.get(c, "")) for c in JOURNAL_KEY_COLUMNS)
+
+
+class JournalIndex:
+    # Khung chung cho các chỉ mục dựng từ nhật ký: dựng một lần, cộng dồn khi ghi thêm dòng mới.
+    # Định kỳ (recheck_seconds) so vân tay với nhật ký thật và dựng lại nếu nhật ký bị sửa/thêm
+    # từ bên ngoài ứng dụng. Lớp con cài đặt _build(df_t) và _add(rows).
+    # version tăng mỗi khi nội dung chỉ mục đổi (dựng lại, ghi thêm, hủy) để làm khóa cho các bộ đệm phía sau.
+    # Khối ghi lớn hơn max_apply_rows dòng (vd. nhập hàng loạt) thì dựng lại lần sau thay vì cộng từng dòng.
+    max_apply_rows = 1000
+
+    def __init__(self, recheck_seconds=15):
+        self.recheck_seconds = recheck_seconds
+        self.version = 0
+        self._lock = threading.RLock()
+        self._fp = None
+        self._checked = 0.0
+
+    def rebuild(self, df_t):
+        with self._lock:
+            self._build(df_t)
+            self._fp, self._checked = journal_fingerprint(df_t), time.monotonic()
+            self.version += 1
+
+    def needs_check(self):
+        return self._fp is None or time.monotonic() - self._checked >= self.recheck_seconds
+
+    def sync(self, df_t):
+        with self._lock:
+            if journal_fingerprint(df_t) != self._fp:
+                self.rebuild(df_t)
+            else:
+                self._checked = time.monotonic()
+
+    def apply(self, rows):
+        with self._lock:
+            if self._fp is None or not rows: return
+            if len(rows) > self.max_apply_rows:
+                self._fp = None
+                self.version += 1
+                return
+            self._add(rows)
+            self._fp = (self._fp[0] + len(rows), tuple(_key_value(rows[-1].get(c, "")) for c in JOURNAL_KEY_COLUMNS))
+            self.version += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._fp = None
+            self.version += 1
+
+
+class StockBalance(JournalIndex):
+    # Bảng tồn kho theo MaQua, tra cứu O(1)
+    def __init__(self, recheck_seconds=15):
+        super().__init__(recheck_seconds)
+        self._ton = {}
+
+    def _build(self, df_t):
+        if df_t.empty or not {"MaQua", "SoLuong"}.issubset(df_t.columns):
+            self._ton = {}
+            return
+        df_t = apply_schema(df_t)
+        self._ton = df_t['SoLuong'].astype("int64").groupby(df_t['MaQua'], observed=True).sum().to_dict()
+
+    def _add(self, rows):
+        for r in rows:
+            ma = str(r["MaQua"])
+            self._ton[ma] = self._ton.get(ma, 0) + _to_number(r.get("SoLuong"))
+
+    def get(self, ma_qua):
+        return self._ton.get(str(ma_qua), 0)
+
+    def snapshot(self, ma_list):
+        # Tồn của nhiều mã đọc cùng một lúc (không lẫn dòng ghi chen giữa các lần get)
+        with self._lock:
+            return {str(m): self._ton.get(str(m), 0) for m in ma_list}
+
+
+def voucher_rows(lines, loai, so_ct, ngay, nguoi):
+    # Các dòng của một phiếu ({MaQua, TenQua, SoLuong, GhiChu}) thành các dòng nhật ký cùng SoChungTu; XUẤT ghi số âm
+    sign = 1 if loai == "NHẬP" else -1
+    return [{"Loai": loai, "Ngay": ngay, "MaQua": l["MaQua"], "TenQua": l["TenQua"], "SoLuong": sign * int(l["SoLuong"]),
+             "SoChungTu": so_ct, "NguoiThucHien": nguoi, "GhiChu": l.get("GhiChu", "")} for l in lines]
+
+
+def voucher_shortages(lines, ton):
+    # Phiếu XUẤT: cộng số lượng theo MaQua (một quà có thể nằm trên nhiều dòng) rồi so với tồn `ton` {MaQua: tồn}
+    # chụp một lần cho cả phiếu. Trả về [(MaQua, cần xuất, tồn)] của các mã không đủ hàng.
+    need = defaultdict(int)
+    for l in lines: need[str(l["MaQua"])] += int(l["SoLuong"])
+    return [(ma, n, ton.get(ma, 0)) for ma, n in need.items() if n > ton.get(ma, 0)]
+
+
+def _day_number(d):
+    return int(np.datetime64(pd.Timestamp(d), "D").astype(np.int64))
+
+
+class BalanceIndex(JournalIndex):
+    # Số dư lũy kế theo ngày của từng MaQua, mỗi mốc gồm (tổng, nhập, xuất) cộng dồn đến hết ngày đó.
+    # Lưu phẳng trong mảng numpy sắp theo khóa (mã quà, ngày): Tồn đầu tại ngày bất kỳ là một lần
+    # searchsorted, Nhập/Xuất của kỳ [d1, d2] là hiệu hai mốc, nên báo cáo không phải quét lại nhật ký.
+    _SPAN = 1 << 32  # khóa = id quà * _SPAN + ngày (tính từ 1970) + _SPAN // 2
+
+    def __init__(self, recheck_seconds=15):
+        super().__init__(recheck_seconds)
+        self._ids, self._key, self._cum = {}, np.empty(0, np.int64), np.empty((0, 3), np.int64)
+
+    def _keys(self, ids, days):
+        return np.asarray(ids, np.int64) * self._SPAN + np.asarray(days, np.int64) + self._SPAN // 2
+
+    def _build(self, df_t):
+        self._ids, self._key, self._cum = {}, np.empty(0, np.int64), np.empty((0, 3), np.int64)
+        if df_t.empty or not {"Loai", "Ngay", "MaQua", "SoLuong"}.issubset(df_t.columns): return
+        df_t = apply_schema(df_t)
+        df_t = df_t[df_t['Ngay'].notna()]
+        if df_t.empty: return
+        ma = df_t['MaQua'].cat.remove_unused_categories()
+        so_luong = df_t['SoLuong'].to_numpy(np.int64)
+        values = np.column_stack([so_luong, np.where((df_t['Loai'] == "NHẬP").to_numpy(), so_luong, 0),
+                                  np.where((df_t['Loai'] == "XUẤT").to_numpy(), so_luong, 0)])
+        ids = ma.cat.codes.to_numpy(np.int64)
+        key = self._keys(ids, df_t['Ngay'].to_numpy().astype("datetime64[D]").astype(np.int64))
+        order = np.argsort(key, kind="stable")
+        key, values, ids = key[order], values[order], ids[order]
+        # Gộp theo (quà, ngày), rồi cộng dồn trong từng quà: cumsum toàn cục trừ lũy kế trước dòng đầu của quà
+        first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        key, ids, daily = key[first], ids[first], np.add.reduceat(values, first, axis=0)
+        cum = np.cumsum(daily, axis=0)
+        gift_start = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        offset = np.repeat(cum[gift_start] - daily[gift_start], np.diff(np.r_[gift_start, len(ids)]), axis=0)
+        self._ids = {str(m): i for i, m in enumerate(ma.cat.categories)}
+        self._key, self._cum = key, cum - offset
+
+    def _add(self, rows):
+        for r in rows:
+            ngay = pd.to_datetime(r.get("Ngay"), errors="coerce")
+            if pd.isna(ngay): continue
+            gid = self._ids.setdefault(str(r["MaQua"]), len(self._ids))
+            so_luong = int(_to_number(r.get("SoLuong")))
+            delta = (so_luong, so_luong if r.get("Loai") == "NHẬP" else 0, so_luong if r.get("Loai") == "XUẤT" else 0)
+            k = int(self._keys(gid, _day_number(ngay)))
+            j = int(np.searchsorted(self._key, k))
+            if j == len(self._key) or self._key[j] != k:
+                same_gift = j > 0 and self._key[j - 1] // self._SPAN == gid
+                self._key = np.insert(self._key, j, k)
+                self._cum = np.insert(self._cum, j, self._cum[j - 1] if same_gift else 0, axis=0)
+            # Thường là ngày mới nhất nên chỉ cộng vào mốc cuối; ghi lùi ngày thì cộng cho mọi mốc sau đó của quà
+            end = int(np.searchsorted(self._key, (gid + 1) * self._SPAN))
+            self._cum[j:end] += delta
+
+    def _at(self, ids, day):
+        # Lũy kế đến hết ngày `day` cho từng id quà (-1: quà chưa có trong nhật ký)
+        pos = np.searchsorted(self._key, self._keys(ids, day), side="right") - 1
+        ok = (ids >= 0) & (pos >= 0)
+        ok[ok] = self._key[pos[ok]] // self._SPAN == ids[ok]
+        out = np.zeros((len(ids), 3), np.int64)
+        out[ok] = self._cum[pos[ok]]
+        return out
+
+    def period(self, ma_list, d1, d2):
+        # Trả về (tồn đầu, nhập, xuất) theo thứ tự ma_list, cùng quy ước với build_xnt_report
+        t1, t2 = _day_number(d1), _day_number(d2)
+        with self._lock:
+            ids = np.array([self._ids.get(str(m), -1) for m in ma_list], dtype=np.int64)
+            truoc, den = self._at(ids, t1 - 1), self._at(ids, t2)
+        trong_ky = den - truoc if t2 >= t1 else np.zeros_like(truoc)
+        return truoc[:, 0], trong_ky[:, 1], np.abs(trong_ky[:, 2])
+
+
+class SheetCache:
+    # Bộ đệm dữ liệu theo từng worksheet với số phiên bản riêng: ghi vào một sheet chỉ làm mới
+    # sheet đó (thay cho st.cache_data.clear() xóa sạch mọi thứ). Dữ liệu vừa ghi được đặt
+    # thẳng vào bộ đệm nên lần chạy lại sau không phải tải lại từ Google.
+    # loader(sheet_name, prev) nhận (df, meta) của lần tải trước (hoặc None) và trả về (df, meta) mới,
+    # nhờ đó có thể tải nối tiếp thay vì tải lại toàn bộ.
+    def __init__(self, ttl=15):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sheet_locks = defaultdict(threading.Lock)
+        self._entries = {}
+        self._versions = defaultdict(int)
+
+    def version(self, sheet_name):
+        return self._versions[sheet_name]
+
+    def _store(self, sheet_name, e, df, meta):
+        with self._lock:
+            if e is None or (df is not e[0] and not df.equals(e[0])): self._versions[sheet_name] += 1
+            e = self._entries[sheet_name] = (df, time.monotonic(), meta)
+        return e
+
+    def get(self, sheet_name, loader):
+        with self._sheet_locks[sheet_name]:
+            e = self._entries.get(sheet_name)
+            if e is None or time.monotonic() - e[1] >= self.ttl:
+                e = self._store(sheet_name, e, *loader(sheet_name, None if e is None else (e[0], e[2])))
+            return e[0].copy()
+
+    def stale(self, sheet_name):
+        # Bản gần nhất bất kể TTL (None nếu chưa từng tải): dùng khi Google từ chối vì hết hạn mức
+        e = self._entries.get(sheet_name)
+        return None if e is None else e[0].copy()
+
+    def prefetch(self, sheet_names, batch_loader):
+        # Nạp các sheet chưa có trong bộ đệm bằng một lệnh batch_loader(names) -> {name: (df, meta)}
+        missing = [n for n in sheet_names if n not in self._entries]
+        if not missing: return
+        for name, (df, meta) in batch_loader(missing).items():
+            with self._sheet_locks[name]:
+                if name not in self._entries: self._store(name, None, df, meta)
+
+    def put(self, sheet_name, df, meta=None):
+        with self._lock:
+            self._entries[sheet_name] = (df, time.monotonic(), meta)
+            self._versions[sheet_name] += 1
+
+    def append(self, sheet_name, df_new, meta_fn=None):
+        # meta_fn(meta) -> meta mới (vd. dời mốc tải nối tiếp); None nghĩa là lần làm mới sau phải tải toàn bộ
+        with self._lock:
+            e = self._entries.get(sheet_name)
+            if e is not None and (e[0].empty or list(e[0].columns) == list(df_new.columns)):
+                meta = meta_fn(e[2]) if meta_fn and e[2] is not None else None
+                self._entries[sheet_name] = (concat_frames([e[0], df_new]), e[1], meta)
+            else:
+                self._entries.pop(sheet_name, None)
+            self._versions[sheet_name] += 1
+
+    def invalidate(self, sheet_name):
+        with self._lock:
+            self._entries.pop(sheet_name, None)
+            self._versions[sheet_name] += 1
+
+
+class ReportCache:
+    # Bộ đệm kết quả báo cáo dùng chung cho mọi phiên, khóa gồm kỳ báo cáo + phiên bản nhật ký/danh mục
+    # (vd. (d1, d2, version danh mục, JournalIndex.version)). Bỏ mục dùng lâu nhất (LRU) khi vượt số mục
+    # hoặc dung lượng; khung quá lớn so với max_bytes thì không giữ.
+    def __init__(self, max_entries=64, max_bytes=64 * 2 ** 20):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None: return None
+            self._entries.move_to_end(key)
+            return e[0].copy()
+
+    def put(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self._bytes -= old[1]
+            if size > self.max_bytes: return
+            self._entries[key] = (df.copy(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        # Gọi ngay khi nhật ký có dòng mới: kết quả cũ không bao giờ được dùng lại nữa
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def _search_key(s):
+    return " ".join(no_accent_vietnamese(s).lower().split())
+
+
+def _search_keys(values):
+    return no_accent_series(pd.Series(values, dtype=object)).str.lower().str.split().str.join(" ").tolist()
+
+
+def _trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class GiftSearchIndex:
+    # Chỉ mục tìm quà dựng sẵn trên MaQua + TenQua đã bỏ dấu ("hoa" tìm được "Hoa Đào").
+    # Thứ hạng của search(): trùng mã > mã bắt đầu bằng từ khóa > mọi từ khóa là tiền tố của các từ trong tên
+    # > chứa chuỗi con (qua trigram; từ khóa < 3 ký tự thì quét tuần tự). Cùng hạng thì theo thứ tự danh mục.
+    # Kết quả gần đúng (trùng >= 60% trigram) tách riêng trong fuzzy(): chỉ để gợi ý, không tính là đã tìm thấy.
+    def __init__(self, df_g):
+        self.size = len(df_g)
+        ma = df_g['MaQua'].astype(str).tolist() if 'MaQua' in df_g.columns else []
+        ten = df_g['TenQua'].astype(str).tolist() if 'TenQua' in df_g.columns else [""] * len(ma)
+        codes = [_search_key(m) for m in ma]
+        self._keys = [f"{c} {t}" for c, t in zip(codes, _search_keys(ten))]
+        self._codes = sorted((c, i) for i, c in enumerate(codes))
+        self._words = defaultdict(set)
+        self._tri = defaultdict(set)
+        for i, k in enumerate(self._keys):
+            for w in k.split(): self._words[w].add(i)
+            for g in _trigrams(k): self._tri[g].add(i)
+        self._sorted_words = sorted(self._words)
+
+    def _words_with_prefix(self, p):
+        j = bisect_left(self._sorted_words, p)
+        while j < len(self._sorted_words) and self._sorted_words[j].startswith(p):
+            yield self._sorted_words[j]
+            j += 1
+
+    def search(self, query, limit=3):
+        q = _search_key(query)
+        if not q: return []
+        ranked = {}
+
+        def add(rows, rank):
+            for i in rows:
+                if i not in ranked: ranked[i] = rank
+
+        def top():
+            return heapq.nsmallest(limit, ranked, key=lambda i: (ranked[i], i))
+
+        j = bisect_left(self._codes, (q, -1))
+        while j < len(self._codes) and self._codes[j][0].startswith(q):
+            add((self._codes[j][1],), 0 if self._codes[j][0] == q else 1)
+            j += 1
+        if len(ranked) >= limit: return top()
+
+        rows = None
+        for w in q.split():
+            hit = set().union(*(self._words[x] for x in self._words_with_prefix(w)))
+            rows = hit if rows is None else rows & hit
+            if not rows: break
+        add(rows or (), 2)
+        if len(ranked) >= limit: return top()
+
+        grams = [self._tri.get(g, set()) for g in _trigrams(q)]
+        if grams:
+            add((i for i in set.intersection(*sorted(grams, key=len)) if q in self._keys[i]), 3)
+        else:
+            add((i for i, k in enumerate(self._keys) if q in k), 3)  # 1-2 ký tự: không có trigram để tra
+        return top()
+
+    def fuzzy(self, query, limit=3):
+        # Gần đúng: trùng >= 60% trigram của từ khóa, xếp theo số trigram trùng; bỏ các dòng search() đã trả về
+        q = _search_key(query)
+        grams = [self._tri.get(g, set()) for g in _trigrams(q)]
+        if not grams: return []
+        counts = defaultdict(int)
+        for posting in grams:
+            if len(posting) > max(50, self.size // 5): continue  # trigram quá phổ biến: ít giá trị phân biệt
+            for i in posting: counts[i] += 1
+        exact = set(self.search(query, limit=self.size))
+        hits = [i for i, n in counts.items() if n >= 0.6 * len(grams) and i not in exact]
+        return heapq.nsmallest(limit, hits, key=lambda i: (-counts[i], i))
@@ -0,0 +1,50 @@
+import io
+
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from kho_core import no_accent_vietnamese
+
+
+def export_pdf_report(df, d1, d2):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    w, h = A4
+    c.setFont("Helvetica-Bold", 16);
+    c.drawCentredString(w / 2, h - 50, "BAO CAO XUAT NHAP TON")
+    c.setFont("Helvetica", 10);
+    c.drawCentredString(w / 2, h - 70, f"Tu {d1} den {d2}")
+    y = h - 110;
+    headers = ["Ma", "Ten Qua", "Ton Dau", "Nhap", "Xuat", "Ton Cuoi"]
+    x_pos = [40, 100, 300, 360, 420, 480]
+    for i, txt in enumerate(headers): c.drawString(x_pos[i], y, txt)
+    y -= 20;
+    c.setFont("Helvetica", 9)
+    for _, r in df.iterrows():
+        if y < 50: c.showPage(); y = h - 50
+        c.drawString(x_pos[0], y, str(r['Mã']))
+        c.drawString(x_pos[1], y, no_accent_vietnamese(r['Tên'])[:35])
+        c.drawString(x_pos[2], y, str(r['Tồn đầu']))
+        c.drawString(x_pos[3], y, str(r['Nhập']))
+        c.drawString(x_pos[4], y, str(r['Xuất']))
+        c.drawString(x_pos[5], y, str(r['Tồn cuối']))
+        y -= 18
+    c.save();
+    return buf.getvalue()
+
+
+def export_excel_report(df):
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf) as wr: df.to_excel(wr, index=False)
+    return buf.getvalue()
+
+
+def export_backup(df_g, df_t, df_sd=None):
+    # File sao lưu: DM (danh mục), NK (nhật ký), SD (số dư chốt sổ nếu có) - đúng định dạng mà Restore đọc lại
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf) as wr:
+        df_g.to_excel(wr, sheet_name='DM', index=False);
+        df_t.to_excel(wr, sheet_name='NK', index=False)
+        if df_sd is not None and not df_sd.empty: df_sd.to_excel(wr, sheet_name='SD', index=False)
+    return buf.getvalue()
@@ -0,0 +1,249 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+# Google Sheets giả trong bộ nhớ cho load test / benchmark / CI không cần credentials và quota. Cài đặt phần API
+# gspread mà các ứng dụng dùng (open_by_key, worksheet(s), add/del_worksheet, values_batch_get, get_all_values,
+# row_values, batch_get, append_rows, update, clear). Mọi thao tác đi qua FakeHTTPClient.request như gspread >= 6,
+# nên count_api_calls / rate_limited bọc được y như client thật; độ trễ và hạn mức mỗi phút mô phỏng tại đó.
+# Bật trong ứng dụng bằng biến môi trường:
+#   KHO_FAKE_SHEETS=1 (bảng trống) hoặc =<file .json {tên sheet: [[ô, ...], ...]}> để nạp dữ liệu ban đầu
+#   KHO_FAKE_LATENCY=0.2      giây mỗi request (cộng thêm ngẫu nhiên tới KHO_FAKE_JITTER giây)
+#   KHO_FAKE_ROW_COST=0.01    giây cho mỗi 1000 dòng đọc/ghi (request lớn chậm hơn)
+#   KHO_FAKE_QUOTA=60         request mỗi phút cho mỗi loại đọc/ghi; vượt thì trả 429 như Google
+FAKE_ENV = "KHO_FAKE_SHEETS"
+_A1 = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._payload = payload
+        self.text = json.dumps(payload, ensure_ascii=False)
+
+    def json(self):
+        return self._payload
+
+
+def _cell(ref):
+    # "B5" -> (5, 2); "B" -> (None, 2); "5" -> (5, None)
+    m = _A1.match(ref.strip().upper())
+    if not m: raise ValueError(f"Vùng không hợp lệ: {ref}")
+    col = a1_to_rowcol(m.group(1) + "1")[1] if m.group(1) else None
+    return (int(m.group(2)) if m.group(2) else None), col
+
+
+def _slice(rows, rng):
+    # Vùng A1 ("1:1", "A5:H", "A1:C3" hoặc rỗng = cả sheet) trên danh sách dòng, bỏ các dòng trống ở cuối như Google
+    if rng:
+        a, b = (rng.split(":") + [rng])[:2]
+        (r1, c1), (r2, c2) = _cell(a), _cell(b)
+        rows = rows[(r1 or 1) - 1:r2]
+        rows = [r[(c1 or 1) - 1:c2] for r in rows]
+    while rows and not any(rows[-1]): rows = rows[:-1]
+    return [list(r) for r in rows]
+
+
+def _split_range(name):
+    # "'Tên sheet'!A1:B2" -> ("Tên sheet", "A1:B2"); "'Tên sheet'" -> ("Tên sheet", "")
+    title, _, rng = name.rpartition("!") if "!" in name else (name, "", "")
+    return title.strip("'"), rng
+
+
+class FakeBackend:
+    # Dữ liệu của một spreadsheet giả, dùng chung cho mọi client/phiên trong tiến trình
+    def __init__(self, sheets=None, latency=0.0, jitter=0.0, row_cost=0.0, read_per_minute=None,
+                 write_per_minute=None, seed=None):
+        self.sheets = {t: [[str(v) for v in r] for r in rows] for t, rows in (sheets or {}).items()}
+        self.latency, self.jitter, self.row_cost = latency, jitter, row_cost
+        self.limits = {"read": read_per_minute, "write": write_per_minute}
+        self.stats = {"read": 0, "write": 0, "rows_read": 0, "rows_written": 0, "throttled": 0}
+        self._sent = {"read": deque(), "write": deque()}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        source = environ.get(FAKE_ENV, "")
+        sheets = None
+        if source not in ("", "1"):
+            with open(source, encoding="utf-8") as f: sheets = json.load(f)
+        quota = environ.get("KHO_FAKE_QUOTA")
+        return cls(sheets, latency=float(environ.get("KHO_FAKE_LATENCY", 0)),
+                   jitter=float(environ.get("KHO_FAKE_JITTER", 0)), row_cost=float(environ.get("KHO_FAKE_ROW_COST", 0)),
+                   read_per_minute=int(quota) if quota else None, write_per_minute=int(quota) if quota else None)
+
+    def dump(self, path):
+        with self._lock:
+            data = {t: [list(r) for r in rows] for t, rows in self.sheets.items()}
+        with open(path, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+
+    def _admit(self, kind):
+        limit = self.limits[kind]
+        if limit is None: return
+        with self._lock:
+            now, sent = time.monotonic(), self._sent[kind]
+            while sent and now - sent[0] >= 60: sent.popleft()
+            if len(sent) >= limit:
+                self.stats["throttled"] += 1
+                raise APIError(FakeResponse({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                       "message": f"Quota exceeded for {kind} requests per minute"}},
+                                            429))
+            sent.append(now)
+
+    def _sheet(self, title):
+        if title not in self.sheets:
+            raise APIError(FakeResponse({"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                                   "message": f"Unable to parse range: {title}"}}, 400))
+        return self.sheets[title]
+
+    def handle(self, method, endpoint, params=None, body=None):
+        kind = "read" if method.lower() == "get" else "write"
+        self._admit(kind)
+        with self._lock:
+            payload, n_rows = self._dispatch(method.lower(), endpoint, params or {}, body or {})
+            self.stats[kind] += 1
+            self.stats["rows_read" if kind == "read" else "rows_written"] += n_rows
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0) + self.row_cost * n_rows / 1000
+        if delay > 0: time.sleep(delay)
+        return FakeResponse(payload)
+
+    def _dispatch(self, method, endpoint, params, body):
+        if endpoint == "meta":
+            return {"sheets": list(self.sheets)}, 0
+        if endpoint == "values:batchGet":
+            out = []
+            for name in params["ranges"]:
+                title, rng = _split_range(name)
+                out.append({"range": name, "values": _slice(self._sheet(title), rng)})
+            return {"valueRanges": out}, sum(len(v["values"]) for v in out)
+        if endpoint == "batchUpdate":
+            if "addSheet" in body:
+                self.sheets.setdefault(body["addSheet"], [])
+            else:
+                self.sheets.pop(body["deleteSheet"], None)
+            return {}, 0
+        title = body.get("sheet") or params.get("sheet")
+        rows = self._sheet(title)
+        if endpoint == "values":
+            out = _slice(rows, params.get("range", ""))
+            return {"range": f"'{title}'!{params.get('range', '')}", "values": out}, len(out)
+        values = [["" if v is None else str(v) for v in r] for r in body.get("values", [])]
+        if endpoint == "values:append":
+            while rows and not any(rows[-1]): rows.pop()
+            start = len(rows) + 1
+            rows.extend(values)
+            width = max(map(len, values), default=1)
+            return {"updates": {"updatedRange": f"'{title}'!A{start}:{rowcol_to_a1(len(rows), width)}",
+                                "updatedRows": len(values)}}, len(values)
+        if endpoint == "values:update":
+            for i, r in enumerate(values):
+                if i >= len(rows): rows.append([])
+                rows[i] = r + rows[i][len(r):]
+            return {"updatedRows": len(values)}, len(values)
+        if endpoint == "values:clear":
+            rows.clear()
+            return {}, 0
+        raise ValueError(f"Không hỗ trợ {method} {endpoint}")
+
+
+class FakeHTTPClient:
+    # Cùng chữ ký request() với gspread.http_client.HTTPClient
+    def __init__(self, backend):
+        self.backend = backend
+        self.timeout = None
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        return self.backend.handle(method, endpoint, params, json)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet, self.title = spreadsheet, title
+
+    def _get(self, rng=""):
+        return self.spreadsheet._request("get", "values", params={"sheet": self.title, "range": rng})["values"]
+
+    def _write(self, endpoint, values=()):
+        return self.spreadsheet._request("post", endpoint, json={"sheet": self.title, "values": list(values)})
+
+    def get_all_values(self):
+        rows = self._get()
+        width = max(map(len, rows), default=0)
+        return [r + [""] * (width - len(r)) for r in rows]
+
+    def row_values(self, row):
+        rows = self._get(f"{row}:{row}")
+        return rows[0] if rows else []
+
+    def batch_get(self, ranges):
+        resp = self.spreadsheet.values_batch_get([f"'{self.title}'!{r}" for r in ranges])
+        return [vr.get("values", []) for vr in resp["valueRanges"]]
+
+    def append_rows(self, values, value_input_option=None, insert_data_option=None, table_range=None, **kwargs):
+        return self._write("values:append", values)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        if range_name not in (None, "A1"): raise ValueError("Bản giả chỉ hỗ trợ update từ ô A1")
+        return self._write("values:update", values or [])
+
+    def clear(self):
+        return self._write("values:clear")
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, key):
+        self.client, self.id = client, key
+
+    def _request(self, method, endpoint, params=None, json=None):
+        return self.client.http_client.request(method, endpoint, params=params, json=json).json()
+
+    def worksheets(self):
+        return [FakeWorksheet(self, t) for t in self._request("get", "meta")["sheets"]]
+
+    def worksheet(self, title):
+        if title not in self._request("get", "meta")["sheets"]: raise WorksheetNotFound(title)
+        return FakeWorksheet(self, title)
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None):
+        self._request("post", "batchUpdate", json={"addSheet": title})
+        return FakeWorksheet(self, title)
+
+    def del_worksheet(self, worksheet):
+        self._request("post", "batchUpdate", json={"deleteSheet": worksheet.title})
+
+    def values_batch_get(self, ranges, params=None):
+        return self._request("get", "values:batchGet", params={"ranges": list(ranges)})
+
+
+class FakeClient:
+    def __init__(self, backend=None):
+        self.backend = backend or FakeBackend()
+        self.http_client = FakeHTTPClient(self.backend)
+
+    def open_by_key(self, key):
+        return FakeSpreadsheet(self, key)
+
+    def set_timeout(self, timeout=None):
+        self.http_client.timeout = timeout
+
+
+_env_backend = None
+_env_lock = threading.Lock()
+
+
+def fake_client_from_env(environ=os.environ):
+    # FakeClient khi đặt KHO_FAKE_SHEETS (mọi client trong tiến trình dùng chung một FakeBackend), ngược lại None
+    global _env_backend
+    if not environ.get(FAKE_ENV): return None
+    with _env_lock:
+        if _env_backend is None: _env_backend = FakeBackend.from_env(environ)
+    return FakeClient(_env_backend)
@@ -0,0 +1,238 @@
+import re
+import time
+
+import pandas as pd
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+
+from kho_core import JOURNAL_COLUMNS, apply_schema, concat_frames, to_strings
+from kho_perf import timed
+from kho_report import BALANCE_LOAI
+
+# Số dòng cuối dùng làm "vân tay" khi tải nối tiếp, và chu kỳ tải lại toàn bộ để bắt các sửa đổi ở giữa sheet
+TAIL_ROWS = 3
+FULL_RELOAD_SECONDS = 300
+
+
+def frame_from_values(data, schema=None):
+    # schema (vd. kho_core.JOURNAL_SCHEMA): ép kiểu ngay khi tải để nơi dùng không phải parse lại
+    if not data or len(data) < 1: return pd.DataFrame()
+    df = pd.DataFrame(data[1:], columns=[str(c).strip() for c in data[0]])
+    df = df.loc[:, ~df.columns.duplicated()].copy()
+    if "MaQua" in df.columns: df = df[df["MaQua"].str.strip() != ""]
+    df = df.reset_index(drop=True)
+    return apply_schema(df, schema) if schema else df
+
+
+def values_from_frame(df):
+    # Chiều ngược của frame_from_values: tiêu đề + các dòng dạng chuỗi để ghi lên sheet
+    df_save = to_strings(df)
+    return [df_save.columns.values.tolist()] + df_save.values.tolist()
+
+
+def _pad(rows, width):
+    return [[str(v) for v in r[:width]] + [""] * (width - len(r)) for r in rows]
+
+
+def watermark_from_values(data):
+    header = [str(c) for c in data[0]] if data else []
+    return {"header": header, "n_rows": len(data), "tail": _pad(data[1:][-TAIL_ROWS:], len(header)),
+            "full_at": time.monotonic()}
+
+
+def _full_fetch(worksheet, schema=None):
+    with timed("sheets: get_all_values"):
+        data = worksheet.get_all_values()
+    with timed("sheets: parse"):
+        return frame_from_values(data, schema), watermark_from_values(data)
+
+
+def fetch_many(spreadsheet, sheet_names, incremental=(), schemas=None):
+    # Tải nhiều worksheet trong một lệnh values_batch_get (một lượt gọi API thay vì mỗi sheet một lượt).
+    # Các sheet trong `incremental` được kèm mốc để các lần làm mới sau tải nối tiếp; schemas: {tên sheet: schema}.
+    schemas = schemas or {}
+    with timed("sheets: values_batch_get"):
+        resp = spreadsheet.values_batch_get([f"'{name}'" for name in sheet_names])
+    out = {}
+    with timed("sheets: parse"):
+        for name, vr in zip(sheet_names, resp.get("valueRanges", [])):
+            rows = vr.get("values", [])
+            data = _pad(rows, max(map(len, rows), default=0))
+            out[name] = (frame_from_values(data, schemas.get(name)),
+                         watermark_from_values(data) if name in incremental else None)
+    return out
+
+
+def fetch_incremental(worksheet, prev=None, schema=None):
+    # Tải nối tiếp: chỉ lấy các dòng sau mốc (watermark) của lần tải trước, kèm vài dòng cuối cũ để đối chiếu.
+    # Nếu tiêu đề hoặc các dòng cuối cũ bị sửa/xóa (hoặc đã quá FULL_RELOAD_SECONDS) thì tải lại toàn bộ.
+    # prev là (df, meta) của lần tải trước; trả về (df, meta) mới.
+    if prev is None or prev[1] is None or time.monotonic() - prev[1]["full_at"] >= FULL_RELOAD_SECONDS:
+        return _full_fetch(worksheet, schema)
+    df_old, meta = prev
+    width, k = len(meta["header"]), len(meta["tail"])
+    if width == 0: return _full_fetch(worksheet, schema)
+    start = meta["n_rows"] - k + 1
+    with timed("sheets: batch_get"):
+        header, body = worksheet.batch_get(["1:1", f"A{start}:{rowcol_to_a1(1, width)[:-1]}"])
+    body = _pad(body, width)
+    if _pad(header[:1], width) != [meta["header"]] or body[:k] != meta["tail"]:
+        return _full_fetch(worksheet, schema)
+    new_rows = body[k:]
+    if not new_rows: return df_old, meta
+    meta = dict(meta, n_rows=meta["n_rows"] + len(new_rows), tail=(meta["tail"] + new_rows)[-TAIL_ROWS:])
+    with timed("sheets: parse"):
+        return concat_frames([df_old, frame_from_values([meta["header"]] + new_rows, schema)]), meta
+
+
+def advance_watermark(meta, response, new_values):
+    # Dời mốc sau khi chính ứng dụng append; chỉ khi khối vừa ghi nằm ngay sau mốc cũ (không phiên nào chen vào)
+    m = re.search(r"![A-Z]+(\d+)", ((response or {}).get("updates") or {}).get("updatedRange", ""))
+    if meta is None or m is None or int(m.group(1)) != meta["n_rows"] + 1: return None
+    new_rows = _pad(new_values, len(meta["header"]))
+    return dict(meta, n_rows=meta["n_rows"] + len(new_rows), tail=(meta["tail"] + new_rows)[-TAIL_ROWS:])
+
+
+# --- Chia nhật ký thành nhiều worksheet (shard): nhatky_xuatnhap, nhatky_xuatnhap_2, ... ---
+# Danh mục shard ghi khoảng ngày của từng shard; shard cuối (DenNgay trống) là shard đang ghi.
+# Shard đã đóng không bao giờ đổi nữa nên lưu sẵn tổng SoLuong theo MaQua của nó trong SHARD_TOTALS.
+SHARD_MAX_ROWS = 50000
+SHARD_DIRECTORY = "nhatky_shards"
+SHARD_TOTALS = "nhatky_shards_tong"
+SHARD_COLUMNS = ["Shard", "TuNgay", "DenNgay", "SoDong"]
+SHARD_SCHEMA = {"TuNgay": "datetime", "DenNgay": "datetime", "SoDong": "int32"}
+TOTALS_COLUMNS = ["Shard", "MaQua", "TenQua", "SoLuong"]
+TOTALS_SCHEMA = {"SoLuong": "int32"}
+
+
+def shard_name(base, n):
+    return base if n == 1 else f"{base}_{n}"
+
+
+def is_shard(base, sheet_name):
+    return sheet_name == base or (sheet_name.startswith(base + "_") and sheet_name[len(base) + 1:].isdigit())
+
+
+def worksheet_or_create(spreadsheet, sheet_name, cols):
+    try:
+        return spreadsheet.worksheet(sheet_name)
+    except WorksheetNotFound:
+        return spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=cols)
+
+
+def append_records(worksheet, rows):
+    # Ghi thêm các dòng (dict theo tên cột) bằng một lệnh append: Google tự chèn vào cuối bảng nên nhiều phiên ghi cùng
+    # lúc không đè nhau; sheet còn trống thì ghi kèm tiêu đề, dòng có cột sheet chưa có (vd. MaGhi của hàng đợi ghi)
+    # thì thêm cột đó vào cuối tiêu đề. Trả về (tiêu đề, các dòng đã ghi, phản hồi của append), phản hồi là None khi
+    # vừa ghi/đổi tiêu đề (mốc tải nối tiếp không dời được).
+    keys = list(dict.fromkeys(c for r in rows for c in r))
+    header = [str(c).strip() for c in worksheet.row_values(1)]
+    values = [] if header else [keys]
+    extra = [c for c in keys if header and c not in header]
+    if extra:
+        header += extra
+        if len(header) > getattr(worksheet, "col_count", len(header)):
+            worksheet.add_cols(len(header) - worksheet.col_count)
+        worksheet.update(values=[header], range_name="A1")
+    header = header or values[0]
+    new_values = [["" if r.get(c) is None else str(r.get(c)) for c in header] for r in rows]
+    resp = worksheet.append_rows(values + new_values, value_input_option="RAW", insert_data_option="INSERT_ROWS",
+                                 table_range="A1")
+    return header, new_values, None if values or extra else resp
+
+
+def shard_directory(df_dir, base):
+    # Chưa có danh mục: cả nhật ký nằm trong một shard là chính sheet gốc
+    if df_dir.empty or "Shard" not in df_dir.columns:
+        return pd.DataFrame({"Shard": [base], "TuNgay": [pd.NaT], "DenNgay": [pd.NaT], "SoDong": [0]})
+    return apply_schema(df_dir, SHARD_SCHEMA).reset_index(drop=True)
+
+
+def active_shard(df_dir, base):
+    return shard_directory(df_dir, base)['Shard'].iloc[-1]
+
+
+def shards_in_range(df_dir, base, d1=None, d2=None):
+    # Trả về (các shard phải đọc đủ dòng, các shard đã đóng hẳn trước d1 chỉ cần lấy tổng theo MaQua).
+    # Shard đã đóng bắt đầu sau d2 được bỏ qua; shard chưa rõ khoảng ngày và shard đang ghi (có thể nhận dòng lùi ngày,
+    # vd. nhập hàng loạt) thì luôn đọc.
+    d = shard_directory(df_dir, base)
+    no = pd.Series(False, index=d.index)
+    closed = (d.index < len(d) - 1) & d['DenNgay'].notna()
+    before = closed & (d['DenNgay'] < pd.Timestamp(d1)) if d1 is not None else no
+    after = closed & (d['TuNgay'] > pd.Timestamp(d2)) if d2 is not None else no
+    return d.loc[~before & ~after, 'Shard'].tolist(), d.loc[before, 'Shard'].tolist()
+
+
+def shard_summary(sheet_name, df_t):
+    # Dòng danh mục + tổng theo MaQua của một shard sắp đóng
+    df_t = apply_schema(df_t)
+    ngay = df_t['Ngay'].dropna() if 'Ngay' in df_t.columns else pd.Series(dtype="datetime64[ns]")
+    row = {"Shard": sheet_name, "TuNgay": ngay.min(), "DenNgay": ngay.max(), "SoDong": len(df_t)}
+    if df_t.empty: return row, pd.DataFrame(columns=TOTALS_COLUMNS)
+    by_ma = df_t.groupby(df_t['MaQua'].astype(str))
+    so_luong = by_ma['SoLuong'].sum().astype("int64")
+    return row, pd.DataFrame({"Shard": sheet_name, "MaQua": so_luong.index, "TenQua": by_ma['TenQua'].last().to_numpy(),
+                              "SoLuong": so_luong.to_numpy()}, columns=TOTALS_COLUMNS)
+
+
+def rollover(df_dir, base, df_active, start):
+    # Đóng shard đang ghi (df_active) và mở shard mới bắt đầu từ ngày `start`.
+    # Trả về (danh mục mới, các dòng tổng của shard vừa đóng, tên shard mới).
+    d = shard_directory(df_dir, base)
+    row, totals = shard_summary(d['Shard'].iloc[-1], df_active)
+    new_name = shard_name(base, len(d) + 1)
+    rows = d.iloc[:-1].to_dict("records") + [row, {"Shard": new_name, "TuNgay": pd.Timestamp(start), "DenNgay": pd.NaT,
+                                                   "SoDong": 0}]
+    return apply_schema(pd.DataFrame(rows, columns=SHARD_COLUMNS), SHARD_SCHEMA), totals, new_name
+
+
+def append_with_rollover(sh, base, rows, df_dir=None, n_active=None, open_ws=None):
+    # Ghi các dòng nhật ký (dict) vào shard đang ghi của `base`; shard đầy SHARD_MAX_ROWS dòng thì đóng lại (tổng theo
+    # MaQua vào SHARD_TOTALS, khoảng ngày vào danh mục) và mở shard mới trước khi ghi. df_dir / n_active: danh mục và
+    # số dòng của shard đang ghi nếu nơi gọi đã có sẵn (bộ đệm), không thì đọc từ sheet. open_ws(tên, số cột) thay cho
+    # worksheet_or_create(sh, ...) khi nơi gọi giữ sẵn handle worksheet.
+    # Trả về (danh mục, shard đã ghi, tiêu đề, các dòng đã ghi, phản hồi append) như append_records.
+    open_ws = open_ws or (lambda name, cols: worksheet_or_create(sh, name, cols))
+    if df_dir is None: df_dir = frame_from_values(open_ws(SHARD_DIRECTORY, len(SHARD_COLUMNS)).get_all_values())
+    d = shard_directory(df_dir, base)
+    active = d['Shard'].iloc[-1]
+    ws = open_ws(active, len(JOURNAL_COLUMNS))
+    if n_active is None: n_active = max(len(ws.batch_get(["A:A"])[0]) - 1, 0)
+    if n_active and n_active + len(rows) > SHARD_MAX_ROWS:
+        d, totals, active = rollover(d, base, frame_from_values(ws.get_all_values()), rows[0]["Ngay"])
+        ws = open_ws(active, len(JOURNAL_COLUMNS))
+        if not totals.empty:
+            append_records(open_ws(SHARD_TOTALS, len(TOTALS_COLUMNS)), to_strings(totals).to_dict("records"))
+        ws_dir = open_ws(SHARD_DIRECTORY, len(SHARD_COLUMNS))
+        ws_dir.clear()
+        ws_dir.update(values_from_frame(d))
+    return (d, active) + append_records(ws, rows)
+
+
+def split_shards(df_t, base, max_rows=SHARD_MAX_ROWS):
+    # Chia toàn bộ nhật ký (khi Restore/ghi lại) thành các shard <= max_rows dòng.
+    # Trả về ([(tên shard, khung)], danh mục, tổng của các shard đã đóng).
+    chunks = [df_t.iloc[i:i + max_rows].reset_index(drop=True) for i in range(0, len(df_t), max_rows)] or [df_t]
+    shards = [(shard_name(base, i + 1), c) for i, c in enumerate(chunks)]
+    rows, totals = [], []
+    for name, chunk in shards[:-1]:
+        row, tot = shard_summary(name, chunk)
+        rows.append(row)
+        totals.append(tot)
+    last_row, _ = shard_summary(*shards[-1])
+    rows.append(dict(last_row, DenNgay=pd.NaT))
+    df_dir = apply_schema(pd.DataFrame(rows, columns=SHARD_COLUMNS), SHARD_SCHEMA)
+    return shards, df_dir, pd.concat(totals, ignore_index=True) if totals else pd.DataFrame(columns=TOTALS_COLUMNS)
+
+
+def totals_as_journal(df_tot, df_dir, base, names):
+    # Tổng của các shard đã đóng dưới dạng dòng số dư đề ngày cuối của shard: đủ cho tồn kho và Tồn đầu
+    if not names or df_tot.empty: return apply_schema(pd.DataFrame(columns=JOURNAL_COLUMNS))
+    den = shard_directory(df_dir, base).set_index('Shard')['DenNgay']
+    tot = apply_schema(df_tot, TOTALS_SCHEMA)
+    tot = tot[tot['Shard'].isin(names)]
+    return apply_schema(pd.DataFrame({
+        "Loai": BALANCE_LOAI, "Ngay": den.reindex(tot['Shard']).to_numpy(), "MaQua": tot['MaQua'].to_numpy(),
+        "TenQua": tot['TenQua'].to_numpy(), "SoLuong": tot['SoLuong'].to_numpy(), "SoChungTu": tot['Shard'].to_numpy(),
+        "NguoiThucHien": "", "GhiChu": ""}, columns=JOURNAL_COLUMNS))
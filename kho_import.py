@@ -0,0 +1,109 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from kho_core import JOURNAL_COLUMNS, apply_schema, no_accent_series
+
+# Số dòng mỗi lệnh append khi ghi các dòng đã nhận (giới hạn kích thước một request của Google Sheets)
+IMPORT_CHUNK_ROWS = 5000
+REJECT_COLUMN = "LyDo"
+_LOAI = {"NHAP": "NHẬP", "XUAT": "XUẤT"}
+
+
+def read_import_file(data, file_name):
+    # File CSV/XLSX các dòng nhật ký; đọc mọi cột dạng chuỗi để tự kiểm tra kiểu ở validate_import
+    if str(file_name).lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(io.BytesIO(data), dtype=str)
+    else:
+        df = pd.read_csv(io.BytesIO(data), dtype=str, encoding="utf-8-sig")
+    df.columns = [str(c).strip() for c in df.columns]
+    return df.fillna("")
+
+
+def validate_import(df_in, df_g, df_t, nguoi=""):
+    # Kiểm tra toàn bộ file trong một lượt vector hóa. Trả về (các dòng nhận, dạng nhật ký đã ép kiểu,
+    # các dòng bị loại kèm số dòng trong file và lý do). df_t là nhật ký hiện có (để tính tồn và dò chứng từ trùng).
+    # Quy tắc: Loai NHẬP/XUẤT (có dấu hay không), MaQua có trong danh mục, SoLuong là số nguyên > 0 (XUẤT ghi âm),
+    # Ngay đọc được, SoChungTu chưa có trong nhật ký, không trùng nguyên dòng trong file, và XUẤT không làm tồn âm.
+    # Các dòng cùng SoChungTu trong file là một phiếu nhiều dòng (như phiếu trong ứng dụng) nên phải cùng Loai và cùng
+    # ngày; khác Loai/ngày là hai phiếu trùng số chứng từ, mọi dòng của số chứng từ đó bị loại.
+    src = df_in.reindex(columns=JOURNAL_COLUMNS, fill_value="").fillna("").astype(str).apply(lambda s: s.str.strip())
+    reasons = pd.Series("", index=src.index, dtype=object)
+
+    def reject(mask, why):
+        nonlocal reasons
+        reasons = reasons.where(~mask, reasons + np.where(reasons == "", "", "; ") + why)
+
+    loai = no_accent_series(src['Loai']).str.upper().map(_LOAI)
+    reject(loai.isna(), "Loai không phải NHẬP/XUẤT")
+
+    g = df_g.reindex(columns=["MaQua", "TenQua"]).drop_duplicates('MaQua')
+    ten_qua = pd.Series(g['TenQua'].to_numpy(), index=g['MaQua'].astype(str))
+    reject(src['MaQua'] == "", "Thiếu MaQua")
+    reject((src['MaQua'] != "") & ~src['MaQua'].isin(ten_qua.index), "MaQua không có trong danh mục")
+
+    so = pd.to_numeric(src['SoLuong'].str.replace(",", "", regex=False), errors="coerce")
+    bad_so = so.isna() | (so != so.round()) | (so == 0)
+    reject(bad_so, "SoLuong không phải số nguyên khác 0")
+    so_luong = so.where(~bad_so, 0).abs().astype("int64") * np.where(loai == "XUẤT", -1, 1)
+
+    ngay = apply_schema(src[['Ngay']], {"Ngay": "datetime"})['Ngay']
+    reject(ngay.isna(), "Ngay không hợp lệ")
+
+    reject(src['SoChungTu'] == "", "Thiếu SoChungTu")
+    da_co = set(df_t['SoChungTu'].astype(str)) if 'SoChungTu' in df_t.columns else set()
+    reject(src['SoChungTu'].isin(da_co), "SoChungTu đã có trong nhật ký")
+    phieu = pd.DataFrame({"SoChungTu": src['SoChungTu'], "Loai": loai, "Ngay": ngay.dt.normalize()}).dropna()
+    n_phieu = phieu.drop_duplicates().groupby('SoChungTu').size()
+    reject((src['SoChungTu'] != "") & (src['SoChungTu'].map(n_phieu).fillna(0) > 1),
+           "SoChungTu trùng với phiếu khác trong file")
+
+    out = pd.DataFrame({
+        "Loai": loai, "Ngay": ngay, "MaQua": src['MaQua'],
+        "TenQua": src['TenQua'].where(src['TenQua'] != "", src['MaQua'].map(ten_qua)).fillna(""),
+        "SoLuong": so_luong, "SoChungTu": src['SoChungTu'],
+        "NguoiThucHien": src['NguoiThucHien'].where(src['NguoiThucHien'] != "", nguoi), "GhiChu": src['GhiChu']},
+        columns=JOURNAL_COLUMNS)
+    reject(out.drop(columns=["TenQua", "NguoiThucHien"]).duplicated(keep="first"), "Trùng dòng trong file")
+    reject(_negative_stock(out[reasons == ""], df_t).reindex(out.index, fill_value=False), "XUẤT làm tồn âm")
+
+    ok = (reasons == "").to_numpy()
+    rejected = df_in[~ok].copy()
+    rejected.insert(0, "Dong", rejected.index + 2)  # số dòng trong file (dòng 1 là tiêu đề)
+    rejected[REJECT_COLUMN] = reasons[~ok]
+    return apply_schema(out[ok].reset_index(drop=True)), rejected.reset_index(drop=True)
+
+
+def _negative_stock(df_new, df_t):
+    # Tồn lũy kế theo từng MaQua khi xếp dòng mới xen với nhật ký theo ngày (cùng ngày thì dòng cũ trước, dòng mới
+    # theo thứ tự file); dòng XUẤT mới bị loại nếu tồn sau nó < 0. Một lượt cumsum tìm các quà có dòng âm, chỉ các
+    # quà đó mới xét tuần tự (dòng bị loại không còn trừ vào tồn của các dòng sau).
+    if df_new.empty: return pd.Series(False, index=df_new.index)
+    old = apply_schema(df_t.reindex(columns=["Ngay", "MaQua", "SoLuong"]))
+    ma = np.concatenate([old['MaQua'].astype(str).to_numpy(object), df_new['MaQua'].to_numpy(object)])
+    ngay = np.concatenate([old['Ngay'].fillna(pd.Timestamp("1900-01-01")).dt.normalize().to_numpy("datetime64[ns]"),
+                           df_new['Ngay'].dt.normalize().to_numpy("datetime64[ns]")])
+    so = np.concatenate([old['SoLuong'].to_numpy(np.int64), df_new['SoLuong'].to_numpy(np.int64)])
+    seq = np.r_[np.full(len(old), -1), np.arange(len(df_new))]
+    codes = pd.factorize(ma)[0]
+    order = np.lexsort((seq, ngay, codes))
+    codes, so, is_new = codes[order], so[order], seq[order] >= 0
+    ton = pd.Series(so).groupby(codes).cumsum().to_numpy()
+    bad = np.isin(codes, codes[(ton < 0) & (so < 0) & is_new])
+    neg_sorted = np.zeros(len(so), bool)
+    prev, ton = -1, 0
+    for j, c, q, new in zip(np.flatnonzero(bad).tolist(), codes[bad].tolist(), so[bad].tolist(), is_new[bad].tolist()):
+        if c != prev: prev, ton = c, 0
+        if new and q < 0 and ton + q < 0:
+            neg_sorted[j] = True
+        else:
+            ton += q
+    neg = np.zeros(len(so), bool)
+    neg[order] = neg_sorted
+    return pd.Series(neg[len(old):], index=df_new.index)
+
+
+def chunks(rows, size=IMPORT_CHUNK_ROWS):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
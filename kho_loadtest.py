@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from kho_bench import git_commit, make_gifts, make_journal
+from kho_core import JOURNAL_COLUMNS
+
+# Load test nhiều phiên đồng thời trên một tiến trình Streamlit: mỗi phiên là một AppTest chạy QTVXTNF_GS3.py
+# trong luồng riêng, lặp tìm quà -> chọn -> XÁC NHẬN XUẤT/NHẬP -> chạy báo cáo, dữ liệu nằm trên Google Sheets giả
+# (kho_fakesheets) với độ trễ/hạn mức mô phỏng. In p50/p95/p99 thời gian mỗi lượt chạy lại và thông lượng theo N:
+#   python kho_loadtest.py --sessions 1,4,16 --actions 5 --latency 0.15 --out loadtest.json
+# Mỗi mức N chạy trong một tiến trình con riêng (bộ đệm cache_resource, hàng đợi ghi, WAL sạch).
+DEFAULT_SESSIONS = "1,2,4,8,16"
+STEPS = ("open", "search", "select", "submit", "report")
+RERUN_TIMEOUT = 120
+SYNC_TIMEOUT = 120
+
+
+def make_seed(path, n_gifts, n_rows, seed):
+    # Danh mục + nhật ký tổng hợp (như kho_bench) làm dữ liệu ban đầu của Google Sheets giả
+    rng = np.random.default_rng(seed)
+    df_g = make_gifts(n_gifts, rng)
+    df_t = make_journal(df_g, n_rows, rng)
+    sheets = {"danhmuc_qua": [df_g.columns.tolist()] + df_g.values.tolist(),
+              "nhatky_xuatnhap": [JOURNAL_COLUMNS] + df_t.astype(str).values.tolist()}
+    with open(path, "w", encoding="utf-8") as f: json.dump(sheets, f, ensure_ascii=False)
+
+
+def percentiles(samples):
+    if not samples: return {"n": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"n": len(samples), "p50_s": round(float(p50), 4), "p95_s": round(float(p95), 4),
+            "p99_s": round(float(p99), 4), "max_s": round(max(samples), 4)}
+
+
+def share_script_cache():
+    # Máy chủ Streamlit biên dịch script một lần cho cả tiến trình, còn AppTest biên dịch lại ở mỗi lượt chạy (làm
+    # sai số đo, và ast.parse đồng thời từ nhiều luồng lỗi trên Python 3.11): mọi phiên dùng chung một ScriptCache
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    shared = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: shared
+
+
+def clerk(i, app_path, gifts, actions, think, seed, samples, errors, lock):
+    # Một phiên thủ kho; ghi (bước, giây) của từng lượt chạy lại vào samples
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(seed * 1000 + i)
+    submits = 0
+
+    def step(name, fn):
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+        with lock: samples.append((name, elapsed))
+        if at.exception: raise RuntimeError(at.exception[0].message)
+        if think: time.sleep(rng.uniform(0, 2 * think))
+
+    try:
+        at = AppTest.from_file(app_path, default_timeout=RERUN_TIMEOUT)
+        at.session_state["user_info"] = {"name": f"Thủ kho {i}", "id": str(i)}
+        step("open", at.run)
+        for k in range(actions):
+            type_f = rng.choice(["XUẤT", "NHẬP"])
+            ma, ten = gifts[rng.randrange(len(gifts))]
+            step("search", at.text_input(key=f"src_{type_f}").set_value(ten).run)
+            tab = at.tabs[0 if type_f == "XUẤT" else 1]
+            found = [b for b in tab.button if b.label.startswith("📍 ")]
+            if not found: raise RuntimeError(f"Không tìm thấy '{ten}'")
+            step("select", next((b for b in found if b.label.startswith(f"📍 {ma} ")), found[0]).click().run)
+            tab = at.tabs[0 if type_f == "XUẤT" else 1]
+            [x for x in tab.text_input if x.label == "Số chứng từ *"][0].set_value(f"LT{i}-{k}")
+            [x for x in tab.number_input if x.label == "Số lượng *"][0].set_value(
+                rng.randint(1, 5) if type_f == "XUẤT" else rng.randint(10, 50))
+            step("submit", [b for b in tab.button if b.label == f"XÁC NHẬN {type_f}"][0].click().run)
+            submits += 1
+            step("report", [b for b in at.tabs[2].button if b.label == "Chạy báo cáo"][0].click().run)
+    except Exception as e:
+        with lock: errors.append(f"phiên {i}: {type(e).__name__}: {e}")
+    return submits
+
+
+def synced_rows(backend):
+    # Số dòng do load test ghi (SoChungTu LT...) đã tới Google Sheets giả, trên mọi shard nhật ký
+    from kho_gsheet import is_shard
+    with backend._lock:
+        return sum(1 for name, rows in backend.sheets.items() if is_shard("nhatky_xuatnhap", name)
+                   for r in rows[1:] if len(r) > 5 and r[5].startswith("LT"))
+
+
+def run_level(n, args, gifts):
+    # Chạy N phiên đồng thời trong tiến trình hiện tại (tiến trình con của main)
+    import kho_fakesheets
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.app)
+    samples, errors, lock, submits = [], [], threading.Lock(), [0] * n
+    share_script_cache()
+
+    def worker(i):
+        submits[i] = clerk(i, app_path, gifts, args.actions, args.think, args.seed, samples, errors, lock)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(n)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    # Thời gian để hàng đợi ghi sau đẩy hết giao dịch lên sheet
+    backend, total = kho_fakesheets._env_backend, sum(submits)
+    deadline = time.monotonic() + SYNC_TIMEOUT
+    while backend is not None and synced_rows(backend) < total and time.monotonic() < deadline: time.sleep(0.1)
+    sync = time.perf_counter() - t0 - wall
+    return {"sessions": n, "wall_s": round(wall, 3), "reruns": len(samples), "submits": total,
+            "reruns_per_s": round(len(samples) / wall, 3), "submits_per_s": round(total / wall, 3),
+            "latency": dict({"all": percentiles([s for _, s in samples])},
+                            **{name: percentiles([s for st, s in samples if st == name]) for name in STEPS}),
+            "synced": backend is not None and synced_rows(backend) >= total, "sync_s": round(sync, 3),
+            "api": dict(backend.stats) if backend is not None else None,
+            "errors": len(errors), "error_samples": errors[:5]}
+
+
+def fake_env(args, seed_path):
+    env = dict(os.environ, KHO_FAKE_SHEETS=seed_path, KHO_FAKE_LATENCY=str(args.latency),
+               KHO_FAKE_JITTER=str(args.jitter), KHO_FAKE_ROW_COST=str(args.row_cost))
+    if args.quota: env["KHO_FAKE_QUOTA"] = str(args.quota)
+    else: env.pop("KHO_FAKE_QUOTA", None)
+    return env
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Load test nhiều phiên đồng thời cho QTVXTNF_GS3.py")
+    p.add_argument("--sessions", default=DEFAULT_SESSIONS, help="Danh sách số phiên đồng thời, cách nhau bởi dấu phẩy")
+    p.add_argument("--actions", type=int, default=5, help="Số vòng tìm -> chọn -> ghi -> báo cáo mỗi phiên")
+    p.add_argument("--think", type=float, default=0.0, help="Thời gian nghĩ trung bình giữa các thao tác (giây)")
+    p.add_argument("--gifts", type=int, default=500)
+    p.add_argument("--rows", type=int, default=20000, help="Số dòng nhật ký có sẵn")
+    p.add_argument("--latency", type=float, default=0.15, help="Độ trễ mỗi request Google Sheets giả (giây)")
+    p.add_argument("--jitter", type=float, default=0.05)
+    p.add_argument("--row-cost", type=float, default=0.005, help="Giây cho mỗi 1000 dòng đọc/ghi")
+    p.add_argument("--quota", type=int, default=0, help="Hạn mức request/phút mỗi loại đọc/ghi (0 = không giới hạn)")
+    p.add_argument("--app", default="QTVXTNF_GS3.py")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default="loadtest.json")
+    p.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    p.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.worker:
+        # Tiến trình con: thư mục làm việc riêng cho WAL/bản sao SQLite/perf log của ứng dụng
+        with open(os.environ["KHO_FAKE_SHEETS"], encoding="utf-8") as f:
+            gifts = [tuple(r) for r in json.load(f)["danhmuc_qua"][1:]]
+        os.chdir(args.workdir)
+        result = run_level(args.worker, args, gifts)
+        with open("result.json", "w", encoding="utf-8") as f: json.dump(result, f, ensure_ascii=False)
+        return 0
+
+    tmp = tempfile.mkdtemp(prefix="kho_loadtest_")
+    seed_path = os.path.join(tmp, "seed.json")
+    make_seed(seed_path, args.gifts, args.rows, args.seed)
+    report = {"meta": {"time": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                       "python": platform.python_version(), "machine": platform.platform(), "app": args.app,
+                       "actions": args.actions, "think_s": args.think, "gifts": args.gifts, "rows": args.rows,
+                       "latency_s": args.latency, "jitter_s": args.jitter, "row_cost_s": args.row_cost,
+                       "quota": args.quota or None, "seed": args.seed},
+              "results": []}
+    print(f"{'N':>4} {'lượt':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'lượt/s':>8} {'ghi/s':>7} {'đồng bộ':>8} "
+          f"{'đọc':>5} {'ghi':>5} {'429':>5} {'lỗi':>4}", flush=True)
+    for n in (int(x) for x in args.sessions.split(",")):
+        workdir = os.path.join(tmp, f"n{n}")
+        os.makedirs(workdir)
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", str(n), "--workdir", workdir] + \
+              (argv if argv is not None else sys.argv[1:])
+        subprocess.run(cmd, env=fake_env(args, seed_path), cwd=workdir, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        try:
+            with open(os.path.join(workdir, "result.json"), encoding="utf-8") as f: r = json.load(f)
+        except OSError:
+            print(f"{n:>4} tiến trình con lỗi, xem lại bằng --worker {n} --workdir {workdir}", flush=True)
+            continue
+        report["results"].append(r)
+        lat, api = r["latency"]["all"], r["api"] or {}
+        print(f"{n:>4} {r['reruns']:>6} {lat.get('p50_s', 0):8.3f} {lat.get('p95_s', 0):8.3f} "
+              f"{lat.get('p99_s', 0):8.3f} {r['reruns_per_s']:8.2f} {r['submits_per_s']:7.2f} "
+              f"{r['sync_s'] if r['synced'] else float('nan'):8.2f} {api.get('read', 0):>5} {api.get('write', 0):>5} "
+              f"{api.get('throttled', 0):>5} {r['errors']:>4}", flush=True)
+        for e in r["error_samples"]: print(f"     {e}", flush=True)
+    with open(args.out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    print(args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
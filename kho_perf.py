@@ -0,0 +1,120 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Đo thời gian theo từng lượt chạy lại (rerun) của Streamlit: mỗi lượt là một RunStats gắn với luồng đang chạy script.
+# timed()/timed_fn() cộng thời gian vào lượt hiện tại (không có lượt nào thì không làm gì), count_api_calls() đếm
+# các request gửi tới Google Sheets. PerfLog giữ N lượt gần nhất cho bảng quản trị và (tùy chọn) ghi JSON-lines.
+_current = threading.local()
+
+
+class RunStats:
+    def __init__(self, label):
+        self.label = label
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.t0 = self.last = time.perf_counter()
+        self.timings = {}
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self.finished = False
+
+    def add(self, name, seconds):
+        total, count = self.timings.get(name, (0.0, 0))
+        self.timings[name] = (total + seconds, count + 1)
+        self.last = time.perf_counter()
+
+    def as_record(self, interrupted=False):
+        # Lượt bị cắt ngang (st.rerun/st.stop) chỉ tính đến sự kiện đo cuối cùng
+        end = self.last if interrupted else time.perf_counter()
+        return {"time": self.started_at, "label": self.label, "total_s": round(end - self.t0, 4),
+                "api_calls": self.api_calls, "api_s": round(self.api_seconds, 4), "interrupted": interrupted,
+                "timings": {k: {"s": round(v[0], 4), "n": v[1]} for k, v in
+                            sorted(self.timings.items(), key=lambda kv: -kv[1][0])}}
+
+
+def current_run():
+    return getattr(_current, "run", None)
+
+
+@contextmanager
+def timed(name):
+    run = current_run()
+    if run is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.add(name, time.perf_counter() - t)
+
+
+def timed_fn(name=None):
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with timed(label):
+                return fn(*args, **kwargs)
+
+        return inner
+
+    return wrap
+
+
+def count_api_calls(client):
+    # Bọc HTTP client của gspread (>= 6: client.http_client.request; bản cũ: client.request) để đếm số request
+    # và tổng thời gian chờ Google cho lượt đang chạy. Trả lại chính client.
+    target = getattr(client, "http_client", client)
+    request = getattr(target, "request", None)
+    if request is None or getattr(request, "_kho_counted", False): return client
+
+    @functools.wraps(request)
+    def counted(*args, **kwargs):
+        run = current_run()
+        t = time.perf_counter()
+        try:
+            return request(*args, **kwargs)
+        finally:
+            if run is not None:
+                run.api_calls += 1
+                run.api_seconds += time.perf_counter() - t
+                run.last = time.perf_counter()
+
+    counted._kho_counted = True
+    target.request = counted
+    return client
+
+
+class PerfLog:
+    # N lượt chạy gần nhất của cả tiến trình; path khác None thì mỗi lượt còn được ghi thêm một dòng JSON vào file
+    def __init__(self, maxlen=50, path=None):
+        self.path = path
+        self._runs = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def start(self, label, prev=None):
+        # Bắt đầu lượt mới cho luồng hiện tại; lượt trước của cùng phiên chưa đóng (bị st.rerun cắt) thì đóng luôn
+        if prev is not None and not prev.finished: self.finish(prev, interrupted=True)
+        run = _current.run = RunStats(label)
+        return run
+
+    def finish(self, run, interrupted=False):
+        if run.finished: return
+        run.finished = True
+        if getattr(_current, "run", None) is run: _current.run = None
+        record = run.as_record(interrupted)
+        with self._lock:
+            self._runs.append(record)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def recent(self, n=None):
+        with self._lock:
+            runs = list(self._runs)
+        return runs[-n:] if n else runs
@@ -0,0 +1,151 @@
+import functools
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from gspread.exceptions import APIError
+
+# Hạn mức Google Sheets API tính theo phút cho mỗi tài khoản dịch vụ, đọc và ghi tách riêng (mặc định 60/phút).
+# Giữ lại một ít cho các công cụ khác (CLI, API) dùng chung tài khoản.
+READ_PER_MINUTE = 55
+WRITE_PER_MINUTE = 55
+# Mã lỗi nên thử lại: hết quota (429) và lỗi tạm thời phía Google. Lệnh ghi chỉ thử lại khi 429 (chắc chắn chưa
+# được thực hiện): append không idempotent, sau 5xx Google có thể đã ghi rồi -> báo lỗi để nơi gọi đối chiếu trước
+RETRY_STATUS = (429, 500, 502, 503, 504)
+WRITE_RETRY_STATUS = (429,)
+# Không có timeout thì request treo mãi khi mất mạng; mất kết nối thì ngừng gọi Google trong OFFLINE_SECONDS giây
+REQUEST_TIMEOUT = 20
+OFFLINE_SECONDS = 30
+
+
+class Throttled(Exception):
+    # Hết hạn mức (hoặc đang chờ sau 429 / mất kết nối) lâu hơn mức chờ cho phép: không gửi request tới Google
+    pass
+
+
+class RateLimiter:
+    # Bọc HTTP client của gspread (client.http_client.request), dùng chung cho mọi phiên trong tiến trình:
+    #  - đếm request trong cửa sổ 60 giây, hết hạn mức thì chờ slot trống (đọc chờ tối đa read_wait giây, ghi
+    #    write_wait giây; lâu hơn thì báo Throttled để nơi gọi dùng dữ liệu cũ thay vì treo cả lượt chạy);
+    #  - gặp 429/5xx (lệnh ghi: chỉ 429) thì thử lại với backoff lũy thừa có jitter (full jitter), 429 còn chặn mọi
+    #    request khác cho tới hết thời gian chờ;
+    #  - các lệnh đọc (GET) giống hệt nhau đang chạy cùng lúc từ nhiều phiên gộp thành một request;
+    #  - mất kết nối (lỗi mạng/timeout) thì báo Throttled và chặn mọi request trong offline_seconds giây, để các lượt
+    #    chạy sau dùng ngay dữ liệu cũ/bản sao cục bộ thay vì chờ timeout lần nữa.
+    def __init__(self, read_per_minute=READ_PER_MINUTE, write_per_minute=WRITE_PER_MINUTE, read_wait=3.0,
+                 write_wait=60.0, retries=5, base=1.0, cap=32.0, offline_seconds=OFFLINE_SECONDS):
+        self.limits = {"read": read_per_minute, "write": write_per_minute}
+        self.read_wait, self.write_wait = read_wait, write_wait
+        self.retries, self.base, self.cap = retries, base, cap
+        self.offline_seconds = offline_seconds
+        self.blocked_until = 0.0
+        self.offline_until = 0.0
+        self._sent = {"read": deque(), "write": deque()}
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {"requests": 0, "coalesced": 0, "retries": 0, "throttled": 0, "offline": 0}
+
+    def budget(self, kind="read"):
+        # Số request còn được gửi trong cửa sổ 60 giây hiện tại
+        with self._lock:
+            self._expire(kind, time.monotonic())
+            return self.limits[kind] - len(self._sent[kind])
+
+    def offline(self):
+        return time.monotonic() < self.offline_until
+
+    def _expire(self, kind, now):
+        sent = self._sent[kind]
+        while sent and now - sent[0] >= 60: sent.popleft()
+
+    def _acquire(self, kind, max_wait):
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(kind, now)
+                sent = self._sent[kind]
+                wait = max(self.blocked_until - now, sent[0] + 60 - now if len(sent) >= self.limits[kind] else 0)
+                if wait <= 0:
+                    sent.append(now)
+                    self.stats["requests"] += 1
+                    return
+                if now + wait > deadline:
+                    self.stats["throttled"] += 1
+                    if now < self.offline_until: raise Throttled("Không kết nối được Google Sheets")
+                    raise Throttled(f"Hết hạn mức Google Sheets ({kind}), cần chờ {wait:.0f}s")
+            time.sleep(wait)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def _send(self, request, kind, args, kwargs):
+        max_wait = self.read_wait if kind == "read" else self.write_wait
+        for attempt in range(self.retries + 1):
+            self._acquire(kind, max_wait)
+            try:
+                return request(*args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                with self._lock:
+                    self.stats["offline"] += 1
+                    self.offline_until = time.monotonic() + self.offline_seconds
+                    self.blocked_until = max(self.blocked_until, self.offline_until)
+                raise Throttled("Không kết nối được Google Sheets") from e
+            except APIError as e:
+                status = getattr(e.response, "status_code", e.code)
+                retry_status = RETRY_STATUS if kind == "read" else WRITE_RETRY_STATUS
+                if status not in retry_status or attempt == self.retries: raise
+                delay = self.backoff(attempt)
+                with self._lock:
+                    self.stats["retries"] += 1
+                    if status == 429: self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+                if kind == "read" and delay > self.read_wait:
+                    raise Throttled(f"Google Sheets trả lỗi {status}, thử lại sau {delay:.0f}s") from e
+                time.sleep(delay)
+
+    def request(self, request, method, endpoint, params=None, **kwargs):
+        args, kwargs = (method, endpoint), dict(kwargs, params=params)
+        if str(method).lower() != "get" or kwargs.get("data") or kwargs.get("json"):
+            return self._send(request, "write", args, kwargs)
+        key = (endpoint, repr(params))
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader: call = self._inflight[key] = {"done": threading.Event(), "result": None, "error": None}
+            else: self.stats["coalesced"] += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None: raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = self._send(request, "read", args, kwargs)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+            call["done"].set()
+
+
+def rate_limited(client, limiter=None):
+    # Gắn RateLimiter vào client gspread (>= 6: client.http_client; bản cũ: chính client). Trả lại chính client.
+    target = getattr(client, "http_client", client)
+    request = getattr(target, "request", None)
+    if request is None or getattr(request, "_kho_limiter", None) is not None: return client
+    limiter = limiter or RateLimiter()
+    if getattr(target, "timeout", 0) is None: target.timeout = REQUEST_TIMEOUT
+
+    @functools.wraps(request)
+    def limited(method, endpoint, params=None, **kwargs):
+        return limiter.request(request, method, endpoint, params, **kwargs)
+
+    limited._kho_limiter = limiter
+    target.request = limited
+    return client
+
+
+def limiter_of(client):
+    return getattr(getattr(getattr(client, "http_client", client), "request", None), "_kho_limiter", None)
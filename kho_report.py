@@ -0,0 +1,110 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from kho_core import BALANCE_COLUMNS, BALANCE_SCHEMA, JOURNAL_COLUMNS, apply_schema, concat_frames
+
+REPORT_COLUMNS = ["Mã", "Tên", "Tồn đầu", "Nhập", "Xuất", "Tồn cuối"]
+# Loại của dòng số dư chốt sổ khi ghép vào nhật ký: chỉ cộng vào tồn, không tính là Nhập/Xuất
+BALANCE_LOAI = "SỐ DƯ"
+
+# Nhóm (bucket) của mỗi dòng nhật ký so với kỳ báo cáo [d1, d2]
+_TON_DAU, _NHAP, _XUAT = 0, 1, 2
+
+
+def build_xnt_report(df_g, df_t, d1, d2):
+    # Tính Tồn đầu / Nhập / Xuất / Tồn cuối cho mọi MaQua trong một lần groupby (MaQua × nhóm kỳ),
+    # thay cho vòng lặp iterrows quét toàn bộ nhật ký 3 lần cho mỗi món quà.
+    # Trả về đúng thứ tự & các cột như vòng lặp cũ để phần xuất Excel/PDF dùng lại được.
+    if df_t.empty or not {"Loai", "Ngay", "MaQua", "SoLuong"}.issubset(df_t.columns):
+        so_luong = pd.Series(dtype="int64")
+        pivot = pd.DataFrame(columns=[_TON_DAU, _NHAP, _XUAT], dtype="int64")
+    else:
+        df_t = apply_schema(df_t)  # không tốn gì nếu nhật ký đã được ép kiểu lúc tải
+        ngay = df_t['Ngay'].dt.normalize()
+        so_luong = df_t['SoLuong'].astype("int64")
+        t1, t2 = pd.Timestamp(d1), pd.Timestamp(d2)
+        in_ky = ((ngay >= t1) & (ngay <= t2)).to_numpy()
+        bucket = np.select([(ngay < t1).to_numpy(), in_ky & (df_t['Loai'] == "NHẬP").to_numpy(),
+                            in_ky & (df_t['Loai'] == "XUẤT").to_numpy()], [_TON_DAU, _NHAP, _XUAT], default=-1)
+        keep = bucket >= 0
+        pivot = so_luong[keep].groupby([df_t['MaQua'][keep], bucket[keep]], observed=True).sum().unstack(fill_value=0)
+        pivot = pivot.reindex(columns=[_TON_DAU, _NHAP, _XUAT], fill_value=0)
+
+    ma, ten = _catalog(df_g)
+    # Nhật ký đã ép MaQua về chuỗi (apply_schema); danh mục đọc qua GSheetsConnection có thể là số -> so khớp
+    # theo chuỗi, hiển thị vẫn dùng mã gốc
+    pivot = pivot.reindex(pd.Index(ma).astype(str), fill_value=0).astype(so_luong.dtype)
+    return _report_frame(ma, ten, pivot[_TON_DAU].to_numpy(), pivot[_NHAP].to_numpy(), np.abs(pivot[_XUAT].to_numpy()))
+
+
+def xnt_report_from_index(df_g, index, d1, d2):
+    # Cùng kết quả với build_xnt_report nhưng lấy số liệu từ kho_core.BalanceIndex đã dựng sẵn:
+    # mỗi món quà chỉ tốn hai lần tra bisect, không đụng tới các dòng nhật ký.
+    ma, ten = _catalog(df_g)
+    return _report_frame(ma, ten, *index.period(ma, d1, d2))
+
+
+def _catalog(df_g):
+    return (df_g.get('MaQua', pd.Series(dtype=object)).to_numpy(),
+            df_g.get('TenQua', pd.Series(dtype=object)).to_numpy())
+
+
+def _report_frame(ma, ten, t_dau, nhap, xuat):
+    return pd.DataFrame({"Mã": ma, "Tên": ten, "Tồn đầu": t_dau, "Nhập": nhap, "Xuất": xuat,
+                         "Tồn cuối": t_dau + nhap - xuat}, columns=REPORT_COLUMNS)
+
+
+def closing_dates(df_sd):
+    # Các ngày đã chốt sổ, tăng dần
+    if df_sd.empty or "NgayChot" not in df_sd.columns: return []
+    return sorted(apply_schema(df_sd, BALANCE_SCHEMA)['NgayChot'].dropna().unique())
+
+
+def balance_as_journal(df_sd, ngay_chot=None):
+    # Số dư của lần chốt `ngay_chot` (mặc định: lần gần nhất) dưới dạng các dòng nhật ký đề ngày chốt,
+    # để tồn kho/báo cáo cứ cộng "số dư + các dòng còn mở" như với một nhật ký bình thường.
+    dates = closing_dates(df_sd)
+    if not dates: return apply_schema(pd.DataFrame(columns=JOURNAL_COLUMNS))
+    df_sd = apply_schema(df_sd, BALANCE_SCHEMA)
+    sd = df_sd[df_sd['NgayChot'] == (dates[-1] if ngay_chot is None else pd.Timestamp(ngay_chot))]
+    return apply_schema(pd.DataFrame({
+        "Loai": BALANCE_LOAI, "Ngay": sd['NgayChot'].to_numpy(), "MaQua": sd['MaQua'].astype(str).to_numpy(),
+        "TenQua": sd.get('TenQua', pd.Series("", index=sd.index)).to_numpy(), "SoLuong": sd['SoLuong'].to_numpy(),
+        "SoChungTu": "CHỐT SỔ", "NguoiThucHien": "", "GhiChu": ""}, columns=JOURNAL_COLUMNS))
+
+
+def close_period(df_t, df_sd, ngay_chot):
+    # Chốt sổ đến hết ngày `ngay_chot`. Trả về (các dòng chuyển vào lưu trữ, các dòng còn lại trong nhật ký,
+    # số dư mới theo MaQua = số dư lần chốt trước + các dòng vừa chốt). Dòng không đọc được ngày để lại nhật ký.
+    df_t = apply_schema(df_t)
+    chot = pd.Timestamp(ngay_chot)
+    closed_mask = np.zeros(len(df_t), bool)
+    if 'Ngay' in df_t.columns: closed_mask = (df_t['Ngay'].dt.normalize() <= chot).to_numpy()
+    closed, live = df_t[closed_mask].reset_index(drop=True), df_t[~closed_mask].reset_index(drop=True)
+    both = concat_frames([balance_as_journal(df_sd), closed])
+    if both.empty:
+        return closed, live, pd.DataFrame(columns=BALANCE_COLUMNS)
+    by_ma = both.groupby(both['MaQua'].astype(str))
+    bal = pd.DataFrame({"SoLuong": by_ma['SoLuong'].sum().astype("int64"), "TenQua": by_ma['TenQua'].last()})
+    return closed, live, pd.DataFrame({"NgayChot": chot, "MaQua": bal.index, "TenQua": bal['TenQua'].to_numpy(),
+                                       "SoLuong": bal['SoLuong'].to_numpy()}, columns=BALANCE_COLUMNS)
+
+
+def _row_keys(df):
+    df = apply_schema(df.reindex(columns=JOURNAL_COLUMNS, fill_value=""))
+    ngay = df['Ngay'].dt.strftime("%Y-%m-%d %H:%M:%S").fillna("")
+    return list(zip(ngay, *(df[c].astype(str) for c in JOURNAL_COLUMNS if c != "Ngay")))
+
+
+def unarchived_rows(closed, df_a):
+    # Các dòng của `closed` chưa có trong sheet lưu trữ df_a (so mọi cột, tính cả số lần lặp): lần chốt sổ trước lỗi
+    # giữa chừng có thể đã ghi một phần, chốt lại thì chỉ ghi phần còn thiếu
+    have = Counter(_row_keys(df_a)) if not df_a.empty else Counter()
+    keep = np.ones(len(closed), bool)
+    for i, k in enumerate(_row_keys(closed) if len(closed) else []):
+        if have[k] > 0:
+            have[k] -= 1
+            keep[i] = False
+    return closed[keep].reset_index(drop=True)
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from kho_report import REPORT_COLUMNS
+
+GIFT_COLUMNS = ["MaQua", "TenQua"]
+TRANS_COLUMNS = ["Loai", "Ngay", "Gio", "SoChungTu", "MaQua", "TenQua", "SoLuong", "NguoiThucHien", "GhiChu"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS danhmuc_qua (
+    MaQua TEXT PRIMARY KEY,
+    TenQua TEXT
+);
+CREATE TABLE IF NOT EXISTS nhatky_xuatnhap (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    Loai TEXT, Ngay TEXT, Gio TEXT, SoChungTu TEXT, MaQua TEXT, TenQua TEXT,
+    SoLuong INTEGER NOT NULL DEFAULT 0, NguoiThucHien TEXT, GhiChu TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_nhatky_maqua ON nhatky_xuatnhap (MaQua, SoLuong);
+CREATE INDEX IF NOT EXISTS idx_nhatky_ngay ON nhatky_xuatnhap (Ngay);
+"""
+
+_XNT_SQL = """
+WITH agg AS (
+    SELECT MaQua,
+           SUM(CASE WHEN Ngay < :d1 THEN SoLuong ELSE 0 END) AS t_dau,
+           SUM(CASE WHEN Loai = 'NHẬP' AND Ngay >= :d1 THEN SoLuong ELSE 0 END) AS nhap,
+           SUM(CASE WHEN Loai = 'XUẤT' AND Ngay >= :d1 THEN SoLuong ELSE 0 END) AS xuat
+    FROM nhatky_xuatnhap
+    WHERE Ngay <= :d2
+    GROUP BY MaQua
+)
+SELECT g.MaQua, g.TenQua, COALESCE(a.t_dau, 0), COALESCE(a.nhap, 0), ABS(COALESCE(a.xuat, 0))
+FROM danhmuc_qua g LEFT JOIN agg a ON a.MaQua = g.MaQua
+ORDER BY g.rowid
+"""
+
+
+def connect(db_path):
+    con = sqlite3.connect(db_path, timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
+def _gift_values(df):
+    df = df.reindex(columns=GIFT_COLUMNS).fillna("").astype(str)
+    return df[df["MaQua"].str.strip() != ""].values.tolist()
+
+
+def _trans_values(df):
+    df = df.reindex(columns=TRANS_COLUMNS)
+    ngay = pd.to_datetime(df["Ngay"], errors="coerce")
+    df["Ngay"] = ngay.dt.strftime("%Y-%m-%d").where(ngay.notna(), df["Ngay"])
+    df["SoLuong"] = pd.to_numeric(df["SoLuong"], errors="coerce").fillna(0).astype("int64")
+    text_cols = [c for c in TRANS_COLUMNS if c != "SoLuong"]
+    df[text_cols] = df[text_cols].fillna("").astype(str)
+    return [tuple(r) for r in df.astype(object).itertuples(index=False)]
+
+
+def _insert(con, table, df):
+    # Trả về số dòng đã ghi (danh mục bỏ qua dòng thiếu mã và mã đã có/trùng trong df)
+    if table == "danhmuc_qua":
+        return con.executemany("INSERT OR IGNORE INTO danhmuc_qua (MaQua, TenQua) VALUES (?, ?)",
+                               _gift_values(df)).rowcount
+    return con.executemany(f"INSERT INTO nhatky_xuatnhap ({', '.join(TRANS_COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(TRANS_COLUMNS))})", _trans_values(df)).rowcount
+
+
+def init_db(db_path, gifts_csv=None, trans_csv=None):
+    # Tạo bảng/chỉ mục; lần đầu tiên thì nhập một lần dữ liệu từ các file CSV cũ (nếu có)
+    with closing(connect(db_path)) as con, con:
+        con.executescript(_SCHEMA)
+        if con.execute("PRAGMA user_version").fetchone()[0] == 0:
+            _import_csv(con, gifts_csv, trans_csv)
+            con.execute("PRAGMA user_version = 1")
+
+
+def import_csv(db_path, gifts_csv, trans_csv):
+    with closing(connect(db_path)) as con, con:
+        _import_csv(con, gifts_csv, trans_csv)
+
+
+def _import_csv(con, gifts_csv, trans_csv):
+    if gifts_csv and os.path.exists(gifts_csv):
+        _insert(con, "danhmuc_qua", pd.read_csv(gifts_csv, dtype=str))
+    if trans_csv and os.path.exists(trans_csv):
+        _insert(con, "nhatky_xuatnhap", pd.read_csv(trans_csv, dtype={"MaQua": str, "SoChungTu": str}))
+
+
+def read_gifts(db_path):
+    with closing(connect(db_path)) as con:
+        return pd.read_sql_query("SELECT MaQua, TenQua FROM danhmuc_qua ORDER BY rowid", con)
+
+
+def read_trans(db_path):
+    with closing(connect(db_path)) as con:
+        return pd.read_sql_query(f"SELECT {', '.join(TRANS_COLUMNS)} FROM nhatky_xuatnhap ORDER BY id", con)
+
+
+def add_transaction(db_path, row, new_gift=None):
+    # Ghi một dòng nhật ký (và quà mới nếu có) trong cùng một giao dịch
+    add_transactions(db_path, [row], [new_gift] if new_gift else ())
+
+
+def add_transactions(db_path, rows, new_gifts=()):
+    # Nhiều dòng nhật ký (vd. cả một phiếu, hoặc một lô gom từ nhiều yêu cầu) trong một giao dịch
+    with closing(connect(db_path)) as con, con:
+        _insert(con, "nhatky_xuatnhap", pd.DataFrame(list(rows)))
+        if new_gifts: _insert(con, "danhmuc_qua", pd.DataFrame(list(new_gifts)))
+
+
+def replace_table(db_path, table, df):
+    # Trả về số dòng của df không được ghi (vd. mã quà trùng)
+    with closing(connect(db_path)) as con, con:
+        con.execute(f"DELETE FROM {table}")
+        return len(df) - _insert(con, table, df)
+
+
+def get_stock(db_path, ma_qua):
+    with closing(connect(db_path)) as con:
+        return con.execute("SELECT COALESCE(SUM(SoLuong), 0) FROM nhatky_xuatnhap WHERE MaQua = ?",
+                           (str(ma_qua),)).fetchone()[0]
+
+
+def get_stocks(db_path, ma_list):
+    # Tồn của nhiều mã trong một truy vấn (cùng một lần đọc)
+    ma_list = [str(m) for m in ma_list]
+    if not ma_list: return {}
+    with closing(connect(db_path)) as con:
+        rows = con.execute(f"SELECT MaQua, COALESCE(SUM(SoLuong), 0) FROM nhatky_xuatnhap "
+                           f"WHERE MaQua IN ({', '.join('?' * len(ma_list))}) GROUP BY MaQua", ma_list).fetchall()
+    return {**dict.fromkeys(ma_list, 0), **dict(rows)}
+
+
+def xnt_report(db_path, d1, d2):
+    with closing(connect(db_path)) as con:
+        rows = con.execute(_XNT_SQL, {"d1": d1.isoformat(), "d2": d2.isoformat()}).fetchall()
+    df = pd.DataFrame(rows, columns=REPORT_COLUMNS[:-1])
+    df["Tồn cuối"] = df["Tồn đầu"] + df["Nhập"] - df["Xuất"]
+    return df
+
+
+def save_replica(db_path, sheet_name, df):
+    # Bản sao cục bộ của một worksheet Google (bảng gs_<tên sheet>, mọi cột dạng chuỗi), đọc lại bằng load_replica
+    # khi không kết nối được Google
+    with closing(connect(db_path)) as con, con:
+        df.astype(str).to_sql(f"gs_{sheet_name}", con, if_exists="replace", index=False)
+
+
+def load_replica(db_path, sheet_name):
+    # None nếu sheet chưa từng được sao lưu
+    with closing(connect(db_path)) as con:
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                       (f"gs_{sheet_name}",)).fetchone() is None:
+            return None
+        return pd.read_sql_query(f'SELECT * FROM "gs_{sheet_name}"', con)
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import pandas as pd
+
+# Mỗi dòng enqueue được gắn một mã riêng ở cột ẩn SYNC_ID (ghi cùng dòng lên sheet) để đối chiếu WAL với sheet;
+# dòng trong WAL cũ chưa có mã thì so theo SYNC_KEYS
+SYNC_ID = "MaGhi"
+SYNC_KEYS = ("Ngay", "MaQua", "SoLuong", "SoChungTu", "NguoiThucHien")
+
+# Hàng đợi ghi sau (write-behind) dùng chung cho mọi phiên: phiên nhập liệu chỉ xếp dòng vào hàng đợi và nhận xác
+# nhận ngay, một luồng nền gom dòng của mọi phiên và ghi bằng một lệnh flush_fn(rows) sau `wait` giây kể từ dòng
+# đầu tiên đang chờ (hoặc ngay khi đủ max_rows dòng). Các dòng mỗi lần enqueue (vd. một phiếu nhiều dòng) luôn nằm
+# chung một lần ghi.
+# wal_path: nhật ký ghi trước (JSON-lines, mỗi dòng file là một lần enqueue, fsync trước khi xác nhận) chứa mọi dòng
+# chưa ghi xong; mất kết nối thì dòng nằm lại đó và được thử lại với thời gian chờ tăng dần, khởi động lại thì nạp lại.
+# Lô có thể đã tới đích dù báo lỗi (hoặc nạp lại từ WAL) được lọc qua reconcile_fn(rows) -> rows còn thiếu trước khi ghi.
+class WriteBehind:
+    def __init__(self, flush_fn, wal_path=None, wait=1.0, max_rows=500, retry_max=60.0, reconcile_fn=None):
+        self.flush_fn, self.wal_path, self.reconcile_fn = flush_fn, wal_path, reconcile_fn
+        self.wait, self.max_rows, self.retry_max = wait, max_rows, retry_max
+        self.last_error = None
+        self.failures = 0
+        self._errors = 0
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._inflight = []
+        self._retry_at = 0.0
+        self._urgent = False
+        self._thread = None
+        self._uncertain = False
+        if wal_path and os.path.exists(wal_path):
+            with open(wal_path, encoding="utf-8") as f:
+                self._queue.extend(json.loads(line) for line in f if line.strip())
+            if self._queue:
+                self._uncertain = True
+                self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def enqueue(self, rows):
+        unit = uuid.uuid4().hex[:16]
+        rows = [{**r, SYNC_ID: r.get(SYNC_ID) or f"{unit}-{i}"} for i, r in enumerate(rows)]
+        if not rows: return
+        with self._cond:
+            if self.wal_path:
+                with open(self.wal_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rows, ensure_ascii=False, default=str) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._queue.append(rows)
+            self._start()
+            self._cond.notify_all()
+
+    def pending_rows(self):
+        # Các dòng chưa ghi xong (đang ghi + đang chờ), theo thứ tự enqueue
+        with self._cond:
+            return [r for unit in list(self._inflight) + list(self._queue) for r in unit]
+
+    def pending_qty(self, ma_list=None):
+        # Tổng SoLuong đang chờ theo MaQua, cộng vào tồn kho đã ghi để tra tồn thấy ngay các giao dịch vừa nhập
+        wanted = None if ma_list is None else {str(m) for m in ma_list}
+        out = {}
+        for r in self.pending_rows():
+            ma = str(r["MaQua"])
+            if wanted is None or ma in wanted: out[ma] = out.get(ma, 0) + int(float(r.get("SoLuong") or 0))
+        return out
+
+    def drain(self, timeout=60):
+        # Ghi ngay mọi dòng đang chờ (bỏ qua thời gian chờ giữa các lần thử lại). False nếu lần ghi lỗi hoặc hết giờ.
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            errors = self._errors
+            self._urgent = True
+            self._cond.notify_all()
+            while self._queue or self._inflight:
+                left = deadline - time.monotonic()
+                if self._errors != errors or left <= 0: return False
+                self._cond.wait(left)
+            return True
+
+    def _n_queued(self):
+        return sum(map(len, self._queue))
+
+    def _take(self):
+        units, n = [], 0
+        while self._queue and (not units or n + len(self._queue[0]) <= self.max_rows):
+            units.append(self._queue.popleft())
+            n += len(units[-1])
+        return units
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue: self._cond.wait()
+                first = time.monotonic()
+                while not self._urgent:
+                    now = time.monotonic()
+                    due = max(first + self.wait, self._retry_at)
+                    if now >= due or (now >= self._retry_at and self._n_queued() >= self.max_rows): break
+                    self._cond.wait(due - now)
+                self._inflight = self._take()
+                uncertain = self._uncertain
+            rows = [r for unit in self._inflight for r in unit]
+            try:
+                if uncertain and self.reconcile_fn: rows = self.reconcile_fn(rows)
+                if rows: self.flush_fn(rows)
+                error = None
+            except Exception as e:
+                error = e
+            with self._cond:
+                if error is None:
+                    self.failures = 0
+                    self._retry_at = 0.0
+                    self._uncertain = False
+                else:
+                    self._uncertain = True
+                    self._queue.extendleft(reversed(self._inflight))
+                    self.failures += 1
+                    self._errors += 1
+                    self.last_error = error
+                    self._retry_at = time.monotonic() + min(self.retry_max, 2 ** self.failures)
+                self._inflight = []
+                if error is not None or not self._queue: self._urgent = False
+                if error is None: self._compact()
+                self._cond.notify_all()
+
+    def _compact(self):
+        # Bỏ khỏi WAL các dòng đã ghi xong: ghi lại phần còn chờ ra file tạm rồi đổi tên (tiến trình chết giữa chừng
+        # vẫn còn nguyên file cũ); hàng đợi rỗng thì xóa file
+        if not self.wal_path: return
+        if not self._queue:
+            if os.path.exists(self.wal_path): os.remove(self.wal_path)
+            return
+        tmp = self.wal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for unit in self._queue: f.write(json.dumps(unit, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.wal_path)
+
+
+def _sync_key(ngay, ma, so, so_ct, nguoi):
+    return str(ngay)[:10], str(ma), int(float(so or 0)), str(so_ct), str(nguoi)
+
+
+def unsynced_rows(rows, df_t):
+    # Các dòng trong `rows` chưa có trong nhật ký df_t: theo SYNC_ID nếu dòng có mã (hai dòng giống hệt nhau từ hai lần
+    # enqueue vẫn là hai dòng), không thì so theo SYNC_KEYS, tính cả số lần lặp (hai dòng giống hệt nhau trong rows mà
+    # df_t mới có một thì còn thiếu một)
+    ids, have = set(), Counter()
+    if not df_t.empty and SYNC_ID in df_t.columns: ids = set(df_t[SYNC_ID].astype(str)) - {""}
+    if not df_t.empty and set(SYNC_KEYS).issubset(df_t.columns):
+        ngay = pd.to_datetime(df_t['Ngay'], errors="coerce").dt.strftime("%Y-%m-%d")
+        have.update(_sync_key(*v) for v in zip(ngay, *(df_t[c] for c in SYNC_KEYS[1:])))
+    out = []
+    for r in rows:
+        if r.get(SYNC_ID):
+            if str(r[SYNC_ID]) not in ids: out.append(r)
+            continue
+        k = _sync_key(*(r.get(c, "") for c in SYNC_KEYS))
+        if have[k] > 0:
+            have[k] -= 1
+        else:
+            out.append(r)
+    return out
@@ -0,0 +1,35 @@
+import re
+import unicodedata
+
+import pandas as pd
+
+from kho_core import no_accent_series, no_accent_vietnamese
+
+# Mọi nguyên âm tiếng Việt với đủ 6 thanh (không dấu, huyền, sắc, hỏi, ngã, nặng), thường và hoa, cùng đ/Đ
+TONES = ["", "̀", "́", "̉", "̃", "̣"]
+LETTERS = [unicodedata.normalize("NFC", v + t) for v in "aăâeêioôơuưy" for t in TONES]
+LETTERS += [c.upper() for c in LETTERS] + ["đ", "Đ"]
+
+
+def regex_no_accent(s):
+    # Cài đặt cũ (14 lượt re.sub) mà no_accent_vietnamese thay thế
+    s = str(s)
+    patterns = {'[àáạảãâầấậẩẫăằắặẳẵ]': 'a', '[èéẹẻẽêềếệểễ]': 'e', '[òóọỏõôồốộổỗơờớợởỡ]': 'o', '[ìíịỉĩ]': 'i',
+                '[ùúụủũưừứựửữ]': 'u', '[ỳýỵỷỹ]': 'y', '[đ]': 'd'}
+    for p, r in patterns.items():
+        s = re.sub(p, r, s)
+        s = re.sub(p.upper(), r.upper(), s)
+    return s
+
+
+def test_every_letter_matches_regex_implementation():
+    assert len(LETTERS) == 146 and all(len(c) == 1 for c in LETTERS)
+    for c in LETTERS:
+        assert no_accent_vietnamese(c) == regex_no_accent(c), c
+    assert "".join(map(no_accent_vietnamese, LETTERS)).isascii()
+
+
+def test_series_matches_regex_implementation():
+    values = ["".join(LETTERS), "Quà Tặng VƯỜN XUÂN", "Đèn lồng đỏ", "", "QT0001", 12]
+    out = no_accent_series(pd.Series(values))
+    assert out.tolist() == [regex_no_accent(v) for v in values]
@@ -0,0 +1,68 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import kho_gsheet
+import kho_sqlite
+from kho_api import SheetStore, SqliteStore, make_server
+from kho_core import JOURNAL_COLUMNS
+from kho_fakesheets import FakeBackend, FakeClient
+from kho_gsheet import SHARD_DIRECTORY, frame_from_values, is_shard
+
+GIFTS = [{"MaQua": "QT0001", "TenQua": "Hoa"}, {"MaQua": "QT0002", "TenQua": "Bánh"}]
+OPENING = {"Loai": "NHẬP", "Ngay": "2025-01-02", "MaQua": "QT0001", "TenQua": "Hoa", "SoLuong": 10,
+           "SoChungTu": "PN1", "NguoiThucHien": "", "GhiChu": ""}
+
+
+def sqlite_store(tmp_path, monkeypatch):
+    db = str(tmp_path / "kho.db")
+    kho_sqlite.init_db(db)
+    kho_sqlite.add_transactions(db, [OPENING], GIFTS)
+    return SqliteStore(db), lambda: len(kho_sqlite.read_trans(db)), lambda: SqliteStore(db)
+
+
+def sheet_store(tmp_path, monkeypatch):
+    # Shard nhỏ để các lô ghi đồng thời đi qua cả bước đóng shard
+    monkeypatch.setattr(kho_gsheet, "SHARD_MAX_ROWS", 4)
+    backend = FakeBackend({"danhmuc_qua": [["MaQua", "TenQua"]] + [list(g.values()) for g in GIFTS],
+                           "nhatky_xuatnhap": [JOURNAL_COLUMNS, [str(OPENING[c]) for c in JOURNAL_COLUMNS]]})
+
+    def n_rows():
+        shards = frame_from_values(backend.sheets[SHARD_DIRECTORY])['Shard'].tolist()
+        assert len(shards) > 1 and all(is_shard("nhatky_xuatnhap", s) for s in shards)
+        return sum(len(backend.sheets[s]) - 1 for s in shards)
+
+    return (SheetStore(FakeClient(backend).open_by_key("test")), n_rows,
+            lambda: SheetStore(FakeClient(backend).open_by_key("test")))
+
+
+def post(port, body):
+    req = urllib.request.Request(f"http://127.0.0.1:{port}/giaodich", json.dumps(body).encode("utf-8"),
+                                 {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp: return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+@pytest.mark.parametrize("make_store", [sqlite_store, sheet_store])
+def test_concurrent_issues_never_oversell(tmp_path, monkeypatch, make_store):
+    store, n_rows, reopen = make_store(tmp_path, monkeypatch)
+    server = make_server(store, port=0, wait=0.01)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        bodies = [{"Loai": "XUẤT", "SoChungTu": f"PX{i}", "Ngay": "2025-02-01",
+                   "lines": [{"MaQua": "QT0001", "SoLuong": 1}]} for i in range(30)]
+        with ThreadPoolExecutor(16) as ex: codes = list(ex.map(lambda b: post(port, b), bodies))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert codes.count(200) == 10 and codes.count(409) == 20
+    assert store.stock(["QT0001", "QT0002"]) == {"QT0001": 0, "QT0002": 0}
+    assert reopen().stock(["QT0001", "QT0002"]) == {"QT0001": 0, "QT0002": 0}
+    assert n_rows() == 11
@@ -0,0 +1,39 @@
+from datetime import date
+
+from kho_cli import load_all
+from kho_core import JOURNAL_COLUMNS, BalanceIndex
+from kho_fakesheets import FakeBackend, FakeClient
+from kho_report import xnt_report_from_index
+
+
+def _row(ngay, ma, sl, so_ct):
+    return ["NHẬP" if sl > 0 else "XUẤT", ngay, ma, "Hoa", str(sl), so_ct, "", ""]
+
+
+def _spreadsheet():
+    # Hai lần chốt sổ; nhatky_2025 chỉ còn các dòng sau lần chốt đầu (dữ liệu trước đó chỉ còn trong số dư)
+    return FakeClient(FakeBackend({
+        "danhmuc_qua": [["MaQua", "TenQua"], ["QT0001", "Hoa"]],
+        "sodu_chotso": [["NgayChot", "MaQua", "TenQua", "SoLuong"], ["2025-01-31", "QT0001", "Hoa", "100"],
+                        ["2025-02-28", "QT0001", "Hoa", "90"]],
+        "nhatky_2025": [JOURNAL_COLUMNS, _row("2025-02-10", "QT0001", -10, "PX1")],
+        "nhatky_xuatnhap": [JOURNAL_COLUMNS, _row("2025-03-05", "QT0001", 5, "PN2")]})).open_by_key("test")
+
+
+def _report(history, df_g, d1, d2):
+    idx = BalanceIndex()
+    idx.rebuild(history)
+    return xnt_report_from_index(df_g, idx, d1, d2).iloc[0][["Tồn đầu", "Nhập", "Xuất", "Tồn cuối"]].tolist()
+
+
+def test_history_starts_from_latest_balance():
+    df_g, live, df_sd, history, df_dir = load_all(_spreadsheet())
+    assert len(live) == 1 and len(df_sd) == 2 and df_dir['Shard'].tolist() == ["nhatky_xuatnhap"]
+    assert int(history['SoLuong'].sum()) == 95
+    assert _report(history, df_g, date(2025, 3, 1), date(2025, 3, 31)) == [90, 5, 0, 95]
+
+
+def test_history_before_latest_close_uses_earlier_balance_and_archive():
+    df_g, _, _, history, _ = load_all(_spreadsheet(), date(2025, 2, 1))
+    assert _report(history, df_g, date(2025, 2, 1), date(2025, 2, 28)) == [100, 0, 10, 90]
+    assert _report(history, df_g, date(2025, 2, 1), date(2025, 3, 31)) == [100, 5, 10, 95]
@@ -0,0 +1,29 @@
+import pandas as pd
+
+from kho_core import JOURNAL_COLUMNS
+from kho_import import REJECT_COLUMN, validate_import
+
+DF_G = pd.DataFrame({"MaQua": ["QT0001", "QT0002"], "TenQua": ["Hoa", "Bánh"]})
+
+
+def _file(rows):
+    return pd.DataFrame(rows, columns=["Loai", "Ngay", "MaQua", "SoLuong", "SoChungTu"]).astype(str)
+
+
+def test_multi_line_voucher_is_accepted():
+    ok, rejected = validate_import(_file([["NHẬP", "2025-03-01", "QT0001", 5, "PN1"],
+                                          ["NHẬP", "2025-03-01", "QT0002", 3, "PN1"]]),
+                                   DF_G, pd.DataFrame(columns=JOURNAL_COLUMNS))
+    assert len(ok) == 2 and rejected.empty
+
+
+def test_voucher_number_reused_by_another_voucher_is_rejected():
+    ok, rejected = validate_import(_file([["NHẬP", "2025-03-01", "QT0001", 5, "PN1"],
+                                          ["NHẬP", "2025-03-02", "QT0002", 3, "PN1"],
+                                          ["NHẬP", "2025-03-02", "QT0002", 3, "PN2"],
+                                          ["XUAT", "2025-03-02", "QT0002", 1, "PN2"],
+                                          ["NHẬP", "2025-03-02", "QT0001", 2, "PN3"]]),
+                                   DF_G, pd.DataFrame(columns=JOURNAL_COLUMNS))
+    assert ok['SoChungTu'].tolist() == ["PN3"]
+    assert rejected['Dong'].tolist() == [2, 3, 4, 5]
+    assert rejected[REJECT_COLUMN].str.contains("SoChungTu trùng với phiếu khác").all()
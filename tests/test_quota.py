@@ -0,0 +1,56 @@
+import pytest
+from gspread.exceptions import APIError
+
+from kho_quota import RateLimiter, rate_limited
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ""
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": "lỗi", "status": "x"}}
+
+
+class _Http:
+    # Trả lỗi `status` cho `fail` lần gọi đầu, sau đó thành công
+    def __init__(self, status, fail):
+        self.status, self.fail, self.calls = status, fail, 0
+        self.timeout = 20
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        self.calls += 1
+        if self.calls <= self.fail: raise APIError(_Response(self.status))
+        return "ok"
+
+
+class _Client:
+    def __init__(self, http):
+        self.http_client = http
+
+
+def _limited(status, fail):
+    http = _Http(status, fail)
+    client = rate_limited(_Client(http), RateLimiter(base=0.01, cap=0.01))
+    return http, client.http_client
+
+
+def test_write_not_retried_on_5xx():
+    # append không idempotent: Google có thể đã ghi dù trả 503, thử lại mù sẽ nhân đôi dòng
+    http, c = _limited(503, 1)
+    with pytest.raises(APIError):
+        c.request("post", "values:append", json={"values": [["a"]]})
+    assert http.calls == 1
+
+
+def test_write_retried_on_429():
+    http, c = _limited(429, 2)
+    assert c.request("post", "values:append", json={"values": [["a"]]}) == "ok"
+    assert http.calls == 3
+
+
+def test_read_retried_on_5xx():
+    http, c = _limited(503, 2)
+    assert c.request("get", "values", params={"range": "A1"}) == "ok"
+    assert http.calls == 3
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from kho_core import GiftSearchIndex, no_accent_vietnamese
+
+GIFTS = pd.DataFrame({"MaQua": ["AB12", "QT0010", "QT0001", "QT0002", "QT0003"],
+                      "TenQua": ["Áo thun", "Hoa Đào", "Bánh Tết", "Trà sen", "Mứt gừng"]})
+
+
+def test_short_substrings_found_anywhere():
+    idx = GiftSearchIndex(GIFTS)
+    assert idx.search("12") == [0]
+    assert set(idx.search("ao")) == {0, 1}  # "Áo" (đầu từ) và "Hoa Đào" (giữa từ)
+    assert idx.search("t") != []
+
+
+def test_substring_hits_match_str_contains():
+    # Mọi món str.contains (bỏ dấu) tìm được thì chỉ mục cũng tìm được
+    idx = GiftSearchIndex(GIFTS)
+    keys = (GIFTS['MaQua'] + " " + GIFTS['TenQua']).map(no_accent_vietnamese).str.lower()
+    for q in ["a", "12", "ao", "en", "qt0", "sen", "ung", "hoa dao"]:
+        expected = set(keys.index[keys.str.contains(q, regex=False)])
+        assert set(idx.search(q, limit=len(GIFTS))) == expected, q
+
+
+def test_fuzzy_hits_kept_separate():
+    idx = GiftSearchIndex(GIFTS)
+    assert idx.search("qt001") == [1]  # QT0010: mã bắt đầu bằng từ khóa
+    fz = idx.fuzzy("qt001")
+    assert 1 not in fz and fz[0] == 2  # QT0001 trùng nhiều trigram nhất
+    assert idx.search("qt0009") == []
+    assert idx.fuzzy("qt0009") != []
@@ -0,0 +1,23 @@
+import io
+
+import pandas as pd
+
+import kho_sqlite
+
+
+def test_replace_gifts_reports_ignored_rows(tmp_path):
+    db = str(tmp_path / "kho.db")
+    kho_sqlite.init_db(db)
+    csv = io.StringIO("MaQua,TenQua\n0012,Hoa\n0012,Hoa trùng\n,Thiếu mã\n0013,Bánh\n")
+    df = pd.read_csv(csv, dtype={"MaQua": str, "SoChungTu": str})
+    assert kho_sqlite.replace_table(db, "danhmuc_qua", df) == 2
+    assert kho_sqlite.read_gifts(db).values.tolist() == [["0012", "Hoa"], ["0013", "Bánh"]]
+
+
+def test_replace_journal_keeps_every_row(tmp_path):
+    db = str(tmp_path / "kho.db")
+    kho_sqlite.init_db(db)
+    row = {"Loai": "NHẬP", "Ngay": "2025-03-01", "MaQua": "0012", "TenQua": "Hoa", "SoLuong": 5, "SoChungTu": "007"}
+    assert kho_sqlite.replace_table(db, "nhatky_xuatnhap", pd.DataFrame([row, row])) == 0
+    assert kho_sqlite.get_stocks(db, ["0012"]) == {"0012": 10}
+    assert kho_sqlite.read_trans(db)['SoChungTu'].tolist() == ["007", "007"]
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from kho_writeback import SYNC_ID, WriteBehind, unsynced_rows
+
+ROW = {"Loai": "XUẤT", "Ngay": "2025-03-01", "MaQua": "QT0001", "TenQua": "Hoa", "SoLuong": -1, "SoChungTu": "PX1",
+       "NguoiThucHien": "Lan (1)", "GhiChu": ""}
+
+
+def test_identical_rows_from_separate_enqueues_are_matched_by_id():
+    # Hai lần bấm ghi cùng một nội dung: lần đầu đã lên sheet, lần sau vẫn phải được ghi
+    wb = WriteBehind(lambda rows: None, wait=60)
+    wb.enqueue([ROW])
+    wb.enqueue([ROW])
+    first, second = wb.pending_rows()
+    assert first[SYNC_ID] != second[SYNC_ID]
+    assert unsynced_rows([first, second], pd.DataFrame([first])) == [second]
+    assert unsynced_rows([first, second], pd.DataFrame([first, second])) == []
+
+
+def test_rows_without_id_fall_back_to_content():
+    # Dòng trong WAL cũ (trước khi có SYNC_ID)
+    assert unsynced_rows([ROW, ROW], pd.DataFrame([ROW])) == [ROW]
+    assert unsynced_rows([ROW], pd.DataFrame([dict(ROW, SoLuong=-2)])) == [ROW]